@@ -1,17 +1,66 @@
 import os
-from fastapi import FastAPI, File, UploadFile, Request
-import psycopg2
+import asyncio
+import hmac
+import json
+import math
+from contextlib import asynccontextmanager
+from typing import Optional
+from fastapi import FastAPI, File, UploadFile, Request, Response, Query
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from starlette.background import BackgroundTask
 from dotenv import load_dotenv
 from models.RegistrationModel import RegistrationModel
 from models.Login import Login
 from models.ChatQueryModel import ChatQueryModel
+from models.BatchChatQueryModel import BatchChatQueryModel
 from db.blob_storage import BlobStorageDatabase
-from rag.QueryResponseGenerator import QueryResponseGenerator
-# from rag.PdfDataIngestor import DataIngestor #final testing pending to create index via api
+from db.postgres_database import PostgresDatabase
+from db.user_auth import UserAuthenticator
+from rag.QueryPipeline import QueryPipeline
+from rag.PdfDataIngestor import DataIngestor
+from rag.IngestionJobQueue import IngestionJobQueue
+from rag.AdmissionController import AdmissionController, AdmissionRejected
+from rag.PipelineMetrics import registry as metrics_registry
+from rag.RequestProfiler import RequestProfiler, RequestProfilingMiddleware
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Opens the database pool, builds the shared query pipeline and starts the ingestion workers at
+    startup, and releases them at shutdown.
+    """
+    # Tokens must be verifiable by every worker and across restarts when the endpoints require them
+    app.state.authenticator = UserAuthenticator(require_secret=AUTH_REQUIRED)
+    app.state.postgres = PostgresDatabase(conn_params)
+    try:
+        # Connect and migrate the schema once; if the database is down, the pool opens on first use
+        app.state.postgres.open()
+    except Exception as e:
+        print("Error connecting to the database:", e)
+    app.state.query_pipeline = QueryPipeline()
+    app.state.query_pipeline.start()
+    # Chatbot queries are admitted against per-user and global token rates before reaching Azure OpenAI
+    app.state.admission = AdmissionController()
+    # Answers computed from a document are invalidated once its new version is indexed
+    app.state.ingestion_jobs = IngestionJobQueue(DataIngestor, on_complete=app.state.query_pipeline.invalidate_document)
+    app.state.ingestion_jobs.start()
+    yield
+    # Wait for the running ingestions in a worker thread, so the event loop keeps serving meanwhile
+    await asyncio.to_thread(app.state.ingestion_jobs.stop, INGEST_SHUTDOWN_TIMEOUT)
+    await app.state.query_pipeline.close()
+    app.state.postgres.close()
+    app.state.authenticator.close()
+
+app = FastAPI(lifespan=lifespan)
 load_dotenv()
 
+# Requests sending the PROFILING_TOKEN secret in `X-Profile-Token` are profiled; without the secret
+# the profiling middleware is not installed at all
+PROFILING_TOKEN = os.environ.get("PROFILING_TOKEN")
+request_profiler = RequestProfiler(PROFILING_TOKEN) if PROFILING_TOKEN else None
+if request_profiler is not None:
+    app.add_middleware(RequestProfilingMiddleware, profiler=request_profiler)
+
 # Load Azure Blob container environment variable
 AZURE_BLOB_CONTAINER = os.environ.get("AZURE_BLOB_CONTAINER")
 
@@ -25,14 +74,71 @@ conn_params = {
     'sslmode': os.environ.get("POSTGRES_SSLMODE")
 }
 
+# Seconds the shutdown waits for the running ingestion jobs
+INGEST_SHUTDOWN_TIMEOUT = float(os.environ.get("INGEST_SHUTDOWN_TIMEOUT", "30"))
+
+# Whether the chatbot endpoints require a token issued by /auth
+AUTH_REQUIRED = os.environ.get("AUTH_REQUIRED", "true").lower() == "true"
+
+def authenticated_user(request: Request) -> Optional[str]:
+    """
+    Returns the user of the bearer token sent in the `Authorization` header.
+    
+    The token is validated locally from its signature, without a database query.
+    
+    Args:
+        request (Request): The request object.
+    
+    Returns:
+        str: The email of the authenticated user, or None if no valid token was sent.
+    """
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    return request.app.state.authenticator.validate_token(token.strip())
+
+UNAUTHORIZED_RESPONSE = {
+    "status_code": 401,
+    "message": "A valid token from /auth is required",
+}
+
+def admission_user(request: Request, user: Optional[str]) -> str:
+    """
+    Returns the identity charged by admission control: the authenticated user, or the client
+    address when authentication is disabled.
+    """
+    return user or f"address:{request.client.host if request.client else 'unknown'}"
+
+def shed_response(response: Response, rejection: AdmissionRejected) -> dict:
+    """
+    Builds the response of a query rejected by admission control, with its HTTP status and a
+    `Retry-After` header.
+    
+    Args:
+        response (Response): The response of the endpoint.
+        rejection (AdmissionRejected): The rejection.
+    
+    Returns:
+        dict: A dictionary containing the status code (429 or 503), a message and `retry_after` in seconds.
+    """
+    retry_after = math.ceil(rejection.retry_after)
+    response.status_code = rejection.status_code
+    response.headers["Retry-After"] = str(retry_after)
+    return {
+        "status_code": rejection.status_code,
+        "message": rejection.message,
+        "retry_after": retry_after,
+    }
+
 @app.post("/registration")
-def registration(user: RegistrationModel):
+def registration(request: Request, user: RegistrationModel):
     """
     Register a new user in the system.
     
     Args:
+        request (Request): The request object.
         user (RegistrationModel): The user registration data containing `email`, `password`, 
-                                   `first_name`, and `last_name`.
+                                   `first_name`, and `last_name`. The password is stored hashed.
     
     Returns:
         dict: A dictionary containing status code and message indicating whether the registration was successful or failed.
@@ -40,23 +146,16 @@ def registration(user: RegistrationModel):
     Raises:
         Exception: Any exception that occurs while connecting to the database or executing the query.
     """
-    conn = None
-    cursor = None
     try:
-        conn = psycopg2.connect(**conn_params)
-        print("Connected to the database!")
-        
-        cursor = conn.cursor()
-        
-        # Create table if it does not exist
-        cursor.execute("CREATE TABLE IF NOT EXISTS users (email VARCHAR(255) PRIMARY KEY, password VARCHAR(255), first_name VARCHAR(255), last_name VARCHAR(255));")
-        
-        # Insert user data into the database
-        cursor.execute("INSERT INTO users (email, password, first_name, last_name) VALUES (%s, %s, %s, %s);", 
-                       (user.email, user.password, user.first_name, user.last_name))
-        
-        # Commit the transaction
-        conn.commit()
+        # Borrow a pooled connection; the users table was created at startup
+        with request.app.state.postgres.connection() as conn:
+            with conn.cursor() as cursor:
+                # Insert user data into the database
+                cursor.execute("INSERT INTO users (email, password, first_name, last_name) VALUES (%s, %s, %s, %s);", 
+                               (user.email, request.app.state.authenticator.hash_password(user.password), user.first_name, user.last_name))
+            
+            # Commit the transaction
+            conn.commit()
 
     except Exception as e:
         print("Error connecting to the database:", e)
@@ -64,11 +163,6 @@ def registration(user: RegistrationModel):
             "status_code": 400,
             "message": "Error connecting to the database",
         }
-    finally:
-        if conn:
-            cursor.close()
-            conn.close()
-        print("Connection closed.")
 
     return {
         "status_code": 201,
@@ -76,32 +170,55 @@ def registration(user: RegistrationModel):
     }
 
 @app.post("/auth")
-def login(login: Login):
+async def login(request: Request, login: Login):
     """
-    Authenticate a user.
+    Authenticate a user against the registered users and issue an access token.
+    
+    The token is sent to the chatbot endpoints in an `Authorization: Bearer <token>` header.
     
     Args:
-        login (Login): The login data containing `username` and `password`.
+        request (Request): The request object.
+        login (Login): The login data containing `username` (the registered email) and `password`.
     
     Returns:
-        dict: A dictionary containing status code and message indicating the authentication result.
+        dict: A dictionary containing status code and message indicating the authentication result,
+              and the `token` and its `expires_at` Unix time on success.
     """
+    try:
+        # The database lookup and password hashing run in the authenticator's thread pool
+        session = await request.app.state.authenticator.authenticate(request.app.state.postgres, login.username, login.password)
+    except Exception as e:
+        print("Error connecting to the database:", e)
+        return {
+            "status_code": 400,
+            "message": "Error connecting to the database",
+        }
+
+    if session is None:
+        return {
+            "status_code": 401,
+            "message": "Invalid username or password",
+        }
+
     return {
         "status_code": 200,
         "message": "User authenticated successfully",
+        "token": session["token"],
+        "expires_at": session["expires_at"],
     }
 
 @app.post("/upload-legal-doc")
 def upload_legal_doc(request: Request, file: UploadFile = File(...)):
     """
-    Upload a legal document to Azure Blob Storage.
+    Upload a legal document to Azure Blob Storage and queue its ingestion into the search index.
     
     Args:
         request (Request): The request object.
         file (UploadFile): The legal document file to be uploaded.
     
     Returns:
-        dict: A dictionary containing the status code and message indicating whether the file upload was successful or failed.
+        dict: A dictionary containing the status code and message indicating whether the file upload was successful or failed,
+              and the `job_id` of the ingestion job on success.
     
     Raises:
         Exception: Any exception that occurs while uploading the file to Azure Blob Storage.
@@ -114,9 +231,11 @@ def upload_legal_doc(request: Request, file: UploadFile = File(...)):
         blob_client.upload_blob(file.file)
         print(f"File uploaded: {file.filename}")
 
-        # final testing pending to create index via api
-        # data_ingestor = DataIngestor()
-        # data_ingestor.ingest_data(file.filename)
+        # Cached answers built from a previous version of this document are stale now
+        request.app.state.query_pipeline.invalidate_document(file.filename)
+
+        # Index the document in the background; progress is reported by /ingest-jobs/{job_id}
+        ingestion_job = request.app.state.ingestion_jobs.submit(file.filename)
 
     except Exception as e:
         return {
@@ -131,55 +250,444 @@ def upload_legal_doc(request: Request, file: UploadFile = File(...)):
     return {
         "status_code": 200,
         "message": message,
+        "job_id": ingestion_job.job_id,
     }
 
+@app.get("/ingest-jobs/{job_id}")
+def ingest_job_status(request: Request, job_id: str):
+    """
+    Report the status and progress of a background ingestion job.
+    
+    Args:
+        request (Request): The request object.
+        job_id (str): The job id returned by `/upload-legal-doc`.
+    
+    Returns:
+        dict: A dictionary containing the status code and the job status: its stage, progress counters
+              (pages, chunks, embeddings, indexed), stage attempts and error if it failed.
+    """
+    ingestion_job = request.app.state.ingestion_jobs.get(job_id)
+    if ingestion_job is None:
+        return {
+            "status_code": 404,
+            "message": "Ingestion job not found",
+        }
+
+    return {
+        "status_code": 200,
+        "message": f"Ingestion job {ingestion_job.status}",
+        "job": ingestion_job.to_dict(),
+    }
+
+def format_sse_event(event: str, data) -> str:
+    """
+    Formats a server-sent event whose data is JSON encoded.
+    
+    Args:
+        event (str): The event name.
+        data: The JSON-serializable event payload.
+    
+    Returns:
+        str: The event in text/event-stream wire format.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def stream_legal_bot_events(query_pipeline: QueryPipeline, query: str, release_admission=None, on_cached=None):
+    """
+    Streams the chatbot answer for a query as server-sent events, keeping the pipeline
+    leased until the last event has been sent.
+    
+    Args:
+        query_pipeline (QueryPipeline): The shared query pipeline.
+        query (str): The user's query.
+        release_admission (callable): Releases the query's admission once the stream ends.
+        on_cached (callable): Called when the query does not call the model itself (semantic answer cache
+            hit, or an identical query in flight).
+    
+    Yields:
+        str: The `context`, `token` and `done` events, or an `error` event if generation fails.
+    """
+    try:
+        async with query_pipeline.lease() as content_generation_object:
+            try:
+                async for event, data in content_generation_object.astream_chat_query_response(query, on_cached):
+                    yield format_sse_event(event, data)
+            except Exception as e:
+                print("Error streaming the chatbot response:", e)
+                yield format_sse_event("error", {"message": str(e)})
+    finally:
+        if release_admission is not None:
+            release_admission()
+
+@app.post("/legal-bot/stream")
+async def legal_bot_stream(request: Request, response: Response, query_data: ChatQueryModel):
+    """
+    Query the legal chatbot and stream the response as server-sent events.
+    
+    The metadata of the retrieved context is sent first as a `context` event, followed by
+    `token` events as the model generates the answer and a final `done` event.
+    
+    Args:
+        request (Request): The request object.
+        response (Response): The response, whose status is set when the query is rejected.
+        query_data (ChatQueryModel): The user's query input in the `query` field.
+    
+    Returns:
+        StreamingResponse: A `text/event-stream` response carrying the answer, or a dictionary
+                           containing a 401, 429 or 503 status code and message if the query is rejected.
+    """
+    user = authenticated_user(request)
+    if AUTH_REQUIRED and user is None:
+        return UNAUTHORIZED_RESPONSE
+
+    admission = request.app.state.admission
+    user_id = admission_user(request, user)
+    try:
+        release_admission = await admission.acquire(user_id, admission.estimate_cost(query_data.query))
+    except AdmissionRejected as rejection:
+        return shed_response(response, rejection)
+
+    async def release_after_response():
+        # Runs on the event loop, like the controller; a no-op if the stream already released
+        release_admission()
+
+    # The stream releases the admission when it ends; the background task covers a client that
+    # disconnects before the stream starts
+    return StreamingResponse(
+        stream_legal_bot_events(
+            request.app.state.query_pipeline, query_data.query, release_admission,
+            on_cached=lambda: admission.refund_cached(user_id)
+        ),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(release_after_response)
+    )
+
 @app.post("/legal-bot")
-def legal_bot(request: Request, query_data: ChatQueryModel):
+async def legal_bot(request: Request, response: Response, query_data: ChatQueryModel):
     """
     Query the legal chatbot for responses to user queries.
     
+    Clients sending `Accept: text/event-stream` get the streamed response of `/legal-bot/stream`.
+    Queries go through admission control: a user over their token rate gets a 429, and a
+    saturated service answers 503, both with a `Retry-After` header.
+    
     Args:
         request (Request): The request object.
+        response (Response): The response, whose status is set when the query is rejected.
         query_data (ChatQueryModel): The user's query input in the `query` field.
     
     Returns:
-        dict: A dictionary containing status code and the chatbot's response to the query.
+        dict: A dictionary containing status code and the chatbot's response to the query, or a
+              502 status code if the search or the model call failed.
     """
-    content_generation_object = QueryResponseGenerator()
+    if "text/event-stream" in request.headers.get("accept", ""):
+        return await legal_bot_stream(request, response, query_data)
+
+    user = authenticated_user(request)
+    if AUTH_REQUIRED and user is None:
+        return UNAUTHORIZED_RESPONSE
+
+    admission = request.app.state.admission
+    user_id = admission_user(request, user)
+    try:
+        async with admission.admit(user_id, query_data.query):
+            # Borrow the shared generator built at startup instead of building clients per request
+            async with request.app.state.query_pipeline.lease() as content_generation_object:
+                # Query the chatbot for a response without holding a threadpool worker; a cached
+                # answer, or one shared with an identical query in flight, gives back the tokens
+                # charged for the model call
+                answer = await content_generation_object.aget_chat_query_response(
+                    query_data.query, on_cached=lambda: admission.refund_cached(user_id)
+                )
+    except AdmissionRejected as rejection:
+        return shed_response(response, rejection)
+    except Exception as e:
+        # A failed search or model call is an error, not an empty answer
+        print("Error generating the chatbot response:", e)
+        response.status_code = 502
+        return {
+            "status_code": 502,
+            "message": "Error generating the chatbot response",
+        }
+
+    return {
+        "status_code": 200,
+        "message": answer,
+    }
+
+@app.post("/legal-bot/batch")
+async def legal_bot_batch(request: Request, response: Response, batch_data: BatchChatQueryModel):
+    """
+    Query the legal chatbot with a batch of queries.
+    
+    Repeated queries are answered once and the queries are processed with bounded concurrency.
+    Each distinct query goes through admission control on its own, so a batch is held to the
+    same token rate and concurrency as separate queries; rejected queries are reported in their
+    result, and the batch gets the rejection status when every query was rejected.
+    
+    Args:
+        request (Request): The request object.
+        response (Response): The response, whose status is set when the batch is rejected.
+        batch_data (BatchChatQueryModel): The queries in the `queries` field and an optional `concurrency` limit.
+    
+    Returns:
+        dict: A dictionary containing status code, a message and one result per query, in input order,
+              holding either the chatbot's `response` or an `error`.
+    """
+    user = authenticated_user(request)
+    if AUTH_REQUIRED and user is None:
+        return UNAUTHORIZED_RESPONSE
+
+    admission = request.app.state.admission
+    user_id = admission_user(request, user)
+    async with request.app.state.query_pipeline.lease() as content_generation_object:
+        results = await content_generation_object.aget_batch_chat_query_responses(
+            batch_data.queries,
+            batch_data.concurrency,
+            admit=lambda query: admission.admit(user_id, query),
+            on_cached=lambda: admission.refund_cached(user_id)
+        )
+
+    rejected = [result for result in results if "status_code" in result]
+    if len(rejected) == len(results):
+        retry_after = max(result["retry_after"] for result in rejected)
+        return shed_response(response, AdmissionRejected(rejected[0]["status_code"], rejected[0]["error"], retry_after))
+
+    failed = sum(1 for result in results if "error" in result)
+    return {
+        "status_code": 200,
+        "message": f"{len(results) - failed} queries answered, {failed} failed",
+        "results": results,
+    }
+
+# Administration endpoints require the ADMIN_TOKEN secret in `X-Admin-Token`; without the secret
+# they are disabled
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
+ADMIN_DISABLED_RESPONSE = {
+    "status_code": 404,
+    "message": "Administration is disabled, set ADMIN_TOKEN to enable it",
+}
+
+ADMIN_FORBIDDEN_RESPONSE = {
+    "status_code": 403,
+    "message": "A valid X-Admin-Token header is required",
+}
+
+def is_admin(request: Request) -> bool:
+    """
+    Tells whether the request sends the ADMIN_TOKEN secret in its `X-Admin-Token` header.
+    
+    Args:
+        request (Request): The request object.
+    
+    Returns:
+        bool: True if the header matches the secret.
+    """
+    token = request.headers.get("x-admin-token")
+    return token is not None and hmac.compare_digest(token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8"))
+
+@app.post("/reload-query-pipeline")
+async def reload_query_pipeline(request: Request, force: bool = False):
+    """
+    Reload the shared query pipeline after a configuration change.
+    
+    Args:
+        request (Request): The request object, carrying the `X-Admin-Token` header.
+        force (bool): Rebuild the pipeline clients even if the configuration is unchanged.
+    
+    Returns:
+        dict: A dictionary containing status code and a message indicating whether the pipeline was rebuilt.
+    """
+    if ADMIN_TOKEN is None:
+        return ADMIN_DISABLED_RESPONSE
+    if not is_admin(request):
+        return ADMIN_FORBIDDEN_RESPONSE
+
+    try:
+        reloaded = await request.app.state.query_pipeline.reload(force=force)
+    except Exception as e:
+        return {
+            "status_code": 400,
+            "message": f"Query pipeline reload failed: {str(e)}",
+        }
+
+    return {
+        "status_code": 200,
+        "message": "Query pipeline reloaded" if reloaded else "Query pipeline configuration unchanged",
+    }
+
+@app.get("/metrics")
+def metrics():
+    """
+    Export the pipeline metrics in the Prometheus text format: per-stage latency histograms of
+    queries (cache_lookup, retrieve, rerank, pack, llm, total) and ingestions (download, extract,
+    embed, index, delete), token counts, cache lookups and admission decisions.
     
-    # Query the chatbot for a response
-    response = content_generation_object.get_chat_query_response(query_data.query)
+    Returns:
+        PlainTextResponse: The metrics of this application worker.
+    """
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+PROFILING_DISABLED_RESPONSE = {
+    "status_code": 404,
+    "message": "Profiling is disabled, set PROFILING_TOKEN to enable it",
+}
+
+PROFILING_FORBIDDEN_RESPONSE = {
+    "status_code": 403,
+    "message": "A valid X-Profile-Token header is required",
+}
 
+@app.post("/profiling")
+def arm_profiling(request: Request, requests: int = Query(default=1, ge=0, le=100), path_prefix: str = "/legal-bot"):
+    """
+    Profile the next chatbot requests without them sending the `X-Profile-Token` header.
+    
+    Args:
+        request (Request): The request object, carrying the `X-Profile-Token` header.
+        requests (int): Number of upcoming requests to profile; 0 disarms the profiler.
+        path_prefix (str): Only profile the requests whose path starts with this prefix.
+    
+    Returns:
+        dict: A dictionary containing status code and a message with the number of armed requests.
+    """
+    if request_profiler is None:
+        return PROFILING_DISABLED_RESPONSE
+    if not request_profiler.is_authorized(request.headers.get("x-profile-token")):
+        return PROFILING_FORBIDDEN_RESPONSE
+
+    request_profiler.arm(requests, path_prefix)
     return {
         "status_code": 200,
-        "message": response,
+        "message": f"Profiling the next {requests} requests to {path_prefix}",
     }
 
+@app.get("/profiles/{profile_id}")
+def get_profile(request: Request, profile_id: str, format: str = Query(default="collapsed", pattern="^(collapsed|json)$")):
+    """
+    Download a stored request profile.
+    
+    The collapsed stacks can be rendered with flamegraph.pl, speedscope or inferno. Samples under
+    `[cpu]` were taken while the request was running, samples under `[await]` show what it was
+    waiting for.
+    
+    Args:
+        request (Request): The request object, carrying the `X-Profile-Token` header.
+        profile_id (str): The id returned in the `X-Profile-Id` header of the profiled request.
+        format (str): "collapsed" for the sampled stacks, "json" for the duration and allocation deltas.
+    
+    Returns:
+        PlainTextResponse: The collapsed stacks, or a dictionary containing status code and the profile summary.
+    """
+    if request_profiler is None:
+        return PROFILING_DISABLED_RESPONSE
+    if not request_profiler.is_authorized(request.headers.get("x-profile-token")):
+        return PROFILING_FORBIDDEN_RESPONSE
+
+    profile = request_profiler.load(profile_id, format)
+    if profile is None:
+        return {
+            "status_code": 404,
+            "message": "Profile not found",
+        }
+    if format == "collapsed":
+        return PlainTextResponse(profile)
+    return {
+        "status_code": 200,
+        "message": "Profile found",
+        "profile": json.loads(profile),
+    }
+
+# Columns returned by /list-users; the password hash is never listed
+USER_LIST_COLUMNS = ("email", "first_name", "last_name")
+
+def estimate_user_count(cursor) -> int:
+    """
+    Estimates the number of users from the planner statistics instead of counting every row.
+    
+    Args:
+        cursor: A cursor of a pooled connection.
+    
+    Returns:
+        int: The estimated number of rows of the `users` table.
+    """
+    cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = 'users'::regclass;")
+    estimate = cursor.fetchone()[0]
+    if estimate < 0:
+        # The table was never vacuumed or analyzed; it is small enough to count
+        cursor.execute("SELECT count(*) FROM users;")
+        estimate = cursor.fetchone()[0]
+    return estimate
+
+def stream_users_ndjson(postgres: PostgresDatabase, after: Optional[str]):
+    """
+    Streams users as newline-delimited JSON, reading them through a server-side cursor so the
+    result set is never held in memory.
+    
+    Args:
+        postgres (PostgresDatabase): The database pool.
+        after (str): Only stream the users whose email sorts after this one.
+    
+    Yields:
+        str: One JSON-encoded user per line, or an error line if the export fails.
+    """
+    try:
+        with postgres.connection() as conn:
+            # Named cursors fetch the rows from the server in batches of `itersize`
+            with conn.cursor(name="list_users_export") as cursor:
+                cursor.itersize = 1000
+                cursor.execute(
+                    f"SELECT {', '.join(USER_LIST_COLUMNS)} FROM users WHERE email > %s ORDER BY email;",
+                    (after or "",)
+                )
+                for row in cursor:
+                    yield json.dumps(dict(zip(USER_LIST_COLUMNS, row))) + "\n"
+    except Exception as e:
+        print("Error streaming users:", e)
+        yield json.dumps({"error": "Error connecting to the database"}) + "\n"
+
 @app.get("/list-users")
-def list_users():
+def list_users(
+    request: Request,
+    limit: int = Query(100, ge=1, le=1000),
+    after: Optional[str] = None,
+    stream: bool = False
+):
     """
-    List all registered users.
+    List registered users, one page at a time, ordered by email.
+    
+    Pages are read with keyset pagination: pass the `next_after` value of a page as `after` to get
+    the next one. With `stream=true` every user after `after` is streamed as NDJSON instead.
     
-    This endpoint retrieves all users from the `users` table.
+    Args:
+        request (Request): The request object.
+        limit (int): The maximum number of users of the page (1 to 1000).
+        after (str): Only list the users whose email sorts after this one.
+        stream (bool): Stream all users as `application/x-ndjson` (for exports).
     
     Returns:
-        dict: A dictionary containing the status code, a message, and a list of all users.
+        dict: A dictionary containing the status code, a message, the page of users (`email`, `first_name`,
+              `last_name`), the `next_after` cursor (None on the last page) and the `estimated_total` number of users.
     
     Raises:
         Exception: Any exception that occurs while connecting to the database or retrieving users.
     """
-    conn = None
-    cursor = None
+    if stream:
+        return StreamingResponse(stream_users_ndjson(request.app.state.postgres, after), media_type="application/x-ndjson")
+
     try:
-        conn = psycopg2.connect(**conn_params)
-        print("Connected to the database!")
-        
-        cursor = conn.cursor()
-        
-        # Retrieve all users from the database
-        cursor.execute("SELECT * FROM users;")
-        users = cursor.fetchall()
-        print("Users:", users)
+        # Borrow a pooled connection
+        with request.app.state.postgres.connection() as conn:
+            with conn.cursor() as cursor:
+                # Read one row past the page to know whether another page follows; the email primary key serves the range scan
+                cursor.execute(
+                    f"SELECT {', '.join(USER_LIST_COLUMNS)} FROM users WHERE email > %s ORDER BY email LIMIT %s;",
+                    (after or "", limit + 1)
+                )
+                rows = cursor.fetchall()
+                estimated_total = estimate_user_count(cursor)
 
     except Exception as e:
         print("Error connecting to the database:", e)
@@ -187,14 +695,12 @@ def list_users():
             "status_code": 400,
             "message": "Error connecting to the database",
         }
-    finally:
-        if conn:
-            cursor.close()
-            conn.close()
-        print("Connection closed.")
 
+    users = [dict(zip(USER_LIST_COLUMNS, row)) for row in rows[:limit]]
     return {
         "status_code": 200,
         "message": "Users listed successfully",
-        "users": users
+        "users": users,
+        "next_after": users[-1]["email"] if len(rows) > limit else None,
+        "estimated_total": estimated_total
     }
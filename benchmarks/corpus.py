@@ -0,0 +1,113 @@
+import random
+
+# Vocabulary of the synthetic legal text used by the benchmarks
+SUBJECTS = [
+    "The Tenant", "The Landlord", "The Employee", "The Employer", "The Customer", "The Provider",
+    "Either party", "The Licensee", "The Licensor", "The Contractor", "The Company", "The Insurer",
+]
+OBLIGATIONS = [
+    "shall provide written notice", "shall indemnify and hold harmless the other party",
+    "may terminate this Agreement", "shall maintain adequate insurance coverage",
+    "shall keep all Confidential Information strictly confidential", "shall pay the fees set forth in Schedule A",
+    "shall comply with all applicable laws and regulations", "may assign this Agreement with prior consent",
+    "shall repair any defect covered by the warranty", "shall not disclose personal data to third parties",
+]
+CONDITIONS = [
+    "within thirty (30) days of the Effective Date", "upon a material breach that remains uncured",
+    "during the term of the warranty period", "unless otherwise agreed in writing",
+    "subject to the limitations of Section 12", "in accordance with the governing law of the State",
+    "prior to the renewal of the subscription", "except in the case of gross negligence or wilful misconduct",
+    "following the end of each calendar quarter", "notwithstanding any provision to the contrary",
+]
+
+def legal_sentence(rng: random.Random) -> str:
+    """
+    Returns a random contract-like sentence.
+    """
+    return f"{rng.choice(SUBJECTS)} {rng.choice(OBLIGATIONS)} {rng.choice(CONDITIONS)}."
+
+def legal_text(rng: random.Random, words: int) -> str:
+    """
+    Returns random contract-like text of about `words` words.
+    """
+    sentences = []
+    count = 0
+    while count < words:
+        sentence = legal_sentence(rng)
+        sentences.append(sentence)
+        count += len(sentence.split())
+    return " ".join(sentences)
+
+def make_pdf(pages: list) -> bytes:
+    """
+    Builds a minimal PDF with one page of Helvetica text per item of `pages`.
+
+    Parameters:
+    ----------
+    pages : list of str
+        The text of each page; it is wrapped at 90 characters per line.
+
+    Returns:
+    -------
+    bytes
+        The PDF document.
+    """
+    objects = []
+
+    def add(body: bytes) -> int:
+        objects.append(body)
+        return len(objects)
+
+    font_id = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    # The page tree follows the content stream and page object of every page
+    pages_id = len(objects) + 1 + 2 * len(pages)
+    page_ids = []
+    for text in pages:
+        text = text.replace("\\", "").replace("(", "").replace(")", "")
+        lines = [text[start:start + 90] for start in range(0, len(text), 90)]
+        stream = ("BT /F1 9 Tf 30 810 Td 11 TL " + " ".join(f"({line}) '" for line in lines) + " ET").encode("latin-1", "replace")
+        content_id = add(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        page_ids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 842] /Contents %d 0 R /Resources << /Font << /F1 %d 0 R >> >> >>"
+            % (pages_id, content_id, font_id)
+        ))
+    add(b"<< /Type /Pages /Kids [" + b" ".join(b"%d 0 R" % page_id for page_id in page_ids) + b"] /Count %d >>" % len(page_ids))
+    catalog_id = add(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id)
+
+    document = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(document))
+        document += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref_offset = len(document)
+    document += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        document += b"%010d 00000 n \n" % offset
+    document += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog_id, xref_offset)
+    return bytes(document)
+
+def generate_pdfs(count: int, pages: int, words_per_page: int = 350, seed: int = 0) -> dict:
+    """
+    Generates synthetic contracts.
+
+    Parameters:
+    ----------
+    count : int
+        Number of documents.
+    pages : int
+        Pages per document.
+    words_per_page : int
+        Approximate words per page.
+    seed : int
+        Seed of the generated text, so runs are comparable.
+
+    Returns:
+    -------
+    dict
+        The PDF content of each blob name.
+    """
+    rng = random.Random(seed)
+    return {
+        f"benchmark/contract-{index:05d}.pdf": make_pdf([legal_text(rng, words_per_page) for _ in range(pages)])
+        for index in range(count)
+    }
@@ -0,0 +1,423 @@
+import re
+import json
+import time
+import uuid
+import base64
+import random
+import asyncio
+import hashlib
+import argparse
+import threading
+import numpy as np
+import uvicorn
+from email.utils import formatdate
+from xml.sax.saxutils import escape
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+from benchmarks.corpus import legal_text
+
+# Key of the Azurite development account; the fake Blob Storage accepts any signature
+DEV_ACCOUNT_NAME = "devstoreaccount1"
+DEV_ACCOUNT_KEY = "Eby8vdM02xNOcqFlqUwJPLlmEtlCDXJ1OUzFT50uSRZ6IFsuFq2UVErCz4I6tq/K1SZFPTOtr/KBHBeksoGMGw=="
+
+class FakeAzureServices:
+    """
+    In-process stand-ins for Azure OpenAI, Azure Cognitive Search and Azure Blob Storage, served by
+    a single local HTTP server so the application can be benchmarked without Azure.
+
+    The services speak enough of the real REST APIs for the SDKs used by this project:
+    - Azure OpenAI: chat completions, streamed or not, and embeddings. Completions wait
+      `first_token_latency` and then `token_interval` per generated token; embeddings wait
+      `embedding_latency`. Embeddings are deterministic pseudo-random unit vectors of the input.
+    - Azure Cognitive Search: index definitions, document uploads and deletions, and searches
+      ranked by query term overlap after `search_latency`. Until documents are uploaded, searches
+      run over `search_documents` generated chunks that carry a content vector, like an index
+      built by the ingestion. `select` is honored.
+    - Azure Blob Storage: listing, uploading and (ranged) downloading of blobs of any container.
+
+    Attributes:
+    ----------
+    blobs : dict
+        The content of each blob, keyed by (container, blob name).
+    requests : dict
+        Number of requests served by each service.
+    """
+
+    def __init__(self, first_token_latency: float = 0.3, token_interval: float = 0.01, completion_tokens: int = 80,
+                 embedding_latency: float = 0.05, embedding_dimensions: int = 1536, search_latency: float = 0.03,
+                 search_documents: int = 200, seed: int = 0):
+        """
+        Initializes the services. Call `start()` to serve them.
+        """
+        self.first_token_latency = first_token_latency
+        self.token_interval = token_interval
+        self.completion_tokens = completion_tokens
+        self.embedding_latency = embedding_latency
+        self.embedding_dimensions = embedding_dimensions
+        self.search_latency = search_latency
+
+        self.blobs = {}  # (container, name) -> (content, etag, last modified)
+        self.indexes = {}  # index name -> index definition
+        self.documents = {}  # index name -> {key: document}
+        self.requests = {"openai": 0, "search": 0, "blob": 0}
+        self._lock = threading.Lock()
+
+        # Chunks searched until documents are uploaded, shaped like those indexed by the ingestion
+        rng = random.Random(seed)
+        self.default_documents = [
+            {
+                "id": f"chunk-{index}",
+                "content": legal_text(rng, 120),
+                "content_vector": self.embed(f"chunk-{index}"),
+                "metadata": json.dumps({"source": f"benchmark/contract-{index // 10:05d}.pdf", "page": index % 10}),
+            }
+            for index in range(search_documents)
+        ]
+
+        self.app = Starlette(routes=[
+            Route("/openai/deployments/{deployment}/chat/completions", self.chat_completions, methods=["POST"]),
+            Route("/openai/deployments/{deployment}/embeddings", self.embeddings, methods=["POST"]),
+            Route("/indexes", self.create_index, methods=["POST"]),
+            Route("/{path:path}", self.dispatch, methods=["GET", "HEAD", "PUT", "POST", "DELETE"]),
+        ])
+        self._server = None
+        self._thread = None
+        self.port = None
+
+    # Azure OpenAI
+
+    def embed(self, text) -> list:
+        """
+        Returns the deterministic unit vector of a text (or of a list of token ids).
+        """
+        digest = hashlib.sha256(json.dumps(text).encode("utf-8")).digest()
+        vector = np.random.default_rng(int.from_bytes(digest[:8], "little")).standard_normal(self.embedding_dimensions).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    async def embeddings(self, request: Request) -> JSONResponse:
+        """
+        Azure OpenAI embeddings.
+        """
+        self.requests["openai"] += 1
+        body = await request.json()
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        # A single list of token ids is one input
+        if inputs and isinstance(inputs[0], int):
+            inputs = [inputs]
+        await asyncio.sleep(self.embedding_latency)
+
+        data = []
+        for index, text in enumerate(inputs):
+            embedding = self.embed(text)
+            if body.get("encoding_format") == "base64":
+                embedding = base64.b64encode(np.asarray(embedding, dtype=np.float32).tobytes()).decode("ascii")
+            data.append({"object": "embedding", "index": index, "embedding": embedding})
+        tokens = sum(len(text) if isinstance(text, list) else len(text) // 4 + 1 for text in inputs)
+        return JSONResponse({
+            "object": "list",
+            "model": "text-embedding-ada-002",
+            "data": data,
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+    def _completion_words(self, messages: list) -> list:
+        """
+        Returns the generated answer, one token per word.
+        """
+        prompt = " ".join(str(message.get("content", "")) for message in messages)
+        rng = random.Random(prompt)
+        return legal_text(rng, self.completion_tokens).split()[:self.completion_tokens]
+
+    async def chat_completions(self, request: Request) -> Response:
+        """
+        Azure OpenAI chat completions, streamed as server-sent events when requested.
+        """
+        self.requests["openai"] += 1
+        body = await request.json()
+        words = self._completion_words(body.get("messages", []))
+        prompt_tokens = sum(len(str(message.get("content", ""))) // 4 + 1 for message in body.get("messages", []))
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+
+        if not body.get("stream"):
+            await asyncio.sleep(self.first_token_latency + self.token_interval * len(words))
+            return JSONResponse({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": "gpt-4",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": " ".join(words)}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(words), "total_tokens": prompt_tokens + len(words)},
+            })
+
+        async def stream_chunks():
+            await asyncio.sleep(self.first_token_latency)
+            for position, word in enumerate(words):
+                delta = {"role": "assistant", "content": word if position == 0 else " " + word}
+                chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": "gpt-4",
+                         "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+                yield f"data: {json.dumps(chunk)}\n\n"
+                await asyncio.sleep(self.token_interval)
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": "gpt-4",
+                     "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+            yield f"data: {json.dumps(chunk)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream_chunks(), media_type="text/event-stream")
+
+    # Azure Cognitive Search
+
+    async def create_index(self, request: Request) -> JSONResponse:
+        """
+        Azure Search index creation.
+        """
+        self.requests["search"] += 1
+        definition = await request.json()
+        self.indexes[definition["name"]] = definition
+        self.documents.setdefault(definition["name"], {})
+        return JSONResponse(definition, status_code=201)
+
+    def _search(self, index_name: str, body: dict) -> dict:
+        """
+        Ranks the documents of an index by the number of query terms they contain.
+        """
+        documents = list(self.documents[index_name].values()) if self.documents.get(index_name) else self.default_documents
+        terms = set(re.findall(r"\w+", (body.get("search") or "").lower()))
+        scored = []
+        for document in documents:
+            content_terms = set(re.findall(r"\w+", str(document.get("content", "")).lower()))
+            scored.append((len(terms & content_terms) / (len(terms) or 1), document))
+        scored.sort(key=lambda item: item[0], reverse=True)
+
+        selected_fields = [field.strip() for field in body["select"].split(",")] if body.get("select") else None
+        results = []
+        for score, document in scored[:int(body.get("top") or 50)]:
+            if selected_fields is not None:
+                document = {field: document[field] for field in selected_fields if field in document}
+            results.append({"@search.score": score, **document})
+        return {"value": results}
+
+    def _index_documents(self, index_name: str, body: dict) -> dict:
+        """
+        Azure Search document uploads, merges and deletions.
+        """
+        documents = self.documents.setdefault(index_name, {})
+        key_field = next((field["name"] for field in self.indexes.get(index_name, {}).get("fields", []) if field.get("key")), "id")
+        results = []
+        for action in body.get("value", []):
+            action = dict(action)
+            kind = action.pop("@search.action", "upload")
+            key = action.get(key_field)
+            if kind == "delete":
+                documents.pop(key, None)
+            elif kind in ("merge", "mergeOrUpload") and key in documents:
+                documents[key].update(action)
+            else:
+                documents[key] = action
+            results.append({"key": key, "status": True, "errorMessage": None, "statusCode": 200 if kind == "delete" else 201})
+        return {"value": results}
+
+    async def _search_request(self, request: Request, index_name: str, operation: str) -> Response:
+        """
+        Dispatches a request on an Azure Search index.
+        """
+        self.requests["search"] += 1
+        if operation is None:
+            if request.method == "GET":
+                if index_name not in self.indexes:
+                    return JSONResponse({"error": {"code": "", "message": f"No index with the name '{index_name}' was found."}}, status_code=404)
+                return JSONResponse(self.indexes[index_name])
+            if request.method == "PUT":
+                self.indexes[index_name] = await request.json()
+                self.documents.setdefault(index_name, {})
+                return JSONResponse(self.indexes[index_name], status_code=201)
+            self.indexes.pop(index_name, None)
+            self.documents.pop(index_name, None)
+            return Response(status_code=204)
+
+        body = await request.json()
+        if operation == "search.post.search":
+            await asyncio.sleep(self.search_latency)
+            return JSONResponse(self._search(index_name, body))
+        if operation == "search.index":
+            return JSONResponse(self._index_documents(index_name, body))
+        return JSONResponse({"error": {"code": "", "message": f"Unsupported operation {operation}"}}, status_code=400)
+
+    # Azure Blob Storage
+
+    @staticmethod
+    def _blob_headers(content: bytes, etag: str, last_modified: float) -> dict:
+        """
+        Returns the headers describing a blob.
+        """
+        return {
+            "ETag": etag,
+            "Last-Modified": formatdate(last_modified, usegmt=True),
+            "Content-MD5": base64.b64encode(hashlib.md5(content).digest()).decode("ascii"),
+            "Content-Type": "application/pdf",
+            "x-ms-blob-type": "BlockBlob",
+            "x-ms-version": "2024-08-04",
+            "x-ms-request-id": str(uuid.uuid4()),
+        }
+
+    def add_blob(self, container: str, name: str, content: bytes):
+        """
+        Stores a blob, as if it had been uploaded.
+        """
+        with self._lock:
+            self.blobs[(container, name)] = (content, f'"0x{hashlib.md5(content).hexdigest()[:15].upper()}"', time.time())
+
+    def _list_blobs(self, container: str, prefix: str) -> Response:
+        """
+        Azure Blob Storage blob listing, in a single page.
+        """
+        entries = []
+        for (blob_container, name), (content, etag, last_modified) in sorted(self.blobs.items()):
+            if blob_container != container or not name.startswith(prefix):
+                continue
+            entries.append(
+                f"<Blob><Name>{escape(name)}</Name><Properties>"
+                f"<Last-Modified>{formatdate(last_modified, usegmt=True)}</Last-Modified><Etag>{escape(etag)}</Etag>"
+                f"<Content-Length>{len(content)}</Content-Length><Content-Type>application/pdf</Content-Type>"
+                f"<Content-MD5>{base64.b64encode(hashlib.md5(content).digest()).decode('ascii')}</Content-MD5>"
+                f"<BlobType>BlockBlob</BlobType></Properties></Blob>"
+            )
+        body = (
+            '<?xml version="1.0" encoding="utf-8"?>'
+            f'<EnumerationResults ServiceEndpoint="http://127.0.0.1:{self.port}/{DEV_ACCOUNT_NAME}/" ContainerName="{escape(container)}">'
+            f"<Prefix>{escape(prefix)}</Prefix><Blobs>{''.join(entries)}</Blobs><NextMarker /></EnumerationResults>"
+        )
+        return Response(body, media_type="application/xml", headers={"x-ms-version": "2024-08-04"})
+
+    async def _blob_request(self, request: Request, container: str, name: str) -> Response:
+        """
+        Dispatches a request on a blob container or a blob.
+        """
+        self.requests["blob"] += 1
+        if not name:
+            if request.query_params.get("comp") == "list":
+                return self._list_blobs(container, request.query_params.get("prefix", ""))
+            # Container creation and properties
+            return Response(status_code=201 if request.method == "PUT" else 200, headers={"ETag": '"0x1"', "Last-Modified": formatdate(usegmt=True)})
+
+        if request.method == "PUT":
+            if request.query_params.get("comp"):
+                return Response(status_code=400, content="Block uploads are not supported, upload blobs in a single request")
+            self.add_blob(container, name, await request.body())
+            content, etag, last_modified = self.blobs[(container, name)]
+            headers = self._blob_headers(content, etag, last_modified)
+            return Response(status_code=201, headers={key: headers[key] for key in ("ETag", "Last-Modified", "Content-MD5", "x-ms-version", "x-ms-request-id")})
+
+        if request.method == "DELETE":
+            self.blobs.pop((container, name), None)
+            return Response(status_code=202)
+
+        if (container, name) not in self.blobs:
+            return Response(status_code=404, headers={"x-ms-error-code": "BlobNotFound"}, content="The specified blob does not exist.")
+        content, etag, last_modified = self.blobs[(container, name)]
+        headers = self._blob_headers(content, etag, last_modified)
+        if request.method == "HEAD":
+            return Response(headers={**headers, "Content-Length": str(len(content))})
+
+        byte_range = request.headers.get("x-ms-range") or request.headers.get("range")
+        match = re.match(r"bytes=(\d+)-(\d*)", byte_range or "")
+        if not match or not content:
+            return Response(content, headers=headers)
+        start = int(match.group(1))
+        end = min(int(match.group(2)) if match.group(2) else len(content) - 1, len(content) - 1)
+        headers["Content-Range"] = f"bytes {start}-{end}/{len(content)}"
+        return Response(content[start:end + 1], status_code=206, headers=headers)
+
+    async def dispatch(self, request: Request) -> Response:
+        """
+        Routes the Azure Search and Blob Storage requests.
+        """
+        path = "/" + request.path_params["path"]
+        match = re.match(r"^/indexes(?:\('([^']+)'\)|/([^/]+))(?:/docs/(search\.[\w.]+))?$", path)
+        if match:
+            return await self._search_request(request, match.group(1) or match.group(2), match.group(3))
+        match = re.match(rf"^/{DEV_ACCOUNT_NAME}/([^/]+)/?(.*)$", path)
+        if match:
+            return await self._blob_request(request, match.group(1), match.group(2))
+        return JSONResponse({"error": {"message": f"Unknown path {path}"}}, status_code=404)
+
+    # Server
+
+    def environment(self, container: str = "benchmark") -> dict:
+        """
+        Returns the environment variables pointing the application at the fake services.
+        """
+        endpoint = f"http://127.0.0.1:{self.port}"
+        return {
+            "AZURE_OPENAI_GPT4_MODEL": "gpt-4",
+            "AZURE_OPENAI_GPT4_DEPLOYMENT": "gpt-4",
+            "AZURE_OPENAI_GPT4_KEY": "benchmark",
+            "AZURE_OPENAI_GPT4_ENDPOINT": endpoint,
+            "AZURE_OPENAI_GPT4_VERSION": "2024-02-01",
+            "AZURE_OPENAI_EMBEDDING_ENDPOINT": endpoint,
+            "AZURE_OPENAI_EMBEDDING_KEY": "benchmark",
+            "AZURE_OPENAI_EMBEDDING_DEPLOYMENT": "text-embedding-ada-002",
+            "AZURE_OPENAI_EMBEDDING_VERSION": "2024-02-01",
+            "AZURE_SEARCH_ENDPOINT": endpoint,
+            "AZURE_SEARCH_KEY": "benchmark",
+            "AZURE_SEARCH_INDEX": "benchmark-index",
+            "AZURE_STORAGE_CONNECTION": (
+                f"DefaultEndpointsProtocol=http;AccountName={DEV_ACCOUNT_NAME};AccountKey={DEV_ACCOUNT_KEY};"
+                f"BlobEndpoint={endpoint}/{DEV_ACCOUNT_NAME};"
+            ),
+            "AZURE_BLOB_CONTAINER": container,
+        }
+
+    def start(self, port: int = 0):
+        """
+        Serves the fake services on 127.0.0.1 from a background thread, on `port` or a free port.
+        """
+        config = uvicorn.Config(self.app, host="127.0.0.1", port=port, log_level="warning", access_log=False)
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._server.run, name="fake-azure-services", daemon=True)
+        self._thread.start()
+        while not self._server.started:
+            if not self._thread.is_alive():
+                raise RuntimeError("The fake Azure services failed to start")
+            time.sleep(0.01)
+        self.port = self._server.servers[0].sockets[0].getsockname()[1]
+
+    def stop(self):
+        """
+        Stops the server.
+        """
+        if self._server is not None:
+            self._server.should_exit = True
+            self._thread.join()
+            self._server = None
+
+
+# Example usage: serve the fake services and print the variables pointing the application at them
+#     python -m benchmarks.fake_azure_services --port 8900 > benchmark.env
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve local stand-ins for Azure OpenAI, Azure Search and Blob Storage.")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--first-token-latency", type=float, default=0.3, help="seconds before the first completion token")
+    parser.add_argument("--token-interval", type=float, default=0.01, help="seconds between completion tokens")
+    parser.add_argument("--completion-tokens", type=int, default=80)
+    parser.add_argument("--embedding-latency", type=float, default=0.05)
+    parser.add_argument("--search-latency", type=float, default=0.03)
+    arguments = parser.parse_args()
+
+    services = FakeAzureServices(
+        first_token_latency=arguments.first_token_latency,
+        token_interval=arguments.token_interval,
+        completion_tokens=arguments.completion_tokens,
+        embedding_latency=arguments.embedding_latency,
+        search_latency=arguments.search_latency,
+    )
+    services.start(arguments.port)
+    for name, value in services.environment().items():
+        print(f'{name}="{value}"', flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        services.stop()
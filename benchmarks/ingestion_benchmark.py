@@ -0,0 +1,114 @@
+import os
+import time
+import argparse
+import tempfile
+from benchmarks.corpus import generate_pdfs
+from benchmarks.fake_azure_services import FakeAzureServices
+from benchmarks.report import peak_memory_mb, parse_histogram_totals, print_stage_breakdown, finish, require_tiktoken_encoding
+
+# Results compared with the baseline, by direction
+HIGHER_IS_BETTER = ("documents_per_second", "pages_per_second", "chunks_per_second", "megabytes_per_second")
+LOWER_IS_BETTER = ("seconds", "peak_memory_mb")
+
+def run_benchmark(arguments) -> dict:
+    """
+    Ingests generated PDFs from the fake Blob Storage with the BulkIngestor and measures throughput.
+
+    The ingestion runs in this process against the fake services, into a local index (or the fake
+    Azure Search with `--backend azure`) created in a temporary directory, so every run starts cold.
+    Rates only count the documents that were ingested successfully.
+
+    Returns:
+    -------
+    dict
+        The throughput, stage durations and peak memory of the run.
+    """
+    require_tiktoken_encoding()
+    services = FakeAzureServices(embedding_latency=arguments.embedding_latency, search_documents=0)
+    services.start()
+    work_dir = tempfile.mkdtemp(prefix="ingestion-benchmark-")
+    os.environ.update(services.environment())
+    os.environ.update({
+        "RETRIEVER_BACKEND": arguments.backend,
+        "LOCAL_INDEX_DIR": os.path.join(work_dir, "local_index"),
+        "EMBEDDING_CACHE_PATH": os.path.join(work_dir, "embedding_cache.sqlite3"),
+        "INGEST_MANIFEST_PATH": os.path.join(work_dir, "ingest_manifest.sqlite3"),
+    })
+
+    print(f"Generating {arguments.documents} PDFs of {arguments.pages} pages...")
+    documents = generate_pdfs(arguments.documents, arguments.pages, arguments.words_per_page, arguments.seed)
+    for name, content in documents.items():
+        services.add_blob("benchmark", name, content)
+
+    try:
+        # Imported once the environment points at the fake services
+        from rag.BulkIngestor import BulkIngestor
+        from rag.PipelineMetrics import registry, EMBEDDING_REQUESTS_TOTAL
+
+        bulk_ingestor = BulkIngestor(checkpoint_path=os.path.join(work_dir, "checkpoint.jsonl"), workers=arguments.workers)
+        try:
+            started_at = time.perf_counter()
+            counts = bulk_ingestor.run(prefix="benchmark/")
+            seconds = time.perf_counter() - started_at
+            checkpoint = bulk_ingestor.load_checkpoint()
+        finally:
+            bulk_ingestor.close()
+    finally:
+        services.stop()
+
+    # Throughput of the documents that made it into the index
+    succeeded = [entry for entry in checkpoint.values() if entry["status"] == "succeeded"]
+    succeeded_bytes = sum(entry["size"] or 0 for entry in succeeded)
+    chunks = sum(entry.get("indexed", 0) for entry in succeeded)
+    results = {
+        "documents": len(succeeded),
+        "pages": len(succeeded) * arguments.pages,
+        "megabytes": succeeded_bytes / 1e6,
+        "chunks": chunks,
+        "failed": counts["failed"],
+        "seconds": seconds,
+        "documents_per_second": len(succeeded) / seconds,
+        "pages_per_second": len(succeeded) * arguments.pages / seconds,
+        "chunks_per_second": chunks / seconds,
+        "megabytes_per_second": succeeded_bytes / 1e6 / seconds,
+        "embedding_requests": EMBEDDING_REQUESTS_TOTAL.value(result="ok"),
+        "peak_memory_mb": peak_memory_mb(),
+        "peak_child_memory_mb": peak_memory_mb(children=True),
+        "stages": parse_histogram_totals(registry.render(), "legal_bot_ingest_stage_seconds"),
+    }
+
+    print()
+    print(f"Ingested {results['documents']} documents ({results['pages']} pages, {results['megabytes']:.1f} MB, {chunks:.0f} chunks) "
+          f"in {seconds:.2f}s with {arguments.workers} workers, {counts['failed']} failed")
+    print(f"  {results['documents_per_second']:.2f} docs/s, {results['pages_per_second']:.1f} pages/s, "
+          f"{results['chunks_per_second']:.1f} chunks/s, {results['megabytes_per_second']:.2f} MB/s, "
+          f"{results['embedding_requests']:.0f} embedding requests")
+    if results["peak_memory_mb"] is not None:
+        print(f"  peak memory {results['peak_memory_mb']:.0f} MB (extraction processes {results['peak_child_memory_mb']:.0f} MB)")
+    print_stage_breakdown("Stage durations:", results["stages"])
+    return results
+
+
+# Example usage: benchmark the ingestion of 50 generated 20-page PDFs and compare with a saved run
+#     python -m benchmarks.ingestion_benchmark --documents 50 --pages 20 --output ingestion.json
+#     python -m benchmarks.ingestion_benchmark --documents 50 --pages 20 --baseline ingestion.json
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark PDF ingestion against local stand-ins for Azure.")
+    parser.add_argument("--documents", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=10, help="pages per document")
+    parser.add_argument("--words-per-page", type=int, default=350)
+    parser.add_argument("--workers", type=int, default=4, help="documents ingested in parallel")
+    parser.add_argument("--backend", choices=("local", "azure"), default="local", help="index into the local index or the fake Azure Search")
+    parser.add_argument("--embedding-latency", type=float, default=0.05, help="seconds per fake embedding request")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="fail if the results regressed from this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression (0.2)")
+    arguments = parser.parse_args()
+
+    results = run_benchmark(arguments)
+    status = finish(results, arguments.output, arguments.baseline, arguments.tolerance, HIGHER_IS_BETTER, LOWER_IS_BETTER)
+    if results["failed"]:
+        print(f"FAILED: {results['failed']} documents could not be ingested")
+        status = 1
+    raise SystemExit(status)
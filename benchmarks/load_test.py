@@ -0,0 +1,299 @@
+import os
+import sys
+import json
+import time
+import shlex
+import socket
+import asyncio
+import secrets
+import argparse
+import itertools
+import subprocess
+import httpx
+from benchmarks.fake_azure_services import FakeAzureServices
+from benchmarks.report import percentile, peak_memory_mb, parse_histogram_totals, print_stage_breakdown, finish, require_tiktoken_encoding
+
+# Results compared with the baseline, by direction
+HIGHER_IS_BETTER = ("requests_per_second",)
+LOWER_IS_BETTER = ("p50_seconds", "p95_seconds", "p99_seconds", "error_rate", "server_peak_memory_mb")
+
+# Repository root, where `api.py` lives
+REPOSITORY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def load_queries(path: str) -> list:
+    """
+    Reads the queries to replay from a JSONL file: the `query` field of each line, or its `title`
+    for files of another shape such as `requests.jsonl`.
+    """
+    queries = []
+    with open(path) as queries_file:
+        for line in queries_file:
+            if line.strip():
+                entry = json.loads(line)
+                query = entry.get("query") or entry.get("title") or entry.get("body")
+                if query:
+                    queries.append(query)
+    if not queries:
+        raise ValueError(f"No queries found in {path}")
+    return queries
+
+def issue_tokens(users: int) -> list:
+    """
+    Issues one access token per simulated user, signed with AUTH_TOKEN_SECRET like those of `/auth`.
+    """
+    from db.user_auth import UserAuthenticator
+
+    authenticator = UserAuthenticator()
+    try:
+        return [authenticator.issue_token(f"load-test-{index}@example.com")["token"] for index in range(users)]
+    finally:
+        authenticator.close()
+
+def free_port() -> int:
+    """
+    Returns a TCP port that is free on 127.0.0.1.
+    """
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+def start_server(arguments, environment: dict) -> tuple:
+    """
+    Starts the application in a child process and waits until it answers.
+
+    Returns:
+    -------
+    tuple
+        The process and the base URL of the application.
+    """
+    port = free_port()
+    command = arguments.server_command.format(python=shlex.quote(sys.executable), port=port)
+    process = subprocess.Popen(shlex.split(command), cwd=REPOSITORY_DIR, env=environment)
+    url = f"http://127.0.0.1:{port}"
+
+    deadline = time.monotonic() + arguments.startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"The application exited during startup with status {process.returncode}")
+        try:
+            if httpx.get(f"{url}/metrics", timeout=1).status_code == 200:
+                return process, url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"The application did not answer within {arguments.startup_timeout}s")
+
+def stop_server(process) -> float:
+    """
+    Stops the application and returns its peak memory in MB.
+    """
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+    return peak_memory_mb(children=True)
+
+async def send_query(client: httpx.AsyncClient, query: str, token: str, stream: bool) -> dict:
+    """
+    Sends one query and measures it.
+
+    Returns:
+    -------
+    dict
+        The `outcome` ("ok", "rejected", "error" or the HTTP status), the `latency` and, for
+        streamed queries, the `first_token` latency, in seconds.
+    """
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    started_at = time.perf_counter()
+    first_token = None
+    try:
+        if stream:
+            async with client.stream("POST", "/legal-bot/stream", json={"query": query}, headers=headers) as response:
+                body = []
+                async for text in response.aiter_text():
+                    if first_token is None and "event: token" in text:
+                        first_token = time.perf_counter() - started_at
+                    body.append(text)
+                status = response.status_code
+                succeeded = status == 200 and "event: done" in "".join(body)
+        else:
+            response = await client.post("/legal-bot", json={"query": query}, headers=headers)
+            status = response.status_code
+            if status == 200:
+                # Rejections such as a missing token are reported in the body with an HTTP 200
+                status = response.json().get("status_code", status)
+            succeeded = status == 200
+    except httpx.HTTPError as e:
+        return {"outcome": f"error: {type(e).__name__}", "latency": time.perf_counter() - started_at, "first_token": None}
+
+    if succeeded:
+        outcome = "ok"
+    elif status in (429, 503):
+        outcome = f"rejected {status}"
+    else:
+        outcome = f"failed {status}"
+    return {"outcome": outcome, "latency": time.perf_counter() - started_at, "first_token": first_token}
+
+async def generate_load(url: str, queries: list, tokens: list, arguments) -> tuple:
+    """
+    Replays the queries from `concurrency` simulated clients, each sending its next query as soon
+    as the previous one is answered, until `requests` queries were sent or `duration` elapsed.
+
+    Returns:
+    -------
+    tuple
+        The measurement of each query and the elapsed seconds.
+    """
+    query_cycle = itertools.cycle(queries)
+    token_cycle = itertools.cycle(tokens or [None])
+    limits = httpx.Limits(max_connections=arguments.concurrency, max_keepalive_connections=arguments.concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=arguments.timeout) as client:
+        # Warm the connections and the application up before measuring
+        await asyncio.gather(*(send_query(client, next(query_cycle), next(token_cycle), arguments.stream) for _ in range(arguments.warmup)))
+
+        measurements = []
+        sent = 0
+        started_at = time.perf_counter()
+        deadline = started_at + arguments.duration if arguments.duration else None
+
+        async def simulated_client():
+            nonlocal sent
+            while (arguments.duration or sent < arguments.requests) and (deadline is None or time.perf_counter() < deadline):
+                sent += 1
+                measurements.append(await send_query(client, next(query_cycle), next(token_cycle), arguments.stream))
+
+        await asyncio.gather(*(simulated_client() for _ in range(arguments.concurrency)))
+        return measurements, time.perf_counter() - started_at
+
+def summarize(measurements: list, elapsed: float) -> dict:
+    """
+    Computes the throughput and latency percentiles of a run.
+    """
+    latencies = [measurement["latency"] for measurement in measurements if measurement["outcome"] == "ok"]
+    first_tokens = [measurement["first_token"] for measurement in measurements if measurement["first_token"] is not None]
+    outcomes = {}
+    for measurement in measurements:
+        outcomes[measurement["outcome"]] = outcomes.get(measurement["outcome"], 0) + 1
+    return {
+        "requests": len(measurements),
+        "succeeded": len(latencies),
+        "outcomes": outcomes,
+        "seconds": elapsed,
+        "requests_per_second": len(latencies) / elapsed if elapsed else 0.0,
+        "error_rate": 1 - len(latencies) / len(measurements) if measurements else 0.0,
+        "p50_seconds": percentile(latencies, 0.50),
+        "p95_seconds": percentile(latencies, 0.95),
+        "p99_seconds": percentile(latencies, 0.99),
+        "max_seconds": max(latencies, default=0.0),
+        "first_token_p50_seconds": percentile(first_tokens, 0.50) if first_tokens else None,
+        "first_token_p95_seconds": percentile(first_tokens, 0.95) if first_tokens else None,
+    }
+
+def run_load_test(arguments) -> dict:
+    """
+    Starts the fake Azure services and the application (unless `--url` targets a running one),
+    replays the queries and reports the results.
+    """
+    queries = load_queries(arguments.queries)
+    services = None
+    process = None
+    url = arguments.url
+    environment = dict(os.environ)
+
+    if url and not os.environ.get("AUTH_TOKEN_SECRET"):
+        print("AUTH_TOKEN_SECRET is not set: queries are sent without a token, so a server requiring "
+              "authentication rejects them all with 401. Export the server's AUTH_TOKEN_SECRET to sign tokens.")
+
+    if not url:
+        # The server embeds and packs with tiktoken, which cannot download its encoding offline
+        require_tiktoken_encoding()
+        services = FakeAzureServices(
+            first_token_latency=arguments.first_token_latency,
+            token_interval=arguments.token_interval,
+            completion_tokens=arguments.completion_tokens,
+            search_latency=arguments.search_latency,
+        )
+        services.start()
+        environment.update(services.environment())
+        environment.setdefault("AUTH_TOKEN_SECRET", secrets.token_hex(32))
+        # Every query runs the whole pipeline unless the semantic cache is asked for
+        environment["SEMANTIC_CACHE_ENABLED"] = "true" if arguments.semantic_cache else "false"
+        if arguments.raise_rate_limits:
+            environment.update({
+                "ADMISSION_GLOBAL_TOKENS_PER_MINUTE": "1000000000",
+                "ADMISSION_USER_TOKENS_PER_MINUTE": "1000000000",
+                "ADMISSION_MAX_CONCURRENT": str(max(arguments.concurrency, 64)),
+            })
+        # Tokens are signed with the secret of the application
+        os.environ["AUTH_TOKEN_SECRET"] = environment["AUTH_TOKEN_SECRET"]
+
+    tokens = issue_tokens(arguments.users) if os.environ.get("AUTH_TOKEN_SECRET") else []
+    server_memory = None
+    try:
+        if not url:
+            process, url = start_server(arguments, environment)
+        print(f"Replaying {len(queries)} queries against {url} from {arguments.concurrency} clients "
+              f"({'streamed' if arguments.stream else 'non-streamed'}, {len(tokens) or 'no'} users)...")
+        measurements, elapsed = asyncio.run(generate_load(url, queries, tokens, arguments))
+        metrics_text = httpx.get(f"{url}/metrics", timeout=10).text
+    finally:
+        if process is not None:
+            server_memory = stop_server(process)
+        if services is not None:
+            services.stop()
+
+    results = summarize(measurements, elapsed)
+    results["server_peak_memory_mb"] = server_memory
+    results["client_peak_memory_mb"] = peak_memory_mb()
+    results["server_stages"] = parse_histogram_totals(metrics_text, "legal_bot_query_stage_seconds")
+
+    print()
+    print(f"{results['requests']} requests in {elapsed:.2f}s: {results['requests_per_second']:.1f} successful requests/s, "
+          f"error rate {results['error_rate']:.1%}")
+    print("  outcomes: " + ", ".join(f"{outcome} {count}" for outcome, count in sorted(results["outcomes"].items())))
+    if results["outcomes"].get("failed 401") and not tokens:
+        print("  the 401s are queries sent without a token: export the server's AUTH_TOKEN_SECRET")
+    print(f"  latency p50 {results['p50_seconds'] * 1000:.0f}ms, p95 {results['p95_seconds'] * 1000:.0f}ms, "
+          f"p99 {results['p99_seconds'] * 1000:.0f}ms, max {results['max_seconds'] * 1000:.0f}ms")
+    if results["first_token_p50_seconds"] is not None:
+        print(f"  first token p50 {results['first_token_p50_seconds'] * 1000:.0f}ms, p95 {results['first_token_p95_seconds'] * 1000:.0f}ms")
+    if server_memory is not None:
+        print(f"  server peak memory {server_memory:.0f} MB")
+    print_stage_breakdown("Server-side stage durations (including warm-up):", results["server_stages"])
+    return results
+
+
+# Example usage: replay the queries of requests.jsonl from 32 clients and save the results as a baseline,
+# then fail a later run whose throughput or latency regressed by more than 20%
+#     python -m benchmarks.load_test --concurrency 32 --requests 1000 --output load.json
+#     python -m benchmarks.load_test --concurrency 32 --requests 1000 --baseline load.json
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the legal bot against local stand-ins for Azure.")
+    parser.add_argument("--queries", default=os.path.join(REPOSITORY_DIR, "requests.jsonl"), help="JSONL file of the queries to replay")
+    parser.add_argument("--concurrency", type=int, default=16, help="simulated clients sending queries back to back")
+    parser.add_argument("--requests", type=int, default=200, help="queries to send")
+    parser.add_argument("--duration", type=float, help="send queries for this many seconds instead")
+    parser.add_argument("--warmup", type=int, default=5, help="queries sent before measuring")
+    parser.add_argument("--stream", action="store_true", help="query /legal-bot/stream instead of /legal-bot")
+    parser.add_argument("--users", type=int, default=50, help="distinct users the queries are spread over")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--url", help="load test an application already running at this URL instead of starting one")
+    parser.add_argument("--server-command", default="{python} -m uvicorn api:app --host 127.0.0.1 --port {port}",
+                        help="command starting the application; {python} and {port} are substituted")
+    parser.add_argument("--startup-timeout", type=float, default=60)
+    parser.add_argument("--semantic-cache", action="store_true", help="keep the semantic answer cache enabled")
+    parser.add_argument("--raise-rate-limits", action="store_true", help="lift the admission control token rates")
+    parser.add_argument("--first-token-latency", type=float, default=0.3, help="seconds before the first fake completion token")
+    parser.add_argument("--token-interval", type=float, default=0.01, help="seconds between fake completion tokens")
+    parser.add_argument("--completion-tokens", type=int, default=80)
+    parser.add_argument("--search-latency", type=float, default=0.03)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="fail if the results regressed from this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression (0.2)")
+    arguments = parser.parse_args()
+
+    results = run_load_test(arguments)
+    raise SystemExit(finish(results, arguments.output, arguments.baseline, arguments.tolerance, HIGHER_IS_BETTER, LOWER_IS_BETTER))
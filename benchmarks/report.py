@@ -0,0 +1,135 @@
+import re
+import sys
+import json
+
+try:
+    import resource  # Unix only
+except ImportError:
+    resource = None
+
+def percentile(values: list, fraction: float) -> float:
+    """
+    Returns the percentile of `values` (e.g. 0.95 for p95), interpolating between ranks.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * fraction
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+def peak_memory_mb(children: bool = False) -> float:
+    """
+    Returns the peak resident memory of this process, or of its terminated child processes, in MB.
+    None where it cannot be measured.
+    """
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+def require_tiktoken_encoding(encoding_name: str = "cl100k_base"):
+    """
+    Loads a tiktoken encoding, exiting with instructions if it is not cached and cannot be
+    downloaded (tiktoken fetches encodings from the network on first use).
+    """
+    import tiktoken
+
+    try:
+        tiktoken.get_encoding(encoding_name)
+    except Exception as e:
+        raise SystemExit(
+            f"The tiktoken encoding {encoding_name} could not be loaded ({e}). On a machine with network access, run\n"
+            f"    TIKTOKEN_CACHE_DIR=<dir> python -c \"import tiktoken; tiktoken.get_encoding('{encoding_name}')\"\n"
+            f"then copy <dir> here and export TIKTOKEN_CACHE_DIR=<dir> before running the benchmark."
+        )
+
+def parse_histogram_totals(metrics_text: str, name: str) -> dict:
+    """
+    Extracts the count and sum of each series of a histogram from Prometheus text output.
+
+    Returns:
+    -------
+    dict
+        `{stage: {"count": int, "seconds": float}}` for a histogram labelled by stage.
+    """
+    totals = {}
+    pattern = re.compile(rf'^{name}_(sum|count)\{{stage="([^"]+)"\}} (\S+)$')
+    for line in metrics_text.splitlines():
+        match = pattern.match(line)
+        if match:
+            kind, stage, value = match.groups()
+            entry = totals.setdefault(stage, {"count": 0, "seconds": 0.0})
+            if kind == "count":
+                entry["count"] = int(float(value))
+            else:
+                entry["seconds"] = float(value)
+    return totals
+
+def print_stage_breakdown(title: str, totals: dict):
+    """
+    Prints the calls, total and mean seconds of each stage.
+    """
+    if not totals:
+        return
+    print(title)
+    for stage, entry in sorted(totals.items(), key=lambda item: -item[1]["seconds"]):
+        mean = entry["seconds"] / entry["count"] if entry["count"] else 0.0
+        print(f"  {stage:<14} {entry['count']:>8} calls {entry['seconds']:>10.3f}s total {mean * 1000:>10.1f}ms mean")
+
+def compare_to_baseline(results: dict, baseline_path: str, tolerance: float, higher_is_better: tuple, lower_is_better: tuple) -> list:
+    """
+    Compares benchmark results with those saved by a previous run.
+
+    Parameters:
+    ----------
+    results : dict
+        The results of this run.
+    baseline_path : str
+        JSON file of the baseline results (written with `--output`).
+    tolerance : float
+        Allowed relative degradation, e.g. 0.2 for 20%.
+    higher_is_better, lower_is_better : tuple of str
+        The compared result keys, by direction.
+
+    Returns:
+    -------
+    list
+        A description of each regression; empty if there is none.
+    """
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)
+
+    regressions = []
+    for key in higher_is_better:
+        if baseline.get(key) and results.get(key) is not None and results[key] < baseline[key] * (1 - tolerance):
+            regressions.append(f"{key} fell from {baseline[key]:.3f} to {results[key]:.3f}")
+    for key in lower_is_better:
+        if baseline.get(key) and results.get(key) is not None and results[key] > baseline[key] * (1 + tolerance):
+            regressions.append(f"{key} rose from {baseline[key]:.3f} to {results[key]:.3f}")
+    return regressions
+
+def finish(results: dict, output_path: str, baseline_path: str, tolerance: float, higher_is_better: tuple, lower_is_better: tuple) -> int:
+    """
+    Saves the results and checks them against the baseline.
+
+    Returns:
+    -------
+    int
+        The exit status: 1 if a result regressed beyond the tolerance, 0 otherwise.
+    """
+    if output_path:
+        with open(output_path, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+        print(f"Results written to {output_path}")
+    if not baseline_path:
+        return 0
+
+    regressions = compare_to_baseline(results, baseline_path, tolerance, higher_is_better, lower_is_better)
+    for regression in regressions:
+        print(f"REGRESSION: {regression}")
+    if not regressions:
+        print(f"No regression beyond {tolerance:.0%} of {baseline_path}")
+    return 1 if regressions else 0
@@ -0,0 +1,198 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+import psycopg2
+from psycopg2 import pool, extensions
+
+class PooledConnection(extensions.connection):
+    """
+    psycopg2 connection remembering when it was last returned to the pool. The timestamp lives
+    and dies with the connection, including the connections the pool closes on its own.
+    """
+
+    last_used = 0.0
+
+class PostgresDatabase:
+    """
+    Class for accessing the PostgreSQL database through a shared connection pool.
+
+    The pool is opened once at application startup, together with the schema migrations, so
+    requests reuse connections instead of paying a connection (and TLS) handshake each time.
+    Callers wait for a free connection when all of them are in use, which caps the number of
+    connections opened against Postgres during traffic spikes. A connection that stayed idle for
+    longer than the health-check interval is pinged before being handed out, and broken
+    connections are discarded.
+
+    Attributes:
+        conn_params (dict): The psycopg2 connection parameters.
+        min_connections (int): Connections kept open by the pool.
+        max_connections (int): Maximum number of open connections.
+        acquire_timeout (float): Seconds to wait for a free connection before failing.
+        health_check_interval (float): Idle seconds after which a connection is pinged before use.
+
+    Methods:
+        open(): Opens the pool and migrates the schema.
+        connection(): Context manager lending a pooled connection.
+        health_check(): Tells whether the database answers.
+        close(): Closes every pooled connection.
+    """
+
+    # Schema migrations applied once, in order; applied versions are recorded in schema_migrations
+    MIGRATIONS = [
+        (1, "CREATE TABLE IF NOT EXISTS users (email VARCHAR(255) PRIMARY KEY, password VARCHAR(255), first_name VARCHAR(255), last_name VARCHAR(255));"),
+    ]
+
+    # Key of the advisory lock serializing migrations across application workers
+    MIGRATION_LOCK_KEY = 7_318_205
+
+    def __init__(self, conn_params: dict):
+        """
+        Initializes the database access. The pool is opened by `open` or on first use.
+
+        Retrieves:
+            - POSTGRES_POOL_MIN / POSTGRES_POOL_MAX: Pool bounds (1, 10).
+            - POSTGRES_POOL_TIMEOUT: Seconds to wait for a free connection (10).
+            - POSTGRES_HEALTH_CHECK_INTERVAL: Idle seconds before a connection is pinged (30).
+
+        Args:
+            conn_params (dict): The psycopg2 connection parameters.
+        """
+        self.conn_params = conn_params
+        self.min_connections = int(os.getenv("POSTGRES_POOL_MIN", "1"))
+        self.max_connections = int(os.getenv("POSTGRES_POOL_MAX", "10"))
+        self.acquire_timeout = float(os.getenv("POSTGRES_POOL_TIMEOUT", "10"))
+        self.health_check_interval = float(os.getenv("POSTGRES_HEALTH_CHECK_INTERVAL", "30"))
+
+        self._pool = None
+        self._lock = threading.Lock()
+        # The pool raises when exhausted, so callers queue on this semaphore instead
+        self._available = threading.BoundedSemaphore(self.max_connections)
+
+    def open(self):
+        """
+        Opens the pool and applies the pending schema migrations. Called at application startup;
+        if the database is unreachable the error is raised and `open` is retried on first use.
+        """
+        with self._lock:
+            if self._pool is not None:
+                return
+            connection_pool = pool.ThreadedConnectionPool(
+                self.min_connections, self.max_connections, connection_factory=PooledConnection, **self.conn_params
+            )
+            try:
+                self._migrate(connection_pool)
+            except Exception:
+                connection_pool.closeall()
+                raise
+            self._pool = connection_pool
+            print("Connected to the database!")
+
+    def _migrate(self, connection_pool):
+        """
+        Applies the migrations that were not applied yet, under an advisory lock so that several
+        application workers starting together do not run them concurrently.
+        """
+        conn = connection_pool.getconn()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_xact_lock(%s);", (self.MIGRATION_LOCK_KEY,))
+                cursor.execute("CREATE TABLE IF NOT EXISTS schema_migrations (version INTEGER PRIMARY KEY, applied_at TIMESTAMPTZ NOT NULL DEFAULT now());")
+                cursor.execute("SELECT version FROM schema_migrations;")
+                applied_versions = {row[0] for row in cursor.fetchall()}
+                for version, statement in self.MIGRATIONS:
+                    if version not in applied_versions:
+                        cursor.execute(statement)
+                        cursor.execute("INSERT INTO schema_migrations (version) VALUES (%s);", (version,))
+                        print(f"Applied database migration {version}")
+            # Committing also releases the advisory lock
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            connection_pool.putconn(conn)
+
+    def _is_healthy(self, conn) -> bool:
+        """
+        Tells whether a pooled connection can still be used, pinging it if it was idle for long.
+        """
+        if conn.closed:
+            return False
+        if time.monotonic() - conn.last_used < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1;")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    @contextmanager
+    def connection(self):
+        """
+        Lends a pooled connection for the duration of a `with` block.
+
+        Work left uncommitted at the end of the block is rolled back. A connection broken during
+        the block is closed instead of being returned to the pool.
+
+        Yields:
+            connection: A psycopg2 connection.
+
+        Raises:
+            TimeoutError: If no connection became free within the acquire timeout.
+        """
+        if self._pool is None:
+            self.open()
+        if not self._available.acquire(timeout=self.acquire_timeout):
+            raise TimeoutError("No database connection available")
+
+        conn = None
+        broken = False
+        try:
+            # Replace connections that went stale while idle in the pool
+            conn = self._pool.getconn()
+            while not self._is_healthy(conn):
+                stale_conn, conn = conn, None
+                self._pool.putconn(stale_conn, close=True)
+                conn = self._pool.getconn()
+
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            if conn is not None:
+                broken = broken or conn.closed
+                if not broken and conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                conn.last_used = time.monotonic()
+                self._pool.putconn(conn, close=broken)
+            self._available.release()
+
+    def health_check(self) -> bool:
+        """
+        Tells whether the database answers a query through the pool.
+
+        Returns:
+            bool: True if the database is reachable.
+        """
+        try:
+            with self.connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT 1;")
+            return True
+        except Exception as e:
+            print("Database health check failed:", e)
+            return False
+
+    def close(self):
+        """
+        Closes every pooled connection.
+        """
+        with self._lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+                print("Connection closed.")
@@ -0,0 +1,216 @@
+import os
+import hmac
+import json
+import time
+import base64
+import hashlib
+import secrets
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+class UserAuthenticator:
+    """
+    Class for authenticating users against the `users` table and issuing signed access tokens.
+
+    Passwords are stored as salted PBKDF2-SHA256 hashes. Hashing is deliberately slow, so it runs
+    in a dedicated thread pool and never blocks the event loop. A successful login returns a token
+    signed with HMAC-SHA256 that carries the user's email and expiry: endpoints validate it
+    locally, without a database round trip, and recently validated tokens are kept in a bounded
+    LRU so repeated requests only cost a dictionary lookup.
+
+    Attributes:
+        token_ttl (float): Lifetime of an issued token in seconds.
+        iterations (int): PBKDF2 iterations of new password hashes.
+        session_cache_size (int): Maximum number of validated tokens kept in the LRU.
+
+    Methods:
+        hash_password(password): Hashes a password for storage.
+        verify_password(password, stored): Checks a password against its stored hash.
+        authenticate(postgres, email, password): Verifies credentials and issues a token.
+        validate_token(token): Returns the email of a valid token.
+    """
+
+    HASH_SCHEME = "pbkdf2_sha256"
+
+    def __init__(self, require_secret: bool = False):
+        """
+        Initializes the authenticator.
+
+        Args:
+            require_secret (bool): Whether AUTH_TOKEN_SECRET must be set. Without a shared secret,
+                every worker signs tokens with its own random key, so a token is rejected by the
+                other workers and after a restart.
+
+        Retrieves:
+            - AUTH_TOKEN_SECRET: Key signing the tokens. Must be shared by all application workers;
+              unless it is required, a random key is generated if it is not set, invalidating
+              tokens on restart.
+            - AUTH_TOKEN_TTL: Token lifetime in seconds (3600).
+            - AUTH_PBKDF2_ITERATIONS: PBKDF2 iterations of new password hashes (200000).
+            - AUTH_HASH_WORKERS: Threads hashing passwords (4).
+            - AUTH_SESSION_CACHE_SIZE: Validated tokens kept in memory (10000).
+
+        Raises:
+            ValueError: If the secret is required and AUTH_TOKEN_SECRET is not set.
+        """
+        secret = os.environ.get("AUTH_TOKEN_SECRET")
+        if not secret:
+            if require_secret:
+                raise ValueError("Missing required environment variable: AUTH_TOKEN_SECRET must be set when AUTH_REQUIRED is true.")
+            print("AUTH_TOKEN_SECRET is not set, tokens will not survive a restart")
+            secret = secrets.token_hex(32)
+        self._secret = secret.encode("utf-8")
+        self.token_ttl = float(os.getenv("AUTH_TOKEN_TTL", "3600"))
+        self.iterations = int(os.getenv("AUTH_PBKDF2_ITERATIONS", "200000"))
+        self.session_cache_size = int(os.getenv("AUTH_SESSION_CACHE_SIZE", "10000"))
+
+        self._hash_executor = ThreadPoolExecutor(max_workers=int(os.getenv("AUTH_HASH_WORKERS", "4")), thread_name_prefix="password-hash")
+        self._sessions = OrderedDict()  # token -> (email, expires_at), least recently used first
+        self._lock = threading.Lock()
+        # Hash checked when the user does not exist, so unknown emails take as long as wrong passwords
+        self._dummy_hash = self.hash_password(secrets.token_hex(16))
+
+    @staticmethod
+    def _b64encode(data: bytes) -> str:
+        """
+        Encodes bytes as unpadded URL-safe base64.
+        """
+        return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+    @staticmethod
+    def _b64decode(text: str) -> bytes:
+        """
+        Decodes unpadded URL-safe base64.
+        """
+        return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+    def hash_password(self, password: str) -> str:
+        """
+        Hashes a password for storage.
+
+        Args:
+            password (str): The plain-text password.
+
+        Returns:
+            str: The hash as "pbkdf2_sha256$<iterations>$<salt>$<digest>".
+        """
+        salt = secrets.token_bytes(16)
+        digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, self.iterations)
+        return f"{self.HASH_SCHEME}${self.iterations}${self._b64encode(salt)}${self._b64encode(digest)}"
+
+    def verify_password(self, password: str, stored: str) -> bool:
+        """
+        Checks a password against its stored hash. Passwords stored in plain text before hashing
+        was introduced are compared directly.
+
+        Args:
+            password (str): The plain-text password.
+            stored (str): The stored hash.
+
+        Returns:
+            bool: True if the password matches.
+        """
+        if not stored.startswith(self.HASH_SCHEME + "$"):
+            return hmac.compare_digest(password.encode("utf-8"), stored.encode("utf-8"))
+        _, iterations, salt, digest = stored.split("$")
+        computed = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), self._b64decode(salt), int(iterations))
+        return hmac.compare_digest(computed, self._b64decode(digest))
+
+    def _check_credentials(self, postgres, email: str, password: str) -> bool:
+        """
+        Looks up the user and verifies the password, upgrading plain-text passwords to hashes.
+        Runs in the hashing thread pool.
+        """
+        with postgres.connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT password FROM users WHERE email = %s;", (email,))
+                row = cursor.fetchone()
+
+            if row is None or row[0] is None:
+                self.verify_password(password, self._dummy_hash)
+                return False
+            if not self.verify_password(password, row[0]):
+                return False
+
+            if not row[0].startswith(self.HASH_SCHEME + "$"):
+                with conn.cursor() as cursor:
+                    cursor.execute("UPDATE users SET password = %s WHERE email = %s;", (self.hash_password(password), email))
+                conn.commit()
+            return True
+
+    def issue_token(self, email: str) -> dict:
+        """
+        Issues a signed token for a user.
+
+        Args:
+            email (str): The authenticated user's email.
+
+        Returns:
+            dict: The `token` and its `expires_at` Unix time.
+        """
+        expires_at = int(time.time() + self.token_ttl)
+        payload = self._b64encode(json.dumps({"sub": email, "exp": expires_at}, separators=(",", ":")).encode("utf-8"))
+        signature = self._b64encode(hmac.new(self._secret, payload.encode("ascii"), hashlib.sha256).digest())
+        return {"token": f"{payload}.{signature}", "expires_at": expires_at}
+
+    async def authenticate(self, postgres, email: str, password: str) -> dict:
+        """
+        Verifies credentials against the `users` table and issues a token.
+
+        Args:
+            postgres (PostgresDatabase): The database pool.
+            email (str): The user's email.
+            password (str): The user's password.
+
+        Returns:
+            dict: The `token` and its `expires_at`, or None if the credentials are invalid.
+        """
+        loop = asyncio.get_running_loop()
+        valid = await loop.run_in_executor(self._hash_executor, self._check_credentials, postgres, email, password)
+        return self.issue_token(email) if valid else None
+
+    def validate_token(self, token: str) -> str:
+        """
+        Validates a token locally.
+
+        Args:
+            token (str): The token returned by `/auth`.
+
+        Returns:
+            str: The email of the token's user, or None if the token is invalid or expired.
+        """
+        now = time.time()
+        with self._lock:
+            session = self._sessions.get(token)
+            if session is not None:
+                if session[1] > now:
+                    self._sessions.move_to_end(token)
+                    return session[0]
+                del self._sessions[token]
+                return None
+
+        try:
+            payload, signature = token.split(".")
+            expected = hmac.new(self._secret, payload.encode("ascii"), hashlib.sha256).digest()
+            if not hmac.compare_digest(self._b64decode(signature), expected):
+                return None
+            claims = json.loads(self._b64decode(payload))
+            email, expires_at = claims["sub"], claims["exp"]
+        except (ValueError, KeyError, TypeError, UnicodeEncodeError):
+            return None
+        if expires_at <= now:
+            return None
+
+        with self._lock:
+            self._sessions[token] = (email, expires_at)
+            if len(self._sessions) > self.session_cache_size:
+                self._sessions.popitem(last=False)
+        return email
+
+    def close(self):
+        """
+        Stops the hashing threads.
+        """
+        self._hash_executor.shutdown(wait=False)
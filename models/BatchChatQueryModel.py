@@ -0,0 +1,63 @@
+import os
+from typing import List, Optional
+from pydantic import BaseModel, Field, validator
+
+# Maximum number of queries in a single batch request
+BATCH_QUERY_MAX_SIZE = int(os.getenv("BATCH_QUERY_MAX_SIZE", "50"))
+
+class BatchChatQueryModel(BaseModel):
+    """
+    This model is used to validate and structure the data for a batch of chatbot queries.
+    It ensures that between one and BATCH_QUERY_MAX_SIZE queries are provided and that the optional
+    concurrency limit is positive.
+
+    Attributes:
+        queries (List[str]): The user queries to be processed by the chatbot, at most BATCH_QUERY_MAX_SIZE (50).
+        concurrency (Optional[int]): Maximum number of queries processed at the same time.
+                                     Defaults to the BATCH_QUERY_CONCURRENCY setting of the server.
+
+    Example:
+        batch_data = BatchChatQueryModel(queries=["question 1", "question 2"], concurrency=4)
+
+    Raises:
+        ValidationError: If the input data does not conform to the required schema.
+    """
+
+    queries: List[str] = Field(..., max_length=BATCH_QUERY_MAX_SIZE)
+    concurrency: Optional[int] = None
+
+    @validator('queries')
+    def validate_queries(cls, v):
+        """
+        Ensures that at least one query is provided.
+
+        Args:
+            v (List[str]): The value of the `queries` field to be validated.
+
+        Returns:
+            List[str]: The validated queries.
+
+        Raises:
+            ValueError: If the list of queries is empty.
+        """
+        if not v:
+            raise ValueError('At least one query is required')
+        return v
+
+    @validator('concurrency')
+    def validate_concurrency(cls, v):
+        """
+        Ensures that the concurrency limit, if provided, is a positive number.
+
+        Args:
+            v (Optional[int]): The value of the `concurrency` field to be validated.
+
+        Returns:
+            Optional[int]: The validated concurrency limit.
+
+        Raises:
+            ValueError: If the concurrency limit is less than 1.
+        """
+        if v is not None and v < 1:
+            raise ValueError('Concurrency must be at least 1')
+        return v
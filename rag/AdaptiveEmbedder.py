@@ -0,0 +1,234 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from openai import RateLimitError, APIConnectionError, APITimeoutError, InternalServerError
+from rag.PipelineMetrics import EMBEDDING_REQUESTS_TOTAL
+
+class AdaptiveEmbedder:
+    """
+    Embeds chunk texts with batched, concurrent Azure OpenAI requests that adapt to the service.
+
+    Texts are grouped into batches bounded by an estimated number of tokens and of inputs, and the
+    batches are sent by a pool of threads. The token budget of a batch and the number of requests
+    in flight are tuned as requests complete:
+    - a throttled request (429) halves the concurrency and the batch budget, and the batch is
+      retried after the delay requested by the service. The requests already in flight when the
+      limits were halved were sent under the old limits, so their 429s do not halve them again:
+      the limits are halved at most once per round of requests;
+    - a request slower than the target latency lowers the concurrency by one and shrinks the budget;
+    - a fast request raises the concurrency by one and grows the budget, up to their maximums.
+
+    The limits are shared by every caller, so concurrent ingestion jobs back off together.
+
+    Throttled and transient errors are retried here, where the delay requested by the service is
+    known; callers should not retry the errors raised once these retries are exhausted.
+
+    Attributes:
+    ----------
+    concurrency : int
+        Current number of requests allowed in flight.
+    batch_tokens : int
+        Current token budget of a batch.
+    requests : int
+        Number of embedding requests sent.
+    throttled : int
+        Number of requests rejected with a 429.
+    """
+
+    # Errors retried without adapting the limits
+    TRANSIENT_ERRORS = (APIConnectionError, APITimeoutError, InternalServerError)
+
+    def __init__(self, embeddings):
+        """
+        Initializes the embedder.
+
+        It reads the following environment variables:
+        - EMBEDDING_CONCURRENCY / EMBEDDING_MAX_CONCURRENCY: initial and maximum requests in flight (4, 16).
+        - EMBEDDING_BATCH_TOKENS / EMBEDDING_BATCH_MAX_TOKENS: initial and maximum token budget of a batch (8000, 32000).
+        - EMBEDDING_BATCH_MAX_INPUTS: maximum number of texts per request (256).
+        - EMBEDDING_TARGET_LATENCY: request latency in seconds above which the load is reduced (5).
+        - EMBEDDING_MAX_RETRIES: attempts of a batch after the first one (6).
+
+        Parameters:
+        ----------
+        embeddings : AzureOpenAIEmbeddings
+            The embedding client, preferably with `max_retries=0` so throttling is seen here.
+        """
+        self.embeddings = embeddings
+        self.max_concurrency = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "16"))
+        self.concurrency = min(int(os.getenv("EMBEDDING_CONCURRENCY", "4")), self.max_concurrency)
+        self.max_batch_tokens = int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", "32000"))
+        self.batch_tokens = min(int(os.getenv("EMBEDDING_BATCH_TOKENS", "8000")), self.max_batch_tokens)
+        self.max_batch_inputs = int(os.getenv("EMBEDDING_BATCH_MAX_INPUTS", "256"))
+        self.target_latency = float(os.getenv("EMBEDDING_TARGET_LATENCY", "5"))
+        self.max_retries = int(os.getenv("EMBEDDING_MAX_RETRIES", "6"))
+        self.requests = 0
+        self.throttled = 0
+
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        self._decrease_epoch = 0  # incremented each time a 429 halves the limits
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="embedding")
+
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        """
+        Estimates the number of tokens of a text (about four characters per token in English).
+        """
+        return len(text) // 4 + 1
+
+    def _next_batch_end(self, texts: list, start: int) -> int:
+        """
+        Returns the end of the batch starting at `start`, within the current token budget.
+        """
+        budget = self.batch_tokens
+        end = start
+        tokens = 0
+        while end < len(texts) and end - start < self.max_batch_inputs:
+            tokens += self.estimate_tokens(texts[end])
+            # A batch always holds at least one text
+            if tokens > budget and end > start:
+                break
+            end += 1
+        return end
+
+    def _acquire(self):
+        """
+        Waits until another request may be sent.
+        """
+        with self._condition:
+            while self._in_flight >= self.concurrency:
+                self._condition.wait()
+            self._in_flight += 1
+
+    def _release(self):
+        """
+        Frees the slot of a finished request.
+        """
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    def _on_throttled(self, epoch: int):
+        """
+        Multiplicative decrease after a 429, unless the limits were already halved since the
+        request was sent.
+
+        Parameters:
+        ----------
+        epoch : int
+            The decrease epoch when the throttled request was sent.
+        """
+        with self._condition:
+            self.throttled += 1
+            if epoch != self._decrease_epoch:
+                return
+            self._decrease_epoch += 1
+            self.concurrency = max(1, self.concurrency // 2)
+            self.batch_tokens = max(1, self.batch_tokens // 2)
+
+    def _on_success(self, latency: float):
+        """
+        Adjusts the limits from the latency of a successful request.
+        """
+        with self._condition:
+            if latency > self.target_latency:
+                self.concurrency = max(1, self.concurrency - 1)
+                self.batch_tokens = max(1, int(self.batch_tokens * 0.8))
+            else:
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+                self.batch_tokens = min(self.max_batch_tokens, int(self.batch_tokens * 1.25) + 1)
+            self._condition.notify_all()
+
+    @staticmethod
+    def _retry_delay(error: Exception, attempt: int) -> float:
+        """
+        Returns the delay before retrying a request: the one requested by the service, if any,
+        or an exponential backoff.
+        """
+        response = getattr(error, "response", None)
+        if response is not None:
+            if response.headers.get("retry-after-ms"):
+                return float(response.headers["retry-after-ms"]) / 1000
+            if response.headers.get("retry-after", "").replace(".", "", 1).isdigit():
+                return float(response.headers["retry-after"])
+        return min(0.5 * (2 ** attempt), 30.0)
+
+    def _embed_batch(self, texts: list, start: int, end: int, results: list):
+        """
+        Embeds `texts[start:end]` into `results[start:end]`, retrying throttled and transient errors.
+        The caller acquired a request slot, which is released here.
+        """
+        try:
+            for attempt in range(self.max_retries + 1):
+                with self._condition:
+                    self.requests += 1
+                    epoch = self._decrease_epoch
+                started_at = time.monotonic()
+                try:
+                    embeddings = self.embeddings.embed_documents(texts[start:end], chunk_size=end - start)
+                except RateLimitError as e:
+                    EMBEDDING_REQUESTS_TOTAL.inc(result="throttled")
+                    if attempt == self.max_retries:
+                        raise
+                    self._on_throttled(epoch)
+                    error = e
+                except self.TRANSIENT_ERRORS as e:
+                    EMBEDDING_REQUESTS_TOTAL.inc(result="error")
+                    if attempt == self.max_retries:
+                        raise
+                    error = e
+                else:
+                    EMBEDDING_REQUESTS_TOTAL.inc(result="ok")
+                    self._on_success(time.monotonic() - started_at)
+                    results[start:end] = embeddings
+                    return
+
+                # Free the slot while waiting, so the lowered concurrency applies to the retry too
+                self._release()
+                time.sleep(self._retry_delay(error, attempt))
+                self._acquire()
+        finally:
+            self._release()
+
+    def embed(self, texts: list) -> list:
+        """
+        Embeds texts.
+
+        Parameters:
+        ----------
+        texts : list of str
+            The texts to embed.
+
+        Returns:
+        -------
+        list
+            The embedding of each text, in order.
+
+        Raises:
+        ------
+        Exception
+            The error of the first batch that failed after its retries.
+        """
+        results = [None] * len(texts)
+        futures = []
+        start = 0
+        while start < len(texts):
+            # Stop sending batches once one has failed
+            if any(future.done() and future.exception() for future in futures):
+                break
+            self._acquire()
+            end = self._next_batch_end(texts, start)
+            futures.append(self._executor.submit(self._embed_batch, texts, start, end, results))
+            start = end
+
+        for future in futures:
+            future.result()
+        return results
+
+    def close(self):
+        """
+        Stops the request threads once their batches are done. Call once no embedding is running.
+        """
+        self._executor.shutdown(wait=True)
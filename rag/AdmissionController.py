@@ -0,0 +1,316 @@
+import os
+import time
+import asyncio
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from rag.PipelineMetrics import ADMISSION_DECISIONS_TOTAL
+
+class AdmissionRejected(Exception):
+    """
+    Raised when a request is shed by the AdmissionController.
+
+    Attributes:
+    ----------
+    status_code : int
+        429 when the user exceeded their rate, 503 when the service is saturated.
+    retry_after : float
+        Suggested delay before retrying, in seconds.
+    """
+
+    def __init__(self, status_code: int, message: str, retry_after: float):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+        self.retry_after = retry_after
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at `rate` tokens per second, up to `capacity`.
+    """
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = now
+
+    def refill(self, now: float):
+        """
+        Adds the tokens accumulated since the last refill.
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def time_until(self, cost: float, now: float) -> float:
+        """
+        Returns the seconds until `cost` tokens are available, 0 if they are now.
+        """
+        self.refill(now)
+        return max(0.0, (cost - self.tokens) / self.rate) if self.rate > 0 else (0.0 if self.tokens >= cost else float("inf"))
+
+class AdmissionController:
+    """
+    Admission control in front of the chatbot: decides whether a query may call Azure OpenAI now,
+    after a short wait, or must be rejected.
+
+    Every query is weighted by its estimated prompt and completion tokens and must take that many
+    tokens from both its user's bucket and the global bucket, which refill at the configured
+    tokens-per-minute rates. At most `max_concurrent` queries run at once. Queries that cannot be
+    admitted immediately wait in a bounded FIFO queue until their deadline; they are admitted in
+    order as tokens refill and running queries finish, except that a waiter held back only by its
+    own user's bucket does not block other users. A query answered from the semantic answer cache,
+    or by joining an identical query in flight, gets its context and completion tokens back (see
+    `refund_cached`). Requests are shed immediately, instead of piling
+    up, when:
+    - the query is larger than a bucket, so it could never be admitted (413);
+    - the user's bucket cannot cover the query before the deadline (429);
+    - the wait queue is full (503);
+    - the deadline passes while waiting (503).
+
+    The controller runs on the event loop and is not thread-safe.
+
+    Attributes:
+    ----------
+    max_concurrent : int
+        Maximum number of admitted queries running at once.
+    max_queue : int
+        Maximum number of waiting queries.
+    queue_timeout : float
+        Maximum wait of a query before it is rejected, in seconds.
+    admitted : int
+        Number of admitted queries.
+    rejected : int
+        Number of rejected queries.
+    """
+
+    def __init__(self):
+        """
+        Initializes the controller.
+
+        It reads the following environment variables:
+        - ADMISSION_GLOBAL_TOKENS_PER_MINUTE: Global token rate, e.g. the deployment quota (120000).
+        - ADMISSION_USER_TOKENS_PER_MINUTE: Token rate of each user (20000).
+        - ADMISSION_BURST_SECONDS: Seconds of rate the buckets can accumulate (60).
+        - ADMISSION_MAX_CONCURRENT: Queries running at once (64).
+        - ADMISSION_QUEUE_SIZE / ADMISSION_QUEUE_TIMEOUT: Waiting queries and their maximum wait (100, 10).
+        - ADMISSION_COMPLETION_TOKENS: Completion tokens expected per query (500).
+        - ADMISSION_MAX_USERS: Per-user buckets kept in memory (10000).
+        """
+        burst_seconds = float(os.getenv("ADMISSION_BURST_SECONDS", "60"))
+        self.global_rate = float(os.getenv("ADMISSION_GLOBAL_TOKENS_PER_MINUTE", "120000")) / 60
+        self.user_rate = float(os.getenv("ADMISSION_USER_TOKENS_PER_MINUTE", "20000")) / 60
+        self.global_capacity = self.global_rate * burst_seconds
+        self.user_capacity = self.user_rate * burst_seconds
+        self.max_concurrent = int(os.getenv("ADMISSION_MAX_CONCURRENT", "64"))
+        self.max_queue = int(os.getenv("ADMISSION_QUEUE_SIZE", "100"))
+        self.queue_timeout = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10"))
+        self.completion_tokens = int(os.getenv("ADMISSION_COMPLETION_TOKENS", "500"))
+        self.context_tokens = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+        self.max_users = int(os.getenv("ADMISSION_MAX_USERS", "10000"))
+
+        self.admitted = 0
+        self.rejected = 0
+        self._global_bucket = TokenBucket(self.global_rate, self.global_capacity, time.monotonic())
+        self._user_buckets = OrderedDict()  # user -> TokenBucket, least recently used first
+        self._waiters = deque()
+        self._running = 0
+        self._drain_timer = None
+
+    def estimate_cost(self, query: str) -> int:
+        """
+        Estimates the tokens a query will consume: the question (about four characters per
+        token), the packed context and the completion.
+
+        Args:
+            query (str): The user's query.
+
+        Returns:
+            int: The estimated number of tokens.
+        """
+        return len(query) // 4 + 1 + self.context_tokens + self.completion_tokens
+
+    def _user_bucket(self, user: str, now: float) -> TokenBucket:
+        """
+        Returns the bucket of a user, creating it full on their first query.
+        """
+        bucket = self._user_buckets.get(user)
+        if bucket is None:
+            bucket = self._user_buckets[user] = TokenBucket(self.user_rate, self.user_capacity, now)
+            # Forget the least recently seen users; a forgotten user starts again with a full bucket
+            while len(self._user_buckets) > self.max_users:
+                self._user_buckets.popitem(last=False)
+        else:
+            self._user_buckets.move_to_end(user)
+        return bucket
+
+    def _reject(self, status_code: int, message: str, retry_after: float):
+        """
+        Counts and raises a rejection.
+        """
+        self.rejected += 1
+        ADMISSION_DECISIONS_TOTAL.inc(result=f"rejected_{status_code}")
+        raise AdmissionRejected(status_code, message, retry_after)
+
+    def _try_admit(self, user_bucket: TokenBucket, cost: float, now: float) -> bool:
+        """
+        Admits a query if a slot and both buckets allow it.
+        """
+        if self._running >= self.max_concurrent:
+            return False
+        if self._global_bucket.time_until(cost, now) > 0 or user_bucket.time_until(cost, now) > 0:
+            return False
+        self._global_bucket.tokens -= cost
+        user_bucket.tokens -= cost
+        self._running += 1
+        self.admitted += 1
+        ADMISSION_DECISIONS_TOTAL.inc(result="admitted")
+        return True
+
+    def _drain(self):
+        """
+        Admits the waiting queries that can run now, in order, and schedules the next attempt.
+        """
+        self._drain_timer = None
+        now = time.monotonic()
+        next_attempt = None
+        for waiter in list(self._waiters):
+            if waiter["future"].done():
+                self._waiters.remove(waiter)
+                continue
+            if self._running >= self.max_concurrent:
+                # A finishing query drains the queue again
+                break
+            global_wait = self._global_bucket.time_until(waiter["cost"], now)
+            if global_wait > 0:
+                # Keep the global order: later waiters must not take the tokens this one is waiting for
+                next_attempt = global_wait if next_attempt is None else min(next_attempt, global_wait)
+                break
+            user_wait = waiter["user_bucket"].time_until(waiter["cost"], now)
+            if user_wait > 0:
+                next_attempt = user_wait if next_attempt is None else min(next_attempt, user_wait)
+                continue
+            self._try_admit(waiter["user_bucket"], waiter["cost"], now)
+            self._waiters.remove(waiter)
+            waiter["future"].set_result(True)
+
+        if next_attempt is not None and self._waiters:
+            self._drain_timer = asyncio.get_running_loop().call_later(max(next_attempt, 0.001), self._drain)
+
+    def _schedule_drain(self):
+        """
+        Drains the queue on the next event loop iteration.
+        """
+        if self._drain_timer is not None:
+            self._drain_timer.cancel()
+        self._drain_timer = asyncio.get_running_loop().call_soon(self._drain)
+
+    def _releaser(self):
+        """
+        Returns a callable releasing one admission, that does nothing when called again.
+        """
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                self.release()
+        return release
+
+    async def acquire(self, user: str, cost: float):
+        """
+        Waits until a query may run, or rejects it.
+
+        Args:
+            user (str): Identifies the user whose rate is charged.
+            cost (float): The estimated tokens of the query (see `estimate_cost`).
+
+        Returns:
+            callable: Releases the admission once the query has finished; further calls are ignored.
+
+        Raises:
+            AdmissionRejected: If the query is shed.
+        """
+        # A query larger than a bucket could never be admitted
+        if cost > min(self.user_capacity, self.global_capacity):
+            self._reject(413, "Query exceeds the token rate limit", 0.0)
+        now = time.monotonic()
+        user_bucket = self._user_bucket(user, now)
+
+        user_wait = user_bucket.time_until(cost, now)
+        if user_wait > self.queue_timeout:
+            self._reject(429, "Rate limit exceeded, retry later", user_wait)
+
+        if not self._waiters and self._try_admit(user_bucket, cost, now):
+            return self._releaser()
+
+        if len(self._waiters) >= self.max_queue:
+            self._reject(503, "Service overloaded, retry later", max(user_wait, 1.0))
+
+        waiter = {"user_bucket": user_bucket, "cost": cost, "future": asyncio.get_running_loop().create_future()}
+        self._waiters.append(waiter)
+        self._schedule_drain()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter["future"]), self.queue_timeout)
+        except asyncio.TimeoutError:
+            # The query may have been admitted just as its deadline passed
+            if waiter["future"].done():
+                return self._releaser()
+            waiter["future"].cancel()
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            self._reject(503, "Service overloaded, retry later", 1.0)
+        except asyncio.CancelledError:
+            # Give the slot back if the query was admitted just as its client went away
+            if waiter["future"].done():
+                self.release()
+            else:
+                waiter["future"].cancel()
+            raise
+        return self._releaser()
+
+    def release(self):
+        """
+        Frees the slot of a finished query and admits waiting queries.
+        """
+        self._running -= 1
+        if self._waiters:
+            self._schedule_drain()
+
+    def refund_cached(self, user: str):
+        """
+        Gives back the context and completion tokens charged for a query of `user` that was
+        answered without calling the model, from the semantic answer cache or by an identical
+        query in flight; only its question stays charged.
+
+        Args:
+            user (str): The user charged for the query.
+        """
+        refund = self.context_tokens + self.completion_tokens
+        now = time.monotonic()
+        self._global_bucket.refill(now)
+        self._global_bucket.tokens = min(self._global_bucket.capacity, self._global_bucket.tokens + refund)
+        user_bucket = self._user_buckets.get(user)
+        if user_bucket is not None:
+            user_bucket.refill(now)
+            user_bucket.tokens = min(user_bucket.capacity, user_bucket.tokens + refund)
+        if self._waiters:
+            self._schedule_drain()
+
+    @asynccontextmanager
+    async def admit(self, user: str, query: str):
+        """
+        Holds an admission for the duration of an `async with` block.
+
+        Args:
+            user (str): Identifies the user whose rate is charged.
+            query (str): The user's query, used to estimate its cost.
+
+        Raises:
+            AdmissionRejected: If the query is shed.
+        """
+        release = await self.acquire(user, self.estimate_cost(query))
+        try:
+            yield
+        finally:
+            release()
@@ -1,17 +1,29 @@
 import os
+import json
+import requests
 from dotenv import load_dotenv
 from azure.core.credentials import AzureKeyCredential
+from azure.core.pipeline.transport import RequestsTransport
 from azure.search.documents import SearchClient
+from azure.search.documents.aio import SearchClient as AsyncSearchClient
+from azure.search.documents.indexes import SearchIndexClient
+from rag.ContentRetriever import ContentRetriever, SearchResult
 
 # Load environment variables from the specified .env file
 load_dotenv(dotenv_path="../.env")
 
-class AzureSearchContentRetriever:
+class AzureSearchContentRetriever(ContentRetriever):
     """
     A class to interact with Azure Cognitive Search and retrieve documents from a specified index.
     It initializes the search client with credentials from environment variables and provides a method
     to perform the search query and return the results.
+
+    Search errors are raised to the caller rather than returned as an empty result, so a failing
+    search is not mistaken for a query without relevant documents.
     """
+
+    # Fields read by `_to_search_result`, in the ingestion layout and the integrated vectorization layout
+    RESULT_FIELDS = ("id", "content", "metadata", "chunk_id", "chunk", "title")
     
     def __init__(self):
         """
@@ -24,7 +36,8 @@ class AzureSearchContentRetriever:
         self.azure_index_name = os.getenv("AZURE_SEARCH_INDEX")
         # Optionally load top results limit, default to 10 if not set in .env file
         self.top_results = int(os.getenv("AZURE_SEARCH_TOP_RESULTS", "10"))
-
+        # Size of the keep-alive connection pool shared by all searches of this retriever
+        self.connection_pool_size = int(os.getenv("AZURE_SEARCH_POOL_SIZE", "20"))
         # Check if all necessary environment variables are set, raise an error if not
         if not all([self.azure_api_key, self.azure_endpoint, self.azure_index_name]):
             raise ValueError("Missing required environment variables: Ensure AZURE_SEARCH_KEY, AZURE_SEARCH_ENDPOINT, and AZURE_SEARCH_INDEX are set.")
@@ -33,9 +46,55 @@ class AzureSearchContentRetriever:
         full_search_url = f"{self.azure_endpoint}/indexes/{self.azure_index_name}/docs/search?api-version=2023-07-01-Preview"
         #print(f"Full Search URL: {full_search_url}")
 
+        # Pooled HTTP session reused across searches so connections (and TLS sessions) stay warm
+        self.http_session = self._initialize_http_session()
+
+        # Fields returned by searches. Projecting them keeps the large content vectors out of the
+        # responses. Unless AZURE_SEARCH_SELECT_FIELDS lists them, they are read from the index
+        # schema; an empty value returns every retrievable field
+        select_fields = os.getenv("AZURE_SEARCH_SELECT_FIELDS")
+        if select_fields is None:
+            self.select_fields = self._read_select_fields_from_schema()
+        else:
+            self.select_fields = [field.strip() for field in select_fields.split(",") if field.strip()] or None
+
         # Initialize the search client
         self.search_client = self._initialize_search_query_client()
 
+        # Initialize the non-blocking search client used by the async query path
+        self.async_search_client = self._initialize_async_search_query_client()
+
+    def _initialize_http_session(self) -> requests.Session:
+        """
+        Initializes a requests Session with a keep-alive connection pool sized for concurrent searches.
+        
+        Returns:
+            requests.Session: The pooled session used as the transport of the search client.
+        """
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.connection_pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def _read_select_fields_from_schema(self) -> list:
+        """
+        Reads the index schema and keeps the retrievable fields that search results are built from,
+        so the projection matches whichever index layout is deployed.
+        
+        Returns:
+            list: The fields to select, or None to return every retrievable field if the schema
+                  cannot be read or has none of the known fields.
+        """
+        try:
+            transport = RequestsTransport(session=self.http_session, session_owner=False)
+            with SearchIndexClient(self.azure_endpoint, AzureKeyCredential(self.azure_api_key), transport=transport) as index_client:
+                index = index_client.get_index(self.azure_index_name)
+        except Exception as e:
+            print(f"Error reading the search index schema, search results are not projected: {str(e)}")
+            return None
+        return [field.name for field in index.fields if field.name in self.RESULT_FIELDS and not field.hidden] or None
+
     def _initialize_search_query_client(self) -> SearchClient:
         """
         Initializes and returns the SearchClient object to interact with the Azure Search service.
@@ -45,45 +104,126 @@ class AzureSearchContentRetriever:
         """
         try:
             # Return a SearchClient with the specified endpoint, index name, and API key credential
-            return SearchClient(self.azure_endpoint, self.azure_index_name, AzureKeyCredential(self.azure_api_key))
+            transport = RequestsTransport(session=self.http_session, session_owner=False)
+            return SearchClient(self.azure_endpoint, self.azure_index_name, AzureKeyCredential(self.azure_api_key), transport=transport)
         except Exception as e:
             # Handle any errors in initializing the SearchClient
             print(f"Error initializing SearchClient: {str(e)}")
             #raise
 
-    def retrieve_searched_documents(self, query: str) -> str:
+    def _initialize_async_search_query_client(self) -> AsyncSearchClient:
         """
-        Executes the search query against the Azure search index and retrieves the relevant documents.
-        
-        Args:
-            query (str): The search term or query to search in the Azure index.
+        Initializes and returns the async SearchClient object. Its aiohttp session is opened lazily
+        on the first search and keeps its connections alive across searches.
         
         Returns:
-            str: A concatenated string of the retrieved document contents.
+            AsyncSearchClient: The initialized client used to execute search queries without blocking the event loop.
         """
         try:
-            # Execute the search query with the given query string, limiting results by top_results
-            results = self.search_client.search(query, top=self.top_results)
-            retrieved_documents = []  # To store the content of each result
-
-            # Iterate through the search results
-            for result in results:
-                print("Result:", result)  # Debugging: Print each result (optional)
-                
-                # Append the 'chunk' field if available, else 'content' field
-                if 'chunk' in result:
-                    retrieved_documents.append(result['chunk'])
-                elif 'content' in result:
-                    retrieved_documents.append(result['content'])
-            
-            # Combine all retrieved document contents into a single string
-            combined_documents = "\n".join(retrieved_documents)
-            return combined_documents
+            return AsyncSearchClient(self.azure_endpoint, self.azure_index_name, AzureKeyCredential(self.azure_api_key))
         except Exception as e:
-            # Handle any errors during the search process
-            print(f"Error during search: {str(e)}")
+            # Handle any errors in initializing the async SearchClient
+            print(f"Error initializing async SearchClient: {str(e)}")
             #raise
 
+    @staticmethod
+    def _to_search_result(result) -> SearchResult:
+        """
+        Converts a raw Azure Search result into a SearchResult.
+
+        Both the index layout written by the ingestion (id, content, metadata) and the layout of
+        Azure integrated vectorization (chunk_id, chunk, title) are understood.
+        
+        Args:
+            result (dict): A search result returned by Azure Search.
+        
+        Returns:
+            SearchResult: The 'content' (the 'chunk' field if available, else the 'content' field), the search
+                          'score', the 'source' and 'page' of the chunk when known and its 'chunk_id',
+                          or None if the result has no text.
+        """
+        if 'chunk' in result:
+            content = result['chunk']
+        elif 'content' in result:
+            content = result['content']
+        else:
+            return None
+
+        # Documents ingested through LangChain keep their loader metadata as a JSON string
+        metadata = result.get('metadata') or {}
+        if isinstance(metadata, str):
+            try:
+                metadata = json.loads(metadata)
+            except ValueError:
+                metadata = {}
+
+        return SearchResult(
+            content=content,
+            score=result.get('@search.score'),
+            source=metadata.get('source', result.get('title')),
+            page=metadata.get('page'),
+            chunk_id=result.get('id', result.get('chunk_id')),
+        )
+
+    def retrieve_search_results(self, query: str) -> list:
+        """
+        Executes the search query against the Azure search index and returns the relevant results.
+        
+        Args:
+            query (str): The search term or query to search in the Azure index.
+        
+        Returns:
+            list of SearchResult: The search results in relevance order.
+
+        Raises:
+            HttpResponseError: If the search fails.
+        """
+        # Execute the search query with the given query string, limiting results by top_results
+        results = self.search_client.search(query, top=self.top_results, select=self.select_fields)
+        search_results = []  # To store the content of each result
+
+        # Iterate through the search results
+        for result in results:
+            search_result = self._to_search_result(result)
+            if search_result is not None:
+                search_results.append(search_result)
+        return search_results
+
+    async def aretrieve_search_results(self, query: str) -> list:
+        """
+        Async variant of `retrieve_search_results` that awaits the search instead of
+        blocking the calling thread.
+        
+        Args:
+            query (str): The search term or query to search in the Azure index.
+        
+        Returns:
+            list of SearchResult: The search results in relevance order.
+
+        Raises:
+            HttpResponseError: If the search fails.
+        """
+        # Execute the search query with the given query string, limiting results by top_results
+        results = await self.async_search_client.search(query, top=self.top_results, select=self.select_fields)
+        search_results = []  # To store the content of each result
+
+        # Iterate through the search results as the pages arrive
+        async for result in results:
+            search_result = self._to_search_result(result)
+            if search_result is not None:
+                search_results.append(search_result)
+        return search_results
+
+    async def aclose(self):
+        """
+        Closes the sync and async search clients and releases the pooled connections.
+        """
+        if self.search_client:
+            self.search_client.close()
+        if self.async_search_client:
+            await self.async_search_client.close()
+        self.http_session.close()
+
 # Example usage (commented out):
 '''
 if __name__ == "__main__":
@@ -91,7 +231,7 @@ if __name__ == "__main__":
         # Create an instance of AzureSearchContentRetriever
         content_retriever_object = AzureSearchContentRetriever()
         # Search for a specific query
-        response = content_retriever_object.retrieve_searched_documents("What does the AppleCare Protection Plan for iPhone cover?")
+        response = content_retriever_object.retrieve_search_results("What does the AppleCare Protection Plan for iPhone cover?")
         # Print the search response
         print("Response:", response)
     except Exception as e:
@@ -0,0 +1,210 @@
+import os
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from rag.PdfDataIngestor import DataIngestor
+
+class BulkIngestor:
+    """
+    Ingests every PDF of the AZURE_BLOB_CONTAINER container, several documents at a time.
+
+    The outcome of each document is appended to a checkpoint file (one JSON line per document with
+    its ETag and content MD5 as downloaded), so an interrupted run resumes where it stopped: documents recorded
+    as ingested are skipped as long as their ETag, or their content hash, is unchanged. Documents
+    that failed are retried on the next run. Progress, throughput and the estimated time left are
+    printed after each document. The checkpoint records the version that was downloaded rather
+    than the one listed, so a blob replaced in between is not skipped on its stale listing ETag.
+
+    Attributes:
+    ----------
+    ingestor : DataIngestor
+        The ingestor shared by the worker threads.
+    checkpoint_path : str
+        The checkpoint file.
+    workers : int
+        Number of documents ingested in parallel.
+    """
+
+    def __init__(self, checkpoint_path: str = None, workers: int = None, ingestor: DataIngestor = None):
+        """
+        Initializes the bulk ingestion. Unset parameters are read from the BULK_INGEST_CHECKPOINT
+        ("bulk_ingest_checkpoint.jsonl") and BULK_INGEST_WORKERS (4) environment variables.
+        """
+        self.ingestor = ingestor or DataIngestor()
+        self.checkpoint_path = checkpoint_path or os.getenv("BULK_INGEST_CHECKPOINT", "bulk_ingest_checkpoint.jsonl")
+        self.workers = workers or int(os.getenv("BULK_INGEST_WORKERS", "4"))
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _content_hash(blob) -> str:
+        """
+        Returns the hex MD5 of a blob's content as stored by Azure, or None if it was not computed.
+        """
+        content_md5 = blob.content_settings.content_md5 if blob.content_settings else None
+        return bytes(content_md5).hex() if content_md5 else None
+
+    def load_checkpoint(self) -> dict:
+        """
+        Reads the checkpoint file.
+
+        Returns:
+        -------
+        dict
+            The last checkpoint entry of each blob name.
+        """
+        entries = {}
+        if not os.path.exists(self.checkpoint_path):
+            return entries
+        with open(self.checkpoint_path) as checkpoint_file:
+            for line in checkpoint_file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Line cut short by an interruption
+                    continue
+                entries[entry["blob"]] = entry
+        return entries
+
+    def _write_checkpoint(self, entry: dict):
+        """
+        Appends the outcome of a document to the checkpoint file.
+        """
+        with self._lock:
+            with open(self.checkpoint_path, "a") as checkpoint_file:
+                checkpoint_file.write(json.dumps(entry) + "\n")
+                checkpoint_file.flush()
+                os.fsync(checkpoint_file.fileno())
+
+    def is_ingested(self, blob, checkpoint: dict) -> bool:
+        """
+        Tells whether a blob was ingested with its current content.
+        """
+        entry = checkpoint.get(blob.name)
+        if entry is None or entry.get("status") != "succeeded":
+            return False
+        content_hash = self._content_hash(blob)
+        return entry.get("etag") == blob.etag or (content_hash is not None and entry.get("content_md5") == content_hash)
+
+    def list_pending_blobs(self, prefix: str = None, force: bool = False) -> list:
+        """
+        Lists the PDFs of the container that still need to be ingested.
+
+        Parameters:
+        ----------
+        prefix : str
+            Only list the blobs whose name starts with this prefix.
+        force : bool
+            Ingest every PDF, ignoring the checkpoint.
+
+        Returns:
+        -------
+        list
+            The BlobProperties of the pending PDFs.
+        """
+        container_client = self.ingestor.blob_service_client.get_container_client(self.ingestor.blob_container_name)
+        checkpoint = {} if force else self.load_checkpoint()
+        return [
+            blob for blob in container_client.list_blobs(name_starts_with=prefix)
+            if blob.name.lower().endswith(".pdf") and not self.is_ingested(blob, checkpoint)
+        ]
+
+    def _ingest_blob(self, blob) -> dict:
+        """
+        Ingests one document and returns its checkpoint entry, describing the downloaded version
+        of the blob (the listed one if the download failed).
+        """
+        started_at = time.time()
+        entry = {"blob": blob.name, "etag": blob.etag, "content_md5": self._content_hash(blob), "size": blob.size}
+
+        def record_download(properties):
+            entry.update(etag=properties.etag, content_md5=self._content_hash(properties), size=properties.size)
+
+        try:
+            results = self.ingestor.ingest_data(blob.name, raise_errors=True, on_download=record_download)
+            entry.update(status="succeeded", indexed=len(results))
+        except Exception as e:
+            entry.update(status="failed", error=str(e))
+        entry["seconds"] = round(time.time() - started_at, 3)
+        entry["finished_at"] = time.time()
+        self._write_checkpoint(entry)
+        return entry
+
+    def close(self):
+        """
+        Releases the resources of the ingestor once the run is over.
+        """
+        self.ingestor.close()
+
+    @staticmethod
+    def _format_duration(seconds: float) -> str:
+        """
+        Formats a duration as H:MM:SS.
+        """
+        seconds = int(seconds)
+        return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+    def run(self, prefix: str = None, force: bool = False) -> dict:
+        """
+        Ingests the pending PDFs of the container in parallel.
+
+        Parameters:
+        ----------
+        prefix : str
+            Only ingest the blobs whose name starts with this prefix.
+        force : bool
+            Ingest every PDF, ignoring the checkpoint.
+
+        Returns:
+        -------
+        dict
+            The number of documents that succeeded and failed.
+        """
+        blobs = self.list_pending_blobs(prefix, force)
+        total_bytes = sum(blob.size or 0 for blob in blobs)
+        print(f"{len(blobs)} documents to ingest ({total_bytes / 1e6:.1f} MB) with {self.workers} workers")
+
+        counts = {"succeeded": 0, "failed": 0}
+        done_bytes = 0
+        indexed = 0
+        started_at = time.time()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self._ingest_blob, blob) for blob in blobs]
+            for done, future in enumerate(as_completed(futures), start=1):
+                entry = future.result()
+                counts[entry["status"]] += 1
+                done_bytes += entry["size"] or 0
+                indexed += entry.get("indexed", 0)
+
+                # Throughput so far, and time left at the same byte rate
+                elapsed = max(time.time() - started_at, 1e-6)
+                byte_rate = done_bytes / elapsed
+                eta = (total_bytes - done_bytes) / byte_rate if byte_rate else 0
+                outcome = "ok" if entry["status"] == "succeeded" else f"FAILED ({entry['error']})"
+                print(
+                    f"[{done}/{len(blobs)}] {entry['blob']}: {outcome} in {entry['seconds']:.1f}s | "
+                    f"{done / elapsed * 60:.1f} docs/min, {byte_rate / 1e6:.2f} MB/s, {indexed / elapsed:.1f} chunks/s | "
+                    f"ETA {self._format_duration(eta)}"
+                )
+
+        print(f"Done in {self._format_duration(time.time() - started_at)}: {counts['succeeded']} succeeded, {counts['failed']} failed")
+        return counts
+
+
+# Example usage: ingest the whole container, resuming from the checkpoint of a previous run
+#     python -m rag.BulkIngestor [--prefix contracts/] [--workers 8] [--checkpoint run.jsonl] [--force]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest every PDF of AZURE_BLOB_CONTAINER.")
+    parser.add_argument("--prefix", help="only ingest the blobs whose name starts with this prefix")
+    parser.add_argument("--workers", type=int, help="documents ingested in parallel (BULK_INGEST_WORKERS)")
+    parser.add_argument("--checkpoint", help="checkpoint file (BULK_INGEST_CHECKPOINT)")
+    parser.add_argument("--force", action="store_true", help="ingest every PDF, ignoring the checkpoint")
+    arguments = parser.parse_args()
+
+    bulk_ingestor = BulkIngestor(checkpoint_path=arguments.checkpoint, workers=arguments.workers)
+    try:
+        counts = bulk_ingestor.run(prefix=arguments.prefix, force=arguments.force)
+    finally:
+        bulk_ingestor.close()
+    raise SystemExit(1 if counts["failed"] else 0)
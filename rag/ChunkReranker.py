@@ -0,0 +1,205 @@
+import os
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+class ChunkReranker:
+    """
+    Optional in-process second-stage re-ranker for retrieved chunks.
+
+    The retriever can fetch a wide candidate set (AZURE_SEARCH_TOP_RESULTS) and this class keeps
+    only the best `top_n` chunks, so fewer chunks are sent to the language model. Two scorers are
+    available, both vectorized with NumPy:
+    - "bm25": Okapi BM25 of the query terms over the candidate chunks, no network call.
+    - "embedding": cosine similarity between the query embedding and the chunk embeddings.
+
+    The "embedding" mode uses the embeddings returned by the retriever when it has them (the local
+    index does). Other chunks are embedded once and kept in an LRU cache keyed on their text, so a
+    chunk retrieved again by a later query is not sent to Azure OpenAI again.
+
+    Attributes:
+    ----------
+    mode : str
+        "none", "bm25" or "embedding".
+    top_n : int
+        Number of chunks kept after re-ranking.
+    embeddings : AzureOpenAIEmbeddings
+        Embedding client used by the "embedding" mode.
+    embedding_cache_size : int
+        Number of chunk embeddings kept by the "embedding" mode.
+    """
+
+    TOKEN_PATTERN = re.compile(r"\w+")
+
+    def __init__(self, mode: str = None, top_n: int = None, embeddings=None, k1: float = 1.2, b: float = 0.75, embedding_cache_size: int = None):
+        """
+        Initializes the re-ranker. Unset parameters are read from the RERANK_MODE, RERANK_TOP_N
+        and RERANK_EMBEDDING_CACHE_SIZE (2000) environment variables.
+        """
+        if mode is None:
+            mode = os.getenv("RERANK_MODE", "none").lower()
+        if top_n is None:
+            top_n = int(os.getenv("RERANK_TOP_N", "4"))
+        if embedding_cache_size is None:
+            embedding_cache_size = int(os.getenv("RERANK_EMBEDDING_CACHE_SIZE", "2000"))
+
+        if mode not in ("none", "bm25", "embedding"):
+            raise ValueError(f"Unsupported RERANK_MODE: {mode}")
+        if mode == "embedding" and embeddings is None:
+            print("Embedding re-ranking needs the AZURE_OPENAI_EMBEDDING_* variables, falling back to BM25")
+            mode = "bm25"
+
+        self.mode = mode
+        self.top_n = top_n
+        self.embeddings = embeddings
+        self.k1 = k1
+        self.b = b
+        self.embedding_cache_size = embedding_cache_size
+        self._embedding_cache = OrderedDict()  # text digest -> chunk embedding, least recently used first
+        self._embedding_cache_lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        """
+        Whether re-ranking is active.
+        """
+        return self.mode != "none"
+
+    @classmethod
+    def tokenize(cls, text: str) -> list:
+        """
+        Splits a text into lowercase word tokens.
+        """
+        return cls.TOKEN_PATTERN.findall(text.lower())
+
+    def _bm25_scores(self, query: str, search_results: list) -> np.ndarray:
+        """
+        Scores each chunk with BM25, using the candidate set itself for document frequencies.
+        """
+        query_terms = list(dict.fromkeys(self.tokenize(query)))
+        if not query_terms:
+            return np.zeros(len(search_results))
+        term_index = {term: i for i, term in enumerate(query_terms)}
+
+        # Term-frequency matrix restricted to the query terms: chunks x query terms
+        term_frequencies = np.zeros((len(search_results), len(query_terms)), dtype=np.float32)
+        chunk_lengths = np.zeros(len(search_results), dtype=np.float32)
+        for row, result in enumerate(search_results):
+            tokens = self.tokenize(result["content"])
+            chunk_lengths[row] = len(tokens)
+            for token in tokens:
+                column = term_index.get(token)
+                if column is not None:
+                    term_frequencies[row, column] += 1
+
+        document_frequencies = np.count_nonzero(term_frequencies, axis=0)
+        idf = np.log1p((len(search_results) - document_frequencies + 0.5) / (document_frequencies + 0.5))
+        average_length = max(float(chunk_lengths.mean()), 1.0)
+        length_norm = self.k1 * (1 - self.b + self.b * chunk_lengths / average_length)
+
+        weights = term_frequencies * (self.k1 + 1) / (term_frequencies + length_norm[:, None])
+        return weights @ idf
+
+    @staticmethod
+    def _cosine_scores(query_embedding, chunk_embeddings) -> np.ndarray:
+        """
+        Computes the cosine similarity between the query and every chunk.
+        """
+        query_vector = np.asarray(query_embedding, dtype=np.float32)
+        chunk_matrix = np.asarray(chunk_embeddings, dtype=np.float32)
+        norms = np.linalg.norm(chunk_matrix, axis=1) * np.linalg.norm(query_vector)
+        return (chunk_matrix @ query_vector) / np.where(norms == 0, 1, norms)
+
+    @staticmethod
+    def _cache_key(content: str) -> bytes:
+        """
+        Keys a chunk embedding on the chunk text, so a re-ingested chunk is embedded again.
+        """
+        return hashlib.sha256(content.encode("utf-8")).digest()
+
+    def _known_embeddings(self, search_results: list) -> tuple:
+        """
+        Collects the chunk embeddings returned by the retriever or found in the cache.
+
+        Returns:
+        -------
+        tuple
+            The embedding of each chunk (None when unknown), and the indices of the unknown chunks.
+        """
+        chunk_embeddings = [result.get("embedding") for result in search_results]
+        with self._embedding_cache_lock:
+            for i, result in enumerate(search_results):
+                if chunk_embeddings[i] is None:
+                    key = self._cache_key(result["content"])
+                    chunk_embeddings[i] = self._embedding_cache.get(key)
+                    if chunk_embeddings[i] is not None:
+                        self._embedding_cache.move_to_end(key)
+        return chunk_embeddings, [i for i, embedding in enumerate(chunk_embeddings) if embedding is None]
+
+    def _remember_embeddings(self, search_results: list, chunk_embeddings: list, missing: list, new_embeddings: list):
+        """
+        Fills in and caches the embeddings computed for the unknown chunks.
+        """
+        with self._embedding_cache_lock:
+            for i, embedding in zip(missing, new_embeddings):
+                chunk_embeddings[i] = np.asarray(embedding, dtype=np.float32)
+                if self.embedding_cache_size > 0:
+                    self._embedding_cache[self._cache_key(search_results[i]["content"])] = chunk_embeddings[i]
+            while len(self._embedding_cache) > self.embedding_cache_size:
+                self._embedding_cache.popitem(last=False)
+
+    def _select(self, search_results: list, scores: np.ndarray) -> list:
+        """
+        Keeps the `top_n` best chunks; ties keep the retriever's order.
+        """
+        order = np.argsort(-scores, kind="stable")[:self.top_n]
+        return [dict(search_results[i], rerank_score=float(scores[i])) for i in order]
+
+    def rerank(self, query: str, search_results: list, query_embedding=None) -> list:
+        """
+        Re-ranks the retrieved chunks and keeps the best `top_n`.
+
+        Parameters:
+        ----------
+        query : str
+            The user's query.
+        search_results : list
+            The retrieved chunks in retriever order, each with a "content" field.
+        query_embedding : list of float
+            The query embedding if already computed (e.g. for the answer cache).
+
+        Returns:
+        -------
+        list
+            The kept chunks, best first, each with an added "rerank_score".
+        """
+        if not self.enabled or not search_results:
+            return search_results
+
+        if self.mode == "bm25":
+            return self._select(search_results, self._bm25_scores(query, search_results))
+
+        if query_embedding is None:
+            query_embedding = self.embeddings.embed_query(query)
+        chunk_embeddings, missing = self._known_embeddings(search_results)
+        if missing:
+            new_embeddings = self.embeddings.embed_documents([search_results[i]["content"] for i in missing])
+            self._remember_embeddings(search_results, chunk_embeddings, missing, new_embeddings)
+        return self._select(search_results, self._cosine_scores(query_embedding, chunk_embeddings))
+
+    async def arerank(self, query: str, search_results: list, query_embedding=None) -> list:
+        """
+        Async variant of `rerank`; only the "embedding" mode performs network calls.
+        """
+        if not self.enabled or not search_results or self.mode == "bm25":
+            return self.rerank(query, search_results, query_embedding)
+
+        if query_embedding is None:
+            query_embedding = await self.embeddings.aembed_query(query)
+        chunk_embeddings, missing = self._known_embeddings(search_results)
+        if missing:
+            new_embeddings = await self.embeddings.aembed_documents([search_results[i]["content"] for i in missing])
+            self._remember_embeddings(search_results, chunk_embeddings, missing, new_embeddings)
+        return self._select(search_results, self._cosine_scores(query_embedding, chunk_embeddings))
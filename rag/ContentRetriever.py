@@ -0,0 +1,122 @@
+import os
+from typing import Optional
+from typing_extensions import NotRequired, TypedDict
+
+class SearchResult(TypedDict):
+    """
+    A retrieved chunk, as returned by every retriever backend.
+
+    Fields:
+        content (str): The text of the chunk.
+        score (float): The relevance score given by the backend; higher is better.
+        source (str): The blob name of the chunk's document, or None if unknown.
+        page (int): The 0-based page of the chunk, or None if unknown.
+        chunk_id (str): The key of the chunk in the index, or None if unknown.
+        embedding (numpy.ndarray): The stored embedding of the chunk, only set by the backends
+            that read it anyway; the embedding re-ranker then does not embed the chunk again.
+    """
+    content: str
+    score: float
+    source: Optional[str]
+    page: Optional[int]
+    chunk_id: Optional[str]
+    embedding: NotRequired[object]
+
+def render_citation(result: SearchResult) -> str:
+    """
+    Renders the citation of a retrieved chunk, e.g. "contract.pdf, page 3" (pages counted from 1).
+
+    Args:
+        result (SearchResult): The retrieved chunk.
+
+    Returns:
+        str: The citation, or "unknown source" if the chunk has no source.
+    """
+    citation = result.get("source") or "unknown source"
+    if result.get("page") is not None:
+        citation += f", page {result['page'] + 1}"
+    return citation
+
+class ContentRetriever:
+    """
+    Interface of the document retrievers used by QueryResponseGenerator.
+
+    A backend implements `retrieve_search_results` and `aretrieve_search_results`, returning the
+    retrieved chunks in relevance order as `SearchResult` dictionaries. The pipeline renders the
+    prompt context and the citations from these results. A failing search raises; an empty list
+    means that no chunk is relevant.
+
+    Available backends (selected with the RETRIEVER_BACKEND environment variable):
+    - "azure": AzureSearchContentRetriever, Azure Cognitive Search (default).
+    - "local": LocalVectorContentRetriever, an in-process memory-mapped vector index.
+    - "hybrid": HybridContentRetriever, the vector backend named by HYBRID_VECTOR_BACKEND
+      ("azure" or "local") fused with the local BM25 keyword index.
+    """
+
+    def retrieve_search_results(self, query: str) -> list:
+        """
+        Retrieves the chunks relevant to a query.
+
+        Args:
+            query (str): The user's query.
+
+        Returns:
+            list of SearchResult: The retrieved chunks in relevance order.
+        """
+        raise NotImplementedError
+
+    async def aretrieve_search_results(self, query: str) -> list:
+        """
+        Async variant of `retrieve_search_results`.
+
+        Args:
+            query (str): The user's query.
+
+        Returns:
+            list of SearchResult: The retrieved chunks in relevance order.
+        """
+        raise NotImplementedError
+
+    async def aclose(self):
+        """
+        Releases the resources held by the retriever.
+        """
+
+def create_content_retriever(embeddings=None) -> ContentRetriever:
+    """
+    Creates the retriever backend selected by the RETRIEVER_BACKEND environment variable.
+
+    Args:
+        embeddings (AzureOpenAIEmbeddings): Embedding client used by backends that embed the query locally.
+
+    Returns:
+        ContentRetriever: The configured retriever.
+
+    Raises:
+        ValueError: If the backend is unknown or its requirements are not met.
+    """
+    backend = os.getenv("RETRIEVER_BACKEND", "azure").lower()
+
+    if backend == "hybrid":
+        from rag.HybridContentRetriever import HybridContentRetriever
+        vector_backend = os.getenv("HYBRID_VECTOR_BACKEND", "azure").lower()
+        return HybridContentRetriever(_create_vector_retriever(vector_backend, embeddings))
+
+    return _create_vector_retriever(backend, embeddings)
+
+def _create_vector_retriever(backend: str, embeddings) -> ContentRetriever:
+    """
+    Creates a vector retriever backend by name ("azure" or "local").
+    """
+    # Backends import this module, so they are imported on demand
+    if backend == "azure":
+        from rag.AzureSearchContentRetriever import AzureSearchContentRetriever
+        return AzureSearchContentRetriever()
+
+    if backend == "local":
+        if embeddings is None:
+            raise ValueError("The local retriever backend needs the AZURE_OPENAI_EMBEDDING_* variables to embed queries.")
+        from rag.LocalVectorContentRetriever import LocalVectorContentRetriever
+        return LocalVectorContentRetriever(embeddings)
+
+    raise ValueError(f"Unsupported RETRIEVER_BACKEND: {backend}")
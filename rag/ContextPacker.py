@@ -0,0 +1,130 @@
+import os
+import tiktoken
+from rag.ContentRetriever import render_citation
+
+class ContextPacker:
+    """
+    Assembles the prompt context from retrieved chunks under a fixed token budget.
+
+    Chunks are taken in relevance order and added while they fit in the budget. Chunks whose
+    token shingles are mostly contained in an already packed chunk (repeated or overlapping text)
+    are dropped, so the prompt sent to the language model stays small and predictable.
+
+    Each packed chunk is preceded by its number and citation, e.g. "[2] contract.pdf, page 3", so the
+    answer can refer to its sources; these headers count against the budget.
+
+    Attributes:
+    ----------
+    token_budget : int
+        Maximum number of context tokens.
+    duplicate_threshold : float
+        Shingle containment ratio above which a chunk counts as a near-duplicate.
+    encoding : tiktoken.Encoding
+        Tokenizer matching the chat model.
+    """
+
+    # Number of consecutive tokens per shingle used for near-duplicate detection
+    SHINGLE_SIZE = 4
+
+    def __init__(self, token_budget: int = None, duplicate_threshold: float = None, encoding_name: str = None):
+        """
+        Initializes the packer. Unset parameters are read from the CONTEXT_TOKEN_BUDGET,
+        CONTEXT_DUPLICATE_THRESHOLD and CONTEXT_TOKEN_ENCODING environment variables.
+        """
+        if token_budget is None:
+            token_budget = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+        if duplicate_threshold is None:
+            duplicate_threshold = float(os.getenv("CONTEXT_DUPLICATE_THRESHOLD", "0.8"))
+        if encoding_name is None:
+            encoding_name = os.getenv("CONTEXT_TOKEN_ENCODING", "cl100k_base")
+
+        self.token_budget = token_budget
+        self.duplicate_threshold = duplicate_threshold
+        self.encoding = tiktoken.get_encoding(encoding_name)
+        self.separator = "\n"
+        self.separator_tokens = len(self.encoding.encode(self.separator))
+
+    def count_tokens(self, text: str) -> int:
+        """
+        Counts the tokens of a text with the packer's encoding.
+        """
+        return len(self.encoding.encode(text))
+
+    def _shingles(self, tokens: list) -> set:
+        """
+        Returns the set of token n-grams of a chunk.
+        """
+        if len(tokens) <= self.SHINGLE_SIZE:
+            return {tuple(tokens)}
+        return {tuple(tokens[i:i + self.SHINGLE_SIZE]) for i in range(len(tokens) - self.SHINGLE_SIZE + 1)}
+
+    def _is_near_duplicate(self, shingles: set, packed_shingles: list) -> bool:
+        """
+        Checks whether a chunk's shingles are mostly contained in, or mostly contain, a packed chunk.
+        """
+        for other_shingles in packed_shingles:
+            overlap = len(shingles & other_shingles)
+            if overlap >= self.duplicate_threshold * min(len(shingles), len(other_shingles)):
+                return True
+        return False
+
+    def pack(self, search_results: list) -> dict:
+        """
+        Packs retrieved chunks into a context string within the token budget.
+
+        Parameters:
+        ----------
+        search_results : list of SearchResult
+            Retrieved chunks in relevance order.
+
+        Returns:
+        -------
+        dict
+            "context": the packed context string,
+            "results": the chunks that were packed, in order (the chunk numbered [n] in the context is results[n - 1]),
+            "tokens_used": the number of context tokens,
+            "dropped_duplicates": the number of near-duplicate chunks dropped,
+            "dropped_over_budget": the number of chunks that did not fit.
+        """
+        packed_texts = []
+        packed_results = []
+        packed_shingles = []
+        tokens_used = 0
+        dropped_duplicates = 0
+        dropped_over_budget = 0
+
+        for result in search_results:
+            tokens = self.encoding.encode(result["content"])
+            if not tokens:
+                continue
+
+            shingles = self._shingles(tokens)
+            if self._is_near_duplicate(shingles, packed_shingles):
+                dropped_duplicates += 1
+                continue
+
+            separator_cost = self.separator_tokens if packed_texts else 0
+            header = f"[{len(packed_texts) + 1}] {render_citation(result)}\n"
+            header_tokens = self.count_tokens(header)
+            remaining = self.token_budget - tokens_used - separator_cost - header_tokens
+            text = result["content"]
+            if len(tokens) > remaining:
+                # Truncate the most relevant chunk rather than sending no context at all
+                if packed_texts or remaining <= 0:
+                    dropped_over_budget += 1
+                    continue
+                tokens = tokens[:remaining]
+                text = self.encoding.decode(tokens)
+
+            packed_texts.append(header + text)
+            packed_results.append(result)
+            packed_shingles.append(shingles)
+            tokens_used += separator_cost + header_tokens + len(tokens)
+
+        return {
+            "context": self.separator.join(packed_texts),
+            "results": packed_results,
+            "tokens_used": tokens_used,
+            "dropped_duplicates": dropped_duplicates,
+            "dropped_over_budget": dropped_over_budget,
+        }
@@ -0,0 +1,110 @@
+import os
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+from rag.PipelineMetrics import CACHE_LOOKUPS_TOTAL
+
+class EmbeddingCache:
+    """
+    Persistent, content-addressed cache of chunk embeddings, stored in a local SQLite database.
+
+    Each embedding is keyed by the SHA-256 hash of the embedding deployment, the API version and
+    the chunk text, so re-ingesting a lightly edited document only embeds the chunks whose text
+    changed, and switching to another embedding model never returns stale vectors. Vectors are
+    stored as float32 blobs.
+
+    Attributes:
+    ----------
+    path : str
+        The SQLite database file.
+    namespace : str
+        The embedding deployment and API version the cached vectors were computed with.
+    hits : int
+        Number of chunks found in the cache.
+    misses : int
+        Number of chunks not found in the cache.
+    """
+
+    def __init__(self, deployment: str, api_version: str, path: str = None):
+        """
+        Opens (or creates) the cache in `path`, by default the EMBEDDING_CACHE_PATH environment
+        variable or "embedding_cache.sqlite3".
+        """
+        self.path = path or os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite3")
+        self.namespace = f"{deployment}\0{api_version}\0"
+        self.hits = 0
+        self.misses = 0
+
+        # One connection shared by the ingestion workers, serialized by the lock
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+        self._connection.commit()
+
+    def key(self, text: str) -> str:
+        """
+        Returns the cache key of a chunk text.
+        """
+        return hashlib.sha256((self.namespace + text).encode("utf-8")).hexdigest()
+
+    def get_many(self, texts: list) -> list:
+        """
+        Looks up the embeddings of chunk texts.
+
+        Parameters:
+        ----------
+        texts : list of str
+            The chunk texts.
+
+        Returns:
+        -------
+        list
+            The cached embedding of each text (a list of floats), or None where it is not cached.
+        """
+        keys = [self.key(text) for text in texts]
+        found = {}
+        with self._lock:
+            # Query in batches below SQLite's limit on the number of parameters
+            unique_keys = list(dict.fromkeys(keys))
+            for start in range(0, len(unique_keys), 500):
+                batch = unique_keys[start:start + 500]
+                rows = self._connection.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                )
+                found.update(rows)
+
+        embeddings = [np.frombuffer(found[key], dtype=np.float32).tolist() if key in found else None for key in keys]
+        hits = sum(embedding is not None for embedding in embeddings)
+        self.hits += hits
+        self.misses += len(embeddings) - hits
+        CACHE_LOOKUPS_TOTAL.inc(hits, cache="embedding", result="hit")
+        CACHE_LOOKUPS_TOTAL.inc(len(embeddings) - hits, cache="embedding", result="miss")
+        return embeddings
+
+    def put_many(self, texts: list, embeddings: list):
+        """
+        Stores the embeddings of chunk texts.
+
+        Parameters:
+        ----------
+        texts : list of str
+            The chunk texts.
+        embeddings : list
+            The embedding of each text.
+        """
+        rows = [
+            (self.key(text), np.asarray(embedding, dtype=np.float32).tobytes())
+            for text, embedding in zip(texts, embeddings)
+        ]
+        with self._lock:
+            self._connection.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows)
+            self._connection.commit()
+
+    def close(self):
+        """
+        Closes the database connection.
+        """
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,117 @@
+import os
+import hashlib
+import asyncio
+from rag.ContentRetriever import ContentRetriever, SearchResult
+from rag.LocalKeywordIndex import LocalKeywordIndex
+
+class HybridContentRetriever(ContentRetriever):
+    """
+    Retriever backend fusing vector search with the local BM25 keyword index.
+
+    Legal questions often hinge on exact clause numbers and defined terms that pure vector search
+    misses. Both retrievers are queried and their rankings are fused with reciprocal rank fusion
+    (RRF): each chunk scores the sum of 1 / (k + rank) over the rankings it appears in. Chunks are
+    matched across rankings by the hash of their text.
+
+    Attributes:
+    ----------
+    vector_retriever : ContentRetriever
+        The vector backend (Azure Cognitive Search or the local vector index).
+    keyword_index : LocalKeywordIndex
+        The BM25 index built during ingestion.
+    rrf_k : int
+        The RRF rank constant.
+    top_results : int
+        Number of fused chunks returned.
+    """
+
+    def __init__(self, vector_retriever: ContentRetriever, keyword_index: LocalKeywordIndex = None):
+        """
+        Initializes the retriever.
+
+        Args:
+            vector_retriever (ContentRetriever): The vector backend to fuse with keyword search.
+            keyword_index (LocalKeywordIndex): The keyword index, by default the one in LOCAL_KEYWORD_INDEX_DIR.
+        """
+        self.vector_retriever = vector_retriever
+        self.keyword_index = keyword_index or LocalKeywordIndex()
+        self.rrf_k = int(os.getenv("HYBRID_RRF_K", "60"))
+        self.top_results = int(os.getenv("HYBRID_TOP_RESULTS", "10"))
+        self.keyword_top_results = int(os.getenv("HYBRID_KEYWORD_TOP_RESULTS", str(self.top_results)))
+
+    @staticmethod
+    def _chunk_key(result: dict) -> str:
+        """
+        Identifies a chunk across rankings by the hash of its text.
+        """
+        return hashlib.sha1(result["content"].encode("utf-8")).hexdigest()
+
+    def _keyword_search(self, query: str) -> list:
+        """
+        Runs the BM25 search and converts its records to search results.
+        """
+        try:
+            return [
+                SearchResult(content=record["content"], score=record["score"], source=record.get("source"), page=record.get("page"), chunk_id=record.get("id"))
+                for record in self.keyword_index.search(query, self.keyword_top_results)
+            ]
+        except Exception as e:
+            # Keyword search is an enhancement; fall back to vector results only
+            print(f"Error during keyword search: {str(e)}")
+            return []
+
+    def fuse(self, *rankings: list) -> list:
+        """
+        Fuses rankings with reciprocal rank fusion.
+
+        Args:
+            *rankings (list): Search results lists, each in relevance order.
+
+        Returns:
+            list: The fused results, best first, with the RRF score as "score".
+        """
+        fused = {}
+        for ranking in rankings:
+            for rank, result in enumerate(ranking, start=1):
+                key = self._chunk_key(result)
+                if key not in fused:
+                    # Keep the first ranking's copy of the chunk (the vector backend's metadata)
+                    fused[key] = dict(result, score=0.0)
+                fused[key]["score"] += 1.0 / (self.rrf_k + rank)
+
+        return sorted(fused.values(), key=lambda result: -result["score"])[:self.top_results]
+
+    def retrieve_search_results(self, query: str) -> list:
+        """
+        Retrieves the chunks relevant to a query from both retrievers and fuses them.
+
+        Args:
+            query (str): The user's query.
+
+        Returns:
+            list: The fused results in relevance order.
+        """
+        return self.fuse(self.vector_retriever.retrieve_search_results(query), self._keyword_search(query))
+
+    async def aretrieve_search_results(self, query: str) -> list:
+        """
+        Async variant of `retrieve_search_results`; the keyword search runs in a worker thread
+        while the vector search is awaited.
+
+        Args:
+            query (str): The user's query.
+
+        Returns:
+            list: The fused results in relevance order.
+        """
+        vector_results, keyword_results = await asyncio.gather(
+            self.vector_retriever.aretrieve_search_results(query),
+            asyncio.to_thread(self._keyword_search, query)
+        )
+        return self.fuse(vector_results, keyword_results)
+
+    async def aclose(self):
+        """
+        Closes the vector retriever.
+        """
+        await self.vector_retriever.aclose()
@@ -0,0 +1,268 @@
+import os
+import time
+import uuid
+import queue
+import threading
+from collections import OrderedDict
+
+class IngestionJob:
+    """
+    State and progress of the background ingestion of one document.
+
+    Attributes:
+    ----------
+    job_id : str
+        Identifier returned to the client.
+    blob_name : str
+        The document being ingested.
+    status : str
+        "queued", "running", "succeeded" or "failed".
+    stage : str
+        The current stage: "download", "extract", "embed" or "index".
+    counters : dict
+        Progress counters: pages extracted, chunks produced, chunks already indexed (unchanged),
+        embeddings computed, chunks indexed, stale chunks deleted.
+    attempts : dict
+        Number of attempts of each stage, including retries.
+    error : str
+        The error that made the job fail.
+    """
+
+    def __init__(self, blob_name: str):
+        """
+        Creates a queued job for a document.
+        """
+        self.job_id = uuid.uuid4().hex
+        self.blob_name = blob_name
+        self.status = "queued"
+        self.stage = None
+        self.counters = {"pages": 0, "chunks": 0, "unchanged": 0, "embeddings": 0, "indexed": 0, "deleted": 0}
+        self.attempts = {}
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def update(self, stage: str = None, **counters):
+        """
+        Records the current stage and progress counters. Used as the `progress` callback of
+        DataIngestor.ingest_data.
+        """
+        with self._lock:
+            if stage is not None:
+                self.stage = stage
+            self.counters.update(counters)
+
+    def to_dict(self) -> dict:
+        """
+        Returns a JSON-serializable snapshot of the job.
+        """
+        with self._lock:
+            return {
+                "job_id": self.job_id,
+                "blob_name": self.blob_name,
+                "status": self.status,
+                "stage": self.stage,
+                "progress": dict(self.counters),
+                "attempts": dict(self.attempts),
+                "error": self.error,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+            }
+
+class IngestionJobQueue:
+    """
+    Background worker pool running document ingestion jobs.
+
+    Uploads enqueue a job and return immediately; worker threads run the download, extract, embed
+    and index stages of DataIngestor.ingest_data, retrying a failed stage with exponential backoff.
+    Job state is kept in memory for the status API, bounded to the most recent jobs. The embed
+    stage is run once: the AdaptiveEmbedder already retries throttled and transient requests.
+
+    Jobs are keyed by blob name, since two concurrent ingestions of one document would race on its
+    indexed chunks: a document that already has a queued job is not queued again (the queued job
+    reads the latest upload when it starts), and a job whose document is being ingested waits
+    for that ingestion to finish.
+
+    Attributes:
+    ----------
+    worker_count : int
+        Number of worker threads (INGEST_WORKERS).
+    stage_retries : int
+        Number of retries of a failed stage (INGEST_STAGE_RETRIES).
+    retry_backoff : float
+        Delay before the first retry in seconds, doubled on each retry (INGEST_RETRY_BACKOFF).
+    """
+
+    def __init__(self, ingestor_factory, on_complete=None):
+        """
+        Initializes the queue.
+
+        Parameters:
+        ----------
+        ingestor_factory : callable
+            Returns the DataIngestor used by the workers; called once, on the first job.
+        on_complete : callable
+            Optional callback receiving the blob name of each successfully ingested document.
+        """
+        self.worker_count = int(os.getenv("INGEST_WORKERS", "2"))
+        self.stage_retries = int(os.getenv("INGEST_STAGE_RETRIES", "3"))
+        self.retry_backoff = float(os.getenv("INGEST_RETRY_BACKOFF", "2"))
+        self.max_jobs = int(os.getenv("INGEST_JOB_HISTORY", "1000"))
+        # Stages retrying their own failures, whose errors are final
+        self.self_retrying_stages = {"embed"}
+        self._ingestor_factory = ingestor_factory
+        self._ingestor = None
+        self._on_complete = on_complete
+        self._queue = queue.Queue()
+        self._jobs = OrderedDict()
+        self._pending = {}  # blob name -> job queued but not started yet
+        self._running = set()  # blob names being ingested
+        self._deferred = {}  # blob name -> job waiting for the ingestion of its blob to finish
+        self._lock = threading.Lock()
+        self._workers = []
+
+    def start(self):
+        """
+        Starts the worker threads.
+        """
+        for worker_number in range(self.worker_count):
+            worker = threading.Thread(target=self._work, name=f"ingestion-worker-{worker_number}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def stop(self, timeout: float = None):
+        """
+        Stops the workers once they have finished their current job, then closes the ingestor.
+        Queued jobs are abandoned.
+
+        Parameters:
+        ----------
+        timeout : float
+            Seconds to wait for the running jobs in total, or None to wait until they finish.
+            Workers still running a job after it are left to the process exit (they are daemon
+            threads), and the ingestor they use is not closed.
+
+        Returns:
+        -------
+        bool
+            True if every worker stopped.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+        running = [worker for worker in self._workers if worker.is_alive()]
+        self._workers = []
+        if running:
+            print(f"{len(running)} ingestion workers still running after {timeout}s, not waiting for them")
+            return False
+        if self._ingestor is not None:
+            self._ingestor.close()
+        return True
+
+    def submit(self, blob_name: str) -> IngestionJob:
+        """
+        Enqueues the ingestion of a document, unless a job for it is already queued.
+
+        Parameters:
+        ----------
+        blob_name : str
+            The name of the PDF in Azure Blob Storage.
+
+        Returns:
+        -------
+        IngestionJob
+            The queued job, possibly one submitted earlier for the same document.
+        """
+        with self._lock:
+            job = self._pending.get(blob_name)
+            if job is not None:
+                return job
+            job = IngestionJob(blob_name)
+            self._pending[blob_name] = job
+            self._jobs[job.job_id] = job
+            # Forget the oldest finished jobs beyond the history size
+            while len(self._jobs) > self.max_jobs:
+                oldest_id, oldest_job = next(iter(self._jobs.items()))
+                if oldest_job.status in ("queued", "running"):
+                    break
+                del self._jobs[oldest_id]
+        self._queue.put(job)
+        return job
+
+    def get(self, job_id: str) -> IngestionJob:
+        """
+        Returns a job by id, or None if it is unknown or was forgotten.
+        """
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _get_ingestor(self):
+        """
+        Builds the shared DataIngestor on first use, so configuration errors surface as job failures.
+        """
+        with self._lock:
+            if self._ingestor is None:
+                self._ingestor = self._ingestor_factory()
+            return self._ingestor
+
+    def _run_stage_with_retries(self, job: IngestionJob, stage: str, function, *args):
+        """
+        Runs a stage, retrying it with exponential backoff when it raises.
+        """
+        retries = 0 if stage in self.self_retrying_stages else self.stage_retries
+        for attempt in range(retries + 1):
+            job.attempts[stage] = job.attempts.get(stage, 0) + 1
+            try:
+                return function(*args)
+            except Exception as e:
+                if attempt == retries:
+                    raise
+                delay = self.retry_backoff * (2 ** attempt)
+                print(f"Ingestion of {job.blob_name}: {stage} failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    def _work(self):
+        """
+        Worker loop: runs queued jobs until a stop sentinel is received.
+        """
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+
+            with self._lock:
+                if job.blob_name in self._running:
+                    # Requeued by the worker ingesting the same document once it finishes
+                    self._deferred[job.blob_name] = job
+                    continue
+                self._running.add(job.blob_name)
+                del self._pending[job.blob_name]
+
+            job.status = "running"
+            job.started_at = time.time()
+            try:
+                ingestor = self._get_ingestor()
+                ingestor.ingest_data(
+                    job.blob_name,
+                    progress=job.update,
+                    run_stage=lambda stage, function, *args: self._run_stage_with_retries(job, stage, function, *args),
+                    raise_errors=True
+                )
+                job.status = "succeeded"
+                if self._on_complete is not None:
+                    self._on_complete(job.blob_name)
+            except Exception as e:
+                job.status = "failed"
+                job.error = str(e)
+            finally:
+                job.finished_at = time.time()
+                with self._lock:
+                    self._running.discard(job.blob_name)
+                    deferred_job = self._deferred.pop(job.blob_name, None)
+                if deferred_job is not None:
+                    self._queue.put(deferred_job)
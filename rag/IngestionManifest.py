@@ -0,0 +1,97 @@
+import os
+import sqlite3
+import threading
+
+class IngestionManifest:
+    """
+    Record of the chunks indexed for each ingested document, stored in a local SQLite database.
+
+    DataIngestor diffs the chunks of a re-ingested document against this record: chunks already
+    indexed are skipped, and chunks that disappeared from the document are deleted from the
+    indexes. Each chunk is recorded with its reference in the vector backend (the Azure Search key
+    or the LocalVectorIndex row).
+
+    Attributes:
+    ----------
+    path : str
+        The SQLite database file.
+    """
+
+    def __init__(self, path: str = None):
+        """
+        Opens (or creates) the manifest in `path`, by default the INGEST_MANIFEST_PATH environment
+        variable or "ingestion_manifest.sqlite3".
+        """
+        self.path = path or os.getenv("INGEST_MANIFEST_PATH", "ingestion_manifest.sqlite3")
+
+        # One connection shared by the ingestion workers, serialized by the lock
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "source TEXT NOT NULL, chunk_id TEXT NOT NULL, vector_ref TEXT NOT NULL, "
+            "PRIMARY KEY (source, chunk_id))"
+        )
+        self._connection.commit()
+
+    def get_chunks(self, source: str) -> dict:
+        """
+        Returns the chunks indexed for a document.
+
+        Parameters:
+        ----------
+        source : str
+            The blob name of the document.
+
+        Returns:
+        -------
+        dict
+            The vector backend reference of each indexed chunk id.
+        """
+        with self._lock:
+            rows = self._connection.execute("SELECT chunk_id, vector_ref FROM chunks WHERE source = ?", (source,))
+            return dict(rows)
+
+    def add_chunks(self, source: str, chunk_refs: dict):
+        """
+        Records newly indexed chunks of a document.
+
+        Parameters:
+        ----------
+        source : str
+            The blob name of the document.
+        chunk_refs : dict
+            The vector backend reference of each chunk id.
+        """
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO chunks (source, chunk_id, vector_ref) VALUES (?, ?, ?)",
+                [(source, chunk_id, str(vector_ref)) for chunk_id, vector_ref in chunk_refs.items()]
+            )
+            self._connection.commit()
+
+    def remove_chunks(self, source: str, chunk_ids: list):
+        """
+        Forgets deleted chunks of a document.
+
+        Parameters:
+        ----------
+        source : str
+            The blob name of the document.
+        chunk_ids : list of str
+            The deleted chunk ids.
+        """
+        with self._lock:
+            self._connection.executemany(
+                "DELETE FROM chunks WHERE source = ? AND chunk_id = ?",
+                [(source, chunk_id) for chunk_id in chunk_ids]
+            )
+            self._connection.commit()
+
+    def close(self):
+        """
+        Closes the database connection.
+        """
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,453 @@
+import os
+import re
+import json
+import mmap
+import shutil
+import fcntl
+import threading
+from contextlib import contextmanager
+import numpy as np
+
+class LocalKeywordIndex:
+    """
+    On-disk BM25 inverted index over the ingested chunks, used for keyword and hybrid retrieval.
+
+    The index is a list of immutable segments, one per ingestion batch. Each segment directory holds:
+    - terms.json: the segment vocabulary, in term-id order.
+    - postings_docs.i32 / postings_tfs.u16 / postings_offsets.i64: the postings of every term
+      (segment-local document ids and term frequencies) and the boundaries of each term's postings.
+    - doc_lengths.i32: the number of tokens of each document.
+    - chunks.jsonl / chunk_offsets.i64: the text and metadata of each document.
+    - chunk_ids.json: the "id" of each document's record, used to delete documents.
+
+    manifest.json lists the live segments and is replaced atomically, so readers always see a
+    consistent set of segments. Deleted chunk ids are kept in the manifest as tombstones, each
+    hiding the copies of the chunk in the segments written before its deletion (so a chunk can be
+    deleted and added again). Segments are merged by size tier: once `merge_factor` segments hold
+    a similar number of documents, they are rewritten as one segment of the next tier, dropping
+    deleted documents, so each document is rewritten a logarithmic number of times. A segment
+    whose share of deleted documents exceeds `max_deleted_ratio` is rewritten on its own.
+    Collection statistics (document count, average length, document frequencies) are summed
+    across segments at query time, excluding deleted documents, so scores match those of a
+    single index.
+
+    Attributes:
+    ----------
+    index_dir : str
+        Directory holding the index.
+    merge_factor : int
+        Number of segments of the same size tier that are merged together.
+    max_deleted_ratio : float
+        Share of deleted documents above which a segment is rewritten without them.
+    """
+
+    MANIFEST_FILE = "manifest.json"
+    LOCK_FILE = ".lock"
+
+    # Dotted clause numbers (e.g. "4.2.1") are kept as single tokens, other words are split on \w+
+    TOKEN_PATTERN = re.compile(r"\d+(?:\.\d+)+|\w+")
+
+    def __init__(self, index_dir: str = None, merge_factor: int = None, max_deleted_ratio: float = None, k1: float = 1.2, b: float = 0.75):
+        """
+        Opens (or prepares) the index stored in `index_dir`, by default the LOCAL_KEYWORD_INDEX_DIR
+        environment variable or "local_keyword_index".
+        """
+        if merge_factor is None:
+            merge_factor = int(os.getenv("LOCAL_KEYWORD_INDEX_MERGE_FACTOR", "8"))
+        if max_deleted_ratio is None:
+            max_deleted_ratio = float(os.getenv("LOCAL_KEYWORD_INDEX_MAX_DELETED_RATIO", "0.3"))
+        self.index_dir = index_dir or os.getenv("LOCAL_KEYWORD_INDEX_DIR", "local_keyword_index")
+        self.merge_factor = max(merge_factor, 2)
+        self.max_deleted_ratio = max_deleted_ratio
+        self.k1 = k1
+        self.b = b
+        os.makedirs(self.index_dir, exist_ok=True)
+        self._refresh_lock = threading.Lock()
+        self._manifest_stamp = None
+        self._segments = []  # Loaded segments of the current manifest
+
+    @classmethod
+    def tokenize(cls, text: str) -> list:
+        """
+        Splits a text into lowercase tokens.
+        """
+        return cls.TOKEN_PATTERN.findall(text.lower())
+
+    def _path(self, *names: str) -> str:
+        """
+        Returns the path of a file of the index.
+        """
+        return os.path.join(self.index_dir, *names)
+
+    def _read_manifest(self) -> dict:
+        """
+        Reads the manifest, or the manifest of an empty index.
+        """
+        try:
+            with open(self._path(self.MANIFEST_FILE)) as manifest_file:
+                return json.load(manifest_file)
+        except FileNotFoundError:
+            return {"segments": [], "next_segment": 0, "tombstones": {}}
+
+    def _write_manifest(self, manifest: dict):
+        """
+        Atomically replaces the manifest, which publishes the segments it lists.
+        """
+        temporary_path = self._path(self.MANIFEST_FILE + ".tmp")
+        with open(temporary_path, "w") as manifest_file:
+            json.dump(manifest, manifest_file)
+            manifest_file.flush()
+            os.fsync(manifest_file.fileno())
+        os.replace(temporary_path, self._path(self.MANIFEST_FILE))
+
+    @contextmanager
+    def _write_lock(self):
+        """
+        Holds the exclusive writer lock shared by all processes using this directory.
+        """
+        with open(self._path(self.LOCK_FILE), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write_segment(self, segment_name: str, records: list):
+        """
+        Builds the postings of a batch of records and writes them as a new segment.
+        """
+        term_ids = {}
+        postings = []  # term id -> {document id: term frequency}
+        doc_lengths = np.zeros(len(records), dtype=np.int32)
+
+        for document_id, record in enumerate(records):
+            tokens = self.tokenize(record["content"])
+            doc_lengths[document_id] = len(tokens)
+            for token in tokens:
+                term_id = term_ids.setdefault(token, len(term_ids))
+                if term_id == len(postings):
+                    postings.append({})
+                postings[term_id][document_id] = postings[term_id].get(document_id, 0) + 1
+
+        postings_lengths = np.fromiter((len(term_postings) for term_postings in postings), dtype=np.int64, count=len(postings))
+        postings_offsets = np.concatenate(([0], np.cumsum(postings_lengths))).astype(np.int64)
+        postings_docs = np.fromiter((d for term_postings in postings for d in term_postings), dtype=np.int32, count=int(postings_offsets[-1]))
+        postings_tfs = np.fromiter((min(tf, 65535) for term_postings in postings for tf in term_postings.values()), dtype=np.uint16, count=int(postings_offsets[-1]))
+
+        encoded_records = [(json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8") for record in records]
+        record_lengths = np.fromiter((len(line) for line in encoded_records), dtype=np.int64, count=len(encoded_records))
+        chunk_offsets = np.concatenate(([0], np.cumsum(record_lengths))).astype(np.int64)
+
+        temporary_dir = self._path(segment_name + ".tmp")
+        os.makedirs(temporary_dir, exist_ok=True)
+        with open(os.path.join(temporary_dir, "terms.json"), "w") as terms_file:
+            json.dump(list(term_ids), terms_file, ensure_ascii=False)
+        postings_docs.tofile(os.path.join(temporary_dir, "postings_docs.i32"))
+        postings_tfs.tofile(os.path.join(temporary_dir, "postings_tfs.u16"))
+        postings_offsets.tofile(os.path.join(temporary_dir, "postings_offsets.i64"))
+        doc_lengths.tofile(os.path.join(temporary_dir, "doc_lengths.i32"))
+        chunk_offsets.tofile(os.path.join(temporary_dir, "chunk_offsets.i64"))
+        with open(os.path.join(temporary_dir, "chunks.jsonl"), "wb") as chunks_file:
+            chunks_file.write(b"".join(encoded_records))
+        with open(os.path.join(temporary_dir, "chunk_ids.json"), "w") as ids_file:
+            json.dump([record.get("id") for record in records], ids_file)
+        # A segment left by a write whose manifest was never committed is not live; replace it
+        shutil.rmtree(self._path(segment_name), ignore_errors=True)
+        os.replace(temporary_dir, self._path(segment_name))
+
+    def _load_segment(self, segment_name: str) -> dict:
+        """
+        Memory-maps the files of a segment.
+        """
+        segment_dir = self._path(segment_name)
+        with open(os.path.join(segment_dir, "terms.json")) as terms_file:
+            terms = json.load(terms_file)
+
+        def load(name, dtype):
+            # Empty files cannot be memory-mapped
+            path = os.path.join(segment_dir, name)
+            return np.memmap(path, dtype=dtype, mode="r") if os.path.getsize(path) else np.zeros(0, dtype=dtype)
+
+        with open(os.path.join(segment_dir, "chunks.jsonl"), "rb") as chunks_file:
+            chunks = mmap.mmap(chunks_file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(chunks_file.name) else b""
+
+        # Segments written before deletions were supported have no ids
+        ids_path = os.path.join(segment_dir, "chunk_ids.json")
+        chunk_ids = None
+        if os.path.exists(ids_path):
+            with open(ids_path) as ids_file:
+                chunk_ids = json.load(ids_file)
+
+        return {
+            "name": segment_name,
+            "number": int(segment_name.rsplit("_", 1)[1]),
+            "chunk_ids": chunk_ids,
+            "term_ids": {term: term_id for term_id, term in enumerate(terms)},
+            "postings_docs": load("postings_docs.i32", np.int32),
+            "postings_tfs": load("postings_tfs.u16", np.uint16),
+            "postings_offsets": load("postings_offsets.i64", np.int64),
+            "doc_lengths": load("doc_lengths.i32", np.int32),
+            "chunk_offsets": load("chunk_offsets.i64", np.int64),
+            "chunks": chunks,
+        }
+
+    @staticmethod
+    def _deleted_mask(segment: dict, tombstones: dict):
+        """
+        Returns the mask of the deleted documents of a segment, or None if none is deleted.
+        """
+        if not tombstones or segment["chunk_ids"] is None:
+            return None
+        # A tombstone hides the copies written before the deletion, i.e. in lower-numbered segments
+        mask = np.fromiter(
+            (tombstones.get(chunk_id, -1) > segment["number"] for chunk_id in segment["chunk_ids"]),
+            dtype=bool, count=len(segment["chunk_ids"])
+        )
+        return mask if mask.any() else None
+
+    def refresh(self):
+        """
+        Loads the segments of a manifest committed by another process or writer.
+        """
+        try:
+            stat = os.stat(self._path(self.MANIFEST_FILE))
+        except FileNotFoundError:
+            return
+        stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if stamp == self._manifest_stamp:
+            return
+
+        with self._refresh_lock:
+            if stamp == self._manifest_stamp:
+                return
+            manifest = self._read_manifest()
+            tombstones = manifest.get("tombstones", {})
+            loaded = {segment["name"]: segment for segment in self._segments}
+            segments = []
+            for segment_name in manifest["segments"]:
+                segment = dict(loaded.get(segment_name) or self._load_segment(segment_name))
+                segment["deleted"] = self._deleted_mask(segment, tombstones)
+                segments.append(segment)
+            self._segments = segments
+            self._manifest_stamp = stamp
+
+    @property
+    def count(self) -> int:
+        """
+        Number of indexed documents, excluding deleted documents.
+        """
+        self.refresh()
+        return sum(
+            len(segment["doc_lengths"]) - (int(segment["deleted"].sum()) if segment["deleted"] is not None else 0)
+            for segment in self._segments
+        )
+
+    def add(self, records: list):
+        """
+        Indexes a batch of chunks as a new segment, merging the segments of a full size tier.
+
+        Parameters:
+        ----------
+        records : list of dict
+            The text ("content") and metadata of each chunk, with the "id" used by `delete`.
+        """
+        if not records:
+            return
+
+        with self._write_lock():
+            manifest = self._read_manifest()
+            segment_name = f"segment_{manifest['next_segment']:06d}"
+            self._write_segment(segment_name, records)
+            manifest["segments"].append(segment_name)
+            manifest["next_segment"] += 1
+            self._write_manifest(manifest)
+
+            # The segment is committed: a failed merge must not make the caller add the records again
+            try:
+                self._merge_tiers(manifest)
+            except Exception as e:
+                print(f"Keyword index merge failed, retried on the next add: {e}")
+
+    def delete(self, chunk_ids: list):
+        """
+        Deletes the documents of chunks by id. They stop being returned by `search` immediately
+        and are dropped from the files when their segment is merged, or rewritten once too many of
+        its documents are deleted.
+
+        Parameters:
+        ----------
+        chunk_ids : list of str
+            The "id" of the records to delete.
+        """
+        if not chunk_ids:
+            return
+
+        with self._write_lock():
+            manifest = self._read_manifest()
+            tombstones = manifest.setdefault("tombstones", {})
+            for chunk_id in chunk_ids:
+                tombstones[chunk_id] = manifest["next_segment"]
+            self._write_manifest(manifest)
+            self._expunge_deleted(manifest)
+
+    def _read_segment_records(self, segment: dict, tombstones: dict = None) -> list:
+        """
+        Reads the stored records of a segment, skipping deleted documents.
+        """
+        chunk_offsets = segment["chunk_offsets"]
+        deleted = self._deleted_mask(segment, tombstones)
+        return [
+            json.loads(segment["chunks"][chunk_offsets[i]:chunk_offsets[i + 1]])
+            for i in range(len(chunk_offsets) - 1)
+            if deleted is None or not deleted[i]
+        ]
+
+    def _segment_size(self, segment_name: str) -> int:
+        """
+        Returns the number of documents of a segment, from the size of its document lengths file.
+        """
+        return os.path.getsize(self._path(segment_name, "doc_lengths.i32")) // np.dtype(np.int32).itemsize
+
+    def _size_tier(self, size: int) -> int:
+        """
+        Returns the size tier of a segment: segments whose sizes are within a factor `merge_factor`
+        of each other share a tier.
+        """
+        tier = 0
+        while size >= self.merge_factor:
+            size //= self.merge_factor
+            tier += 1
+        return tier
+
+    def _merge_tiers(self, manifest: dict):
+        """
+        Merges the segments of any size tier holding `merge_factor` segments, oldest first, until
+        no tier is full. Caller holds the writer lock.
+        """
+        while True:
+            tiers = {}
+            for segment_name in manifest["segments"]:
+                tiers.setdefault(self._size_tier(self._segment_size(segment_name)), []).append(segment_name)
+            full_tier = next((names for _, names in sorted(tiers.items()) if len(names) >= self.merge_factor), None)
+            if full_tier is None:
+                return
+            self._merge_segments(manifest, full_tier[:self.merge_factor])
+
+    def _expunge_deleted(self, manifest: dict):
+        """
+        Rewrites the segments whose share of deleted documents exceeds `max_deleted_ratio`.
+        Caller holds the writer lock.
+        """
+        tombstones = manifest.get("tombstones", {})
+        if not tombstones:
+            return
+        for segment_name in list(manifest["segments"]):
+            ids_path = self._path(segment_name, "chunk_ids.json")
+            if not os.path.exists(ids_path):
+                continue
+            with open(ids_path) as ids_file:
+                segment = {"number": int(segment_name.rsplit("_", 1)[1]), "chunk_ids": json.load(ids_file)}
+            deleted = self._deleted_mask(segment, tombstones)
+            if deleted is not None and deleted.sum() > self.max_deleted_ratio * len(deleted):
+                self._merge_segments(manifest, [segment_name])
+
+    def _merge_segments(self, manifest: dict, segment_names: list):
+        """
+        Rewrites segments as a single one without their deleted documents. Caller holds the writer lock.
+        """
+        tombstones = manifest.get("tombstones", {})
+        records = []
+        for segment_name in segment_names:
+            records.extend(self._read_segment_records(self._load_segment(segment_name), tombstones))
+
+        segments = [segment_name for segment_name in manifest["segments"] if segment_name not in segment_names]
+        if records:
+            segment_name = f"segment_{manifest['next_segment']:06d}"
+            self._write_segment(segment_name, records)
+            segments.append(segment_name)
+            manifest["next_segment"] += 1
+        manifest["segments"] = segments
+
+        # A tombstone only hides copies in lower-numbered segments; once none is left it can be dropped
+        oldest = min((int(segment_name.rsplit("_", 1)[1]) for segment_name in segments), default=manifest["next_segment"])
+        manifest["tombstones"] = {chunk_id: number for chunk_id, number in tombstones.items() if number > oldest}
+        self._write_manifest(manifest)
+
+        # Readers still mapping the old segments keep their pages until they refresh
+        for old_segment_name in segment_names:
+            shutil.rmtree(self._path(old_segment_name), ignore_errors=True)
+
+    def search(self, query: str, top_k: int) -> list:
+        """
+        Ranks the indexed chunks against a query with BM25.
+
+        Parameters:
+        ----------
+        query : str
+            The user's query.
+        top_k : int
+            Number of chunks to return.
+
+        Returns:
+        -------
+        list
+            The stored records of the best chunks, best first, each with its BM25 "score".
+        """
+        self.refresh()
+        segments = self._segments
+        query_terms = list(dict.fromkeys(self.tokenize(query)))
+        if not query_terms or top_k <= 0:
+            return []
+
+        # Collection statistics across all segments, excluding deleted documents
+        total_documents = 0
+        total_length = 0
+        for segment in segments:
+            live_lengths = segment["doc_lengths"] if segment["deleted"] is None else segment["doc_lengths"][~segment["deleted"]]
+            total_documents += len(live_lengths)
+            total_length += int(live_lengths.sum())
+        if not total_documents:
+            return []
+        average_length = max(total_length / total_documents, 1.0)
+        document_frequencies = {}
+        for term in query_terms:
+            document_frequencies[term] = 0
+            for segment in segments:
+                term_id = segment["term_ids"].get(term)
+                if term_id is not None:
+                    start, end = segment["postings_offsets"][term_id], segment["postings_offsets"][term_id + 1]
+                    document_frequencies[term] += int(end - start)
+                    if segment["deleted"] is not None:
+                        document_frequencies[term] -= int(segment["deleted"][segment["postings_docs"][start:end]].sum())
+
+        candidates = []  # (score, segment index, document id)
+        for segment_index, segment in enumerate(segments):
+            scores = np.zeros(len(segment["doc_lengths"]), dtype=np.float32)
+            length_norm = self.k1 * (1 - self.b + self.b * segment["doc_lengths"] / average_length)
+            for term in query_terms:
+                term_id = segment["term_ids"].get(term)
+                if term_id is None:
+                    continue
+                start, end = segment["postings_offsets"][term_id], segment["postings_offsets"][term_id + 1]
+                documents = segment["postings_docs"][start:end]
+                term_frequencies = segment["postings_tfs"][start:end].astype(np.float32)
+                document_frequency = document_frequencies[term]
+                idf = np.log1p((total_documents - document_frequency + 0.5) / (document_frequency + 0.5))
+                scores[documents] += idf * term_frequencies * (self.k1 + 1) / (term_frequencies + length_norm[documents])
+            if segment["deleted"] is not None:
+                scores[segment["deleted"]] = 0
+
+            k = min(top_k, int(np.count_nonzero(scores)))
+            if k:
+                best = np.argpartition(-scores, k - 1)[:k]
+                candidates.extend((float(scores[i]), segment_index, int(i)) for i in best)
+
+        candidates.sort(key=lambda candidate: -candidate[0])
+        results = []
+        for score, segment_index, document_id in candidates[:top_k]:
+            segment = segments[segment_index]
+            chunk_offsets = segment["chunk_offsets"]
+            record = json.loads(segment["chunks"][chunk_offsets[document_id]:chunk_offsets[document_id + 1]])
+            record["score"] = score
+            results.append(record)
+        return results
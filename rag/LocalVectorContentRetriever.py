@@ -0,0 +1,91 @@
+import os
+import asyncio
+from rag.ContentRetriever import ContentRetriever, SearchResult
+from rag.LocalVectorIndex import LocalVectorIndex
+
+class LocalVectorContentRetriever(ContentRetriever):
+    """
+    Retriever backend that searches the in-process LocalVectorIndex written by DataIngestor.
+
+    The query is embedded with Azure OpenAI and the nearest chunks are found with a NumPy search
+    over the memory-mapped index, so no search service round trip is needed.
+    """
+
+    def __init__(self, embeddings, index: LocalVectorIndex = None):
+        """
+        Initializes the retriever.
+
+        Args:
+            embeddings (AzureOpenAIEmbeddings): Embedding client used to embed queries.
+            index (LocalVectorIndex): The index to search, by default the one in LOCAL_INDEX_DIR.
+        """
+        self.embeddings = embeddings
+        self.index = index or LocalVectorIndex()
+        # Optionally load top results limit, default to 10 if not set in .env file
+        self.top_results = int(os.getenv("LOCAL_INDEX_TOP_RESULTS", "10"))
+        # Number of IVF clusters scanned per query; unset means an exact search
+        nprobe = os.getenv("LOCAL_INDEX_NPROBE")
+        self.nprobe = int(nprobe) if nprobe else None
+
+    def _to_search_results(self, matches: list) -> list:
+        """
+        Loads the stored chunks of the index matches, with their embeddings for the re-ranker.
+
+        Args:
+            matches (list): `(row, score)` pairs returned by the index.
+
+        Returns:
+            list of SearchResult: The search results in relevance order.
+        """
+        rows = [row for row, _ in matches]
+        records = self.index.get_records(rows)
+        embeddings = self.index.get_embeddings(rows)
+        return [
+            SearchResult(
+                content=record["content"],
+                score=score,
+                source=record.get("source"),
+                page=record.get("page"),
+                chunk_id=record.get("id"),
+                embedding=embedding,
+            )
+            for record, (_, score), embedding in zip(records, matches, embeddings)
+        ]
+
+    def search_by_embedding(self, query_embedding) -> list:
+        """
+        Searches the index with an already computed query embedding.
+
+        Args:
+            query_embedding (list of float): The embedding of the query.
+
+        Returns:
+            list of SearchResult: The search results in relevance order.
+        """
+        return self._to_search_results(self.index.search(query_embedding, self.top_results, self.nprobe))
+
+    def retrieve_search_results(self, query: str) -> list:
+        """
+        Embeds the query and returns the nearest chunks of the local index.
+
+        Args:
+            query (str): The user's query.
+
+        Returns:
+            list of SearchResult: The search results in relevance order.
+        """
+        return self.search_by_embedding(self.embeddings.embed_query(query))
+
+    async def aretrieve_search_results(self, query: str) -> list:
+        """
+        Async variant of `retrieve_search_results`. The query embedding is awaited and the NumPy
+        search runs in a worker thread, so neither blocks the event loop.
+
+        Args:
+            query (str): The user's query.
+
+        Returns:
+            list of SearchResult: The search results in relevance order.
+        """
+        query_embedding = await self.embeddings.aembed_query(query)
+        return await asyncio.to_thread(self.search_by_embedding, query_embedding)
@@ -0,0 +1,415 @@
+import os
+import json
+import mmap
+import fcntl
+import threading
+from contextlib import contextmanager
+import numpy as np
+
+class LocalVectorIndex:
+    """
+    On-disk vector index searched in-process with NumPy.
+
+    Layout of the index directory:
+    - embeddings.f32: unit-normalized float32 embeddings, one row per chunk, memory-mapped for search.
+    - chunks.jsonl / chunk_offsets.i64: chunk text and metadata, one JSON line per row, and the byte
+      offset of each line so a row is read without scanning the file.
+    - ivf_centroids.<generation>.f32 / ivf_rows.<generation>.i32 / ivf_list_offsets.<generation>.i64:
+      optional inverted-file partition (centroids, rows grouped by list, list boundaries) built by
+      `build_ivf`. Each rebuild writes a new generation so readers never mix two partitions; the
+      previous generation is kept until the next rebuild for readers that read the old manifest.
+    - deleted_rows.i32: rows deleted by `delete` (tombstones), excluded from searches.
+    - manifest.json: number of committed rows and the layout of the files, replaced atomically.
+
+    Writers append under an exclusive file lock and publish new rows by replacing the manifest, so
+    readers never see partially written rows. Readers only memory-map the files: several uvicorn
+    workers share the same pages from the OS page cache instead of each loading a copy, and pick up
+    new rows on their next search.
+
+    Attributes:
+    ----------
+    index_dir : str
+        Directory holding the index files.
+    """
+
+    EMBEDDINGS_FILE = "embeddings.f32"
+    CHUNKS_FILE = "chunks.jsonl"
+    OFFSETS_FILE = "chunk_offsets.i64"
+    CENTROIDS_FILE = "ivf_centroids.{generation}.f32"
+    IVF_ROWS_FILE = "ivf_rows.{generation}.i32"
+    IVF_OFFSETS_FILE = "ivf_list_offsets.{generation}.i64"
+    DELETED_FILE = "deleted_rows.i32"
+    MANIFEST_FILE = "manifest.json"
+    LOCK_FILE = ".lock"
+
+    # Rows scored per block when clustering, to bound the memory of the similarity matrix
+    BLOCK_ROWS = 65536
+
+    def __init__(self, index_dir: str = None):
+        """
+        Opens (or prepares) the index stored in `index_dir`, by default the LOCAL_INDEX_DIR
+        environment variable or "local_index".
+        """
+        self.index_dir = index_dir or os.getenv("LOCAL_INDEX_DIR", "local_index")
+        os.makedirs(self.index_dir, exist_ok=True)
+        self._refresh_lock = threading.Lock()
+        self._manifest_stamp = None
+        self._snapshot = self._empty_snapshot()
+
+    def _path(self, name: str) -> str:
+        """
+        Returns the path of an index file.
+        """
+        return os.path.join(self.index_dir, name)
+
+    @staticmethod
+    def _empty_snapshot() -> dict:
+        """
+        Returns the state of an index without any committed row.
+        """
+        return {
+            "manifest": {"count": 0, "dimension": None, "chunks_bytes": 0, "ivf_lists": 0, "ivf_count": 0, "ivf_generation": 0, "deleted_count": 0},
+            "embeddings": None,
+            "deleted": None,
+            "offsets": None,
+            "chunks": None,
+            "centroids": None,
+            "ivf_rows": None,
+            "ivf_offsets": None,
+        }
+
+    def _read_manifest(self) -> dict:
+        """
+        Reads the committed manifest, or the empty manifest if nothing was committed yet.
+        """
+        try:
+            with open(self._path(self.MANIFEST_FILE)) as manifest_file:
+                return json.load(manifest_file)
+        except FileNotFoundError:
+            return dict(self._empty_snapshot()["manifest"])
+
+    def _write_manifest(self, manifest: dict):
+        """
+        Atomically replaces the manifest, which publishes the rows it describes.
+        """
+        temporary_path = self._path(self.MANIFEST_FILE + ".tmp")
+        with open(temporary_path, "w") as manifest_file:
+            json.dump(manifest, manifest_file)
+            manifest_file.flush()
+            os.fsync(manifest_file.fileno())
+        os.replace(temporary_path, self._path(self.MANIFEST_FILE))
+
+    @contextmanager
+    def _write_lock(self):
+        """
+        Holds the exclusive writer lock shared by all processes using this directory.
+        """
+        with open(self._path(self.LOCK_FILE), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def refresh(self):
+        """
+        Re-maps the index files if another process committed a new manifest.
+        """
+        try:
+            stat = os.stat(self._path(self.MANIFEST_FILE))
+        except FileNotFoundError:
+            return
+        stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if stamp == self._manifest_stamp:
+            return
+
+        with self._refresh_lock:
+            if stamp == self._manifest_stamp:
+                return
+            manifest = self._read_manifest()
+            snapshot = self._empty_snapshot()
+            snapshot["manifest"] = manifest
+            count, dimension = manifest["count"], manifest["dimension"]
+
+            if count:
+                snapshot["embeddings"] = np.memmap(self._path(self.EMBEDDINGS_FILE), dtype=np.float32, mode="r", shape=(count, dimension))
+                snapshot["offsets"] = np.memmap(self._path(self.OFFSETS_FILE), dtype=np.int64, mode="r", shape=(count,))
+                with open(self._path(self.CHUNKS_FILE), "rb") as chunks_file:
+                    snapshot["chunks"] = mmap.mmap(chunks_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+            if manifest.get("deleted_count"):
+                # Mask of the deleted rows
+                deleted_rows = np.fromfile(self._path(self.DELETED_FILE), dtype=np.int32, count=manifest["deleted_count"])
+                snapshot["deleted"] = np.zeros(count, dtype=bool)
+                snapshot["deleted"][deleted_rows] = True
+
+            if manifest.get("ivf_lists"):
+                n_lists, generation = manifest["ivf_lists"], manifest["ivf_generation"]
+                snapshot["centroids"] = np.memmap(self._path(self.CENTROIDS_FILE.format(generation=generation)), dtype=np.float32, mode="r", shape=(n_lists, dimension))
+                snapshot["ivf_rows"] = np.memmap(self._path(self.IVF_ROWS_FILE.format(generation=generation)), dtype=np.int32, mode="r", shape=(manifest["ivf_count"],))
+                snapshot["ivf_offsets"] = np.memmap(self._path(self.IVF_OFFSETS_FILE.format(generation=generation)), dtype=np.int64, mode="r", shape=(n_lists + 1,))
+
+            self._snapshot = snapshot
+            self._manifest_stamp = stamp
+
+    @property
+    def count(self) -> int:
+        """
+        Number of committed rows, including deleted rows.
+        """
+        self.refresh()
+        return self._snapshot["manifest"]["count"]
+
+    @staticmethod
+    def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+        """
+        Scales each row to unit length so that dot products are cosine similarities.
+        """
+        norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+        return matrix / np.where(norms == 0, 1, norms)
+
+    @staticmethod
+    def _append(path: str, committed_size: int, data: bytes):
+        """
+        Appends data after the committed part of a file, discarding bytes left by an interrupted writer.
+        """
+        with open(path, "a+b") as index_file:
+            index_file.truncate(committed_size)
+            index_file.seek(committed_size)
+            index_file.write(data)
+            index_file.flush()
+            os.fsync(index_file.fileno())
+
+    def add(self, embeddings, records: list) -> list:
+        """
+        Appends chunks to the index.
+
+        Parameters:
+        ----------
+        embeddings : list of list of float
+            The embedding of each chunk.
+        records : list of dict
+            The text and metadata of each chunk (at least "content"), stored as JSON.
+
+        Returns:
+        -------
+        list
+            The row numbers assigned to the chunks.
+        """
+        if not records:
+            return []
+        matrix = self._normalize_rows(np.asarray(embeddings, dtype=np.float32))
+
+        with self._write_lock():
+            manifest = self._read_manifest()
+            count = manifest["count"]
+            if manifest["dimension"] is None:
+                manifest["dimension"] = int(matrix.shape[1])
+            elif manifest["dimension"] != matrix.shape[1]:
+                raise ValueError(f"Embedding dimension {matrix.shape[1]} does not match the index dimension {manifest['dimension']}")
+
+            # Serialize the side store and the offset of each record within it
+            encoded_records = [(json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8") for record in records]
+            lengths = np.fromiter((len(line) for line in encoded_records), dtype=np.int64, count=len(encoded_records))
+            offsets = manifest["chunks_bytes"] + np.concatenate(([0], np.cumsum(lengths)[:-1]))
+
+            self._append(self._path(self.EMBEDDINGS_FILE), count * manifest["dimension"] * 4, matrix.tobytes())
+            self._append(self._path(self.OFFSETS_FILE), count * 8, offsets.tobytes())
+            self._append(self._path(self.CHUNKS_FILE), manifest["chunks_bytes"], b"".join(encoded_records))
+
+            manifest["count"] = count + len(records)
+            manifest["chunks_bytes"] = int(manifest["chunks_bytes"] + lengths.sum())
+            self._write_manifest(manifest)
+
+        return list(range(count, count + len(records)))
+
+    def delete(self, rows: list):
+        """
+        Marks rows as deleted. Their data stays in the files but they are no longer returned by `search`.
+
+        Parameters:
+        ----------
+        rows : list of int
+            Row numbers returned by `add`.
+        """
+        if not rows:
+            return
+
+        with self._write_lock():
+            manifest = self._read_manifest()
+            manifest.setdefault("deleted_count", 0)
+            rows = np.asarray(rows, dtype=np.int32)
+            if rows.min() < 0 or rows.max() >= manifest["count"]:
+                raise ValueError("Cannot delete rows that are not committed")
+
+            self._append(self._path(self.DELETED_FILE), manifest["deleted_count"] * 4, rows.tobytes())
+            manifest["deleted_count"] += len(rows)
+            self._write_manifest(manifest)
+
+    def build_ivf(self, n_lists: int = None, iterations: int = 10, seed: int = 0):
+        """
+        Partitions the committed rows into `n_lists` clusters with spherical k-means, so searches
+        only score the rows of the clusters closest to the query. Rows added afterwards are
+        always scored until the partition is rebuilt.
+
+        Parameters:
+        ----------
+        n_lists : int
+            Number of clusters, by default the square root of the number of rows.
+        iterations : int
+            Number of k-means iterations.
+        seed : int
+            Seed of the initial centroid sample.
+        """
+        with self._write_lock():
+            self.refresh()
+            snapshot = self._snapshot
+            manifest = dict(snapshot["manifest"])
+            count = manifest["count"]
+            if not count:
+                return
+
+            matrix = snapshot["embeddings"]
+            n_lists = min(n_lists or max(1, int(np.sqrt(count))), count)
+            rng = np.random.default_rng(seed)
+            centroids = np.array(matrix[np.sort(rng.choice(count, n_lists, replace=False))])
+            assignments = np.empty(count, dtype=np.int32)
+
+            for _ in range(iterations):
+                sums = np.zeros_like(centroids)
+                for start in range(0, count, self.BLOCK_ROWS):
+                    block = np.asarray(matrix[start:start + self.BLOCK_ROWS])
+                    block_assignments = np.argmax(block @ centroids.T, axis=1)
+                    assignments[start:start + len(block)] = block_assignments
+                    np.add.at(sums, block_assignments, block)
+                # Empty clusters keep their previous centroid
+                non_empty = np.linalg.norm(sums, axis=1) > 0
+                centroids[non_empty] = self._normalize_rows(sums[non_empty])
+
+            ivf_rows = np.argsort(assignments, kind="stable").astype(np.int32)
+            ivf_offsets = np.concatenate(([0], np.cumsum(np.bincount(assignments, minlength=n_lists)))).astype(np.int64)
+
+            previous_generation = manifest.get("ivf_generation", 0)
+            generation = previous_generation + 1
+            file_names = (self.CENTROIDS_FILE, self.IVF_ROWS_FILE, self.IVF_OFFSETS_FILE)
+            for name, array in zip(file_names, (centroids, ivf_rows, ivf_offsets)):
+                array.tofile(self._path(name.format(generation=generation)))
+
+            manifest["ivf_lists"] = int(n_lists)
+            manifest["ivf_count"] = int(count)
+            manifest["ivf_generation"] = generation
+            self._write_manifest(manifest)
+
+            # The previous partition stays for readers that read its manifest but did not map it
+            # yet; the one before it is no longer referenced by any manifest a reader can be mapping
+            for name in file_names:
+                expired_path = self._path(name.format(generation=previous_generation - 1))
+                if os.path.exists(expired_path):
+                    os.remove(expired_path)
+
+    def search(self, query_embedding, top_k: int, nprobe: int = None) -> list:
+        """
+        Finds the rows most similar to a query embedding.
+
+        Parameters:
+        ----------
+        query_embedding : list of float
+            The embedding of the query.
+        top_k : int
+            Number of rows to return.
+        nprobe : int
+            Number of IVF clusters to scan. The search is exact when no partition was built or
+            when `nprobe` is None or covers every cluster.
+
+        Returns:
+        -------
+        list
+            `(row, score)` pairs, best first, with the cosine similarity as score.
+        """
+        self.refresh()
+        snapshot = self._snapshot
+        manifest = snapshot["manifest"]
+        if not manifest["count"] or top_k <= 0:
+            return []
+
+        query_vector = self._normalize_rows(np.asarray(query_embedding, dtype=np.float32))
+        n_lists = manifest.get("ivf_lists", 0)
+
+        if n_lists and nprobe and nprobe < n_lists:
+            # Score only the rows of the closest clusters and the rows added after clustering
+            closest_lists = np.argpartition(-(snapshot["centroids"] @ query_vector), nprobe - 1)[:nprobe]
+            ivf_offsets = snapshot["ivf_offsets"]
+            candidate_rows = np.concatenate(
+                [snapshot["ivf_rows"][ivf_offsets[list_id]:ivf_offsets[list_id + 1]] for list_id in closest_lists]
+                + [np.arange(manifest["ivf_count"], manifest["count"], dtype=np.int32)]
+            )
+            candidate_rows.sort()  # Sequential reads through the memory map
+            scores = snapshot["embeddings"][candidate_rows] @ query_vector
+            deleted = snapshot["deleted"][candidate_rows] if snapshot["deleted"] is not None else None
+        else:
+            candidate_rows = None
+            scores = snapshot["embeddings"] @ query_vector
+            deleted = snapshot["deleted"]
+
+        live_count = len(scores)
+        if deleted is not None:
+            # Deleted rows rank last and are not returned
+            scores[deleted] = -np.inf
+            live_count -= int(np.count_nonzero(deleted))
+
+        k = min(top_k, live_count)
+        if k <= 0:
+            return []
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best], kind="stable")]
+        rows = candidate_rows[best] if candidate_rows is not None else best
+        return [(int(row), float(scores[i])) for row, i in zip(rows, best)]
+
+    def get_records(self, rows: list) -> list:
+        """
+        Reads the stored text and metadata of rows.
+
+        Parameters:
+        ----------
+        rows : list of int
+            Row numbers returned by `search` or `add`.
+
+        Returns:
+        -------
+        list
+            The stored record of each row.
+        """
+        snapshot = self._snapshot
+        manifest = snapshot["manifest"]
+        offsets, chunks = snapshot["offsets"], snapshot["chunks"]
+        records = []
+        for row in rows:
+            end = offsets[row + 1] if row + 1 < manifest["count"] else manifest["chunks_bytes"]
+            records.append(json.loads(chunks[offsets[row]:end]))
+        return records
+
+    def get_embeddings(self, rows: list) -> np.ndarray:
+        """
+        Reads the stored embeddings of rows.
+
+        Parameters:
+        ----------
+        rows : list of int
+            Row numbers returned by `search` or `add`.
+
+        Returns:
+        -------
+        numpy.ndarray
+            The unit-length embedding of each row, copied out of the memory map.
+        """
+        return np.array(self._snapshot["embeddings"][rows], dtype=np.float32)
+
+
+# Example usage: rebuild the IVF partition of the index in LOCAL_INDEX_DIR after a large ingestion
+#     python -m rag.LocalVectorIndex [n_lists]
+if __name__ == "__main__":
+    import sys
+
+    local_index = LocalVectorIndex()
+    local_index.build_ivf(int(sys.argv[1]) if len(sys.argv) > 1 else None)
+    print(f"IVF partition built over {local_index.count} rows in {local_index.index_dir}")
@@ -1,3 +1,13 @@
+import os
+import math
+import shutil
+import tempfile
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pypdf import PdfReader
+from langchain_core.documents import Document
 from langchain_community.document_loaders import PyPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
@@ -6,21 +16,39 @@ class PDFExtractor:
     A class to extract text from a PDF file and split it into smaller chunks using the
     RecursiveCharacterTextSplitter. This is useful for processing large PDFs where the content
     needs to be split into smaller pieces for further analysis or processing.
+
+    Large PDFs can be extracted in parallel by `iter_chunks`: page ranges are parsed by a pool of
+    worker processes and their chunks are merged back in page order. The pool is shared by every
+    extraction of the process and lives until `shutdown_pool`, so concurrent ingestions never run
+    more than PDF_EXTRACT_WORKERS extraction processes in total. Its processes are started with
+    "spawn": forking the multi-threaded application process could deadlock the children.
     """
+
+    _pool = None
+    _pool_lock = threading.Lock()
     
-    def __init__(self, pdf_path, chunk_size=1000, chunk_overlap=20):
+    def __init__(self, pdf_path, chunk_size=1000, chunk_overlap=20, max_workers=None, pages_per_task=None):
         """
         Initializes the PDFExtractor with the file path of the PDF, the size of each chunk,
         and the overlap between consecutive chunks.
         
         Args:
-            pdf_path (str): Path to the PDF file to be processed.
+            pdf_path (str or file-like): Path to the PDF file to be processed, or a seekable binary
+                                         stream holding it (only supported by `iter_chunks`).
             chunk_size (int): Maximum size of each text chunk. Default is 1000 characters.
             chunk_overlap (int): Number of overlapping characters between consecutive chunks. Default is 20 characters.
+            max_workers (int): Maximum number of extraction processes used for this PDF. Defaults to the
+                               PDF_EXTRACT_WORKERS environment variable, or the number of CPUs, which also
+                               sizes the shared pool; 1 disables parallel extraction.
+            pages_per_task (int): Number of consecutive pages extracted by one task. Defaults to the
+                                  PDF_EXTRACT_PAGES_PER_TASK environment variable, or 16.
         """
         self.pdf_path = pdf_path  # Store the PDF file path
         self.chunk_size = chunk_size  # Set the maximum size for each chunk of text
         self.chunk_overlap = chunk_overlap  # Set the overlap between consecutive text chunks
+        # Set the parallel extraction limits
+        self.max_workers = max_workers or int(os.getenv("PDF_EXTRACT_WORKERS", str(os.cpu_count() or 1)))
+        self.pages_per_task = pages_per_task or int(os.getenv("PDF_EXTRACT_PAGES_PER_TASK", "16"))
 
     def extract_content(self):
         """
@@ -42,6 +70,153 @@ class PDFExtractor:
         # Return the list of text chunks
         return file_chunks
 
+    def worker_count(self, page_count):
+        """
+        Chooses the number of extraction processes for a PDF: one per task of `pages_per_task`
+        pages, up to `max_workers`. Small PDFs are extracted in the calling process.
+
+        Args:
+            page_count (int): Number of pages of the PDF.
+
+        Returns:
+            int: The number of processes, 1 meaning sequential extraction.
+        """
+        return max(1, min(self.max_workers, math.ceil(page_count / self.pages_per_task)))
+
+    def iter_chunks(self, source=None):
+        """
+        Lazily extracts the PDF one page at a time and yields its text chunks.
+
+        Unlike `extract_content`, only the current pages' text and chunks are held in memory,
+        and the PDF can be read from an in-memory stream instead of a file. The PDF structure is
+        parsed immediately, so a malformed file fails here rather than while iterating.
+
+        PDFs with more pages than one task are split into page ranges extracted by a process pool
+        (see `worker_count`). A bounded number of ranges is in flight at a time and their chunks
+        are yielded in page order, exactly as the sequential extraction would.
+
+        Args:
+            source (str): Value of the "source" metadata of the chunks. Defaults to the PDF path.
+
+        Returns:
+            generator: The text chunks as Documents, with their "source" and zero-based "page" metadata.
+        """
+        # Initialize a text splitter with the specified chunk size and overlap
+        splitter = RecursiveCharacterTextSplitter(chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap)
+        reader = PdfReader(self.pdf_path)
+        if source is None:
+            source = self.pdf_path
+
+        workers = self.worker_count(len(reader.pages))
+        if workers == 1:
+            return self._generate_chunks(reader, splitter, source)
+        return self._generate_chunks_in_parallel(len(reader.pages), workers, source)
+
+    @staticmethod
+    def _generate_chunks(reader, splitter, source):
+        """
+        Yields the chunks of each page in turn.
+        """
+        for page_number, page in enumerate(reader.pages):
+            # Split each page on its own, as PyPDFLoader.load_and_split does
+            for chunk_text in splitter.split_text(page.extract_text()):
+                yield Document(page_content=chunk_text, metadata={"source": source, "page": page_number})
+
+    @classmethod
+    def _shared_pool(cls):
+        """
+        Returns the process pool shared by all extractions, starting it on first use.
+        """
+        with cls._pool_lock:
+            if cls._pool is None:
+                cls._pool = ProcessPoolExecutor(
+                    max_workers=int(os.getenv("PDF_EXTRACT_WORKERS", str(os.cpu_count() or 1))),
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            return cls._pool
+
+    @classmethod
+    def shutdown_pool(cls):
+        """
+        Stops the shared extraction processes. A later parallel extraction starts a new pool.
+        """
+        with cls._pool_lock:
+            pool, cls._pool = cls._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def _pdf_file(self):
+        """
+        Returns the path of a file holding the PDF, that worker processes can open, and whether it
+        is a temporary copy of a stream that the caller must delete.
+        """
+        if isinstance(self.pdf_path, (str, os.PathLike)):
+            return os.fspath(self.pdf_path), False
+        # A stream backed by a named file (e.g. a NamedTemporaryFile) is opened by its name
+        name = getattr(self.pdf_path, "name", None)
+        if isinstance(name, str) and os.path.isfile(name):
+            self.pdf_path.flush()
+            return name, False
+        # Other streams are copied block by block, never held as a second copy in memory
+        self.pdf_path.seek(0)
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as pdf_file:
+            shutil.copyfileobj(self.pdf_path, pdf_file)
+        return pdf_file.name, True
+
+    def _generate_chunks_in_parallel(self, page_count, workers, source):
+        """
+        Yields the chunks of each page in turn, extracting page ranges in the shared worker processes.
+        """
+        page_ranges = deque(
+            (start, min(start + self.pages_per_task, page_count))
+            for start in range(0, page_count, self.pages_per_task)
+        )
+        pdf_file, temporary = self._pdf_file()
+        executor = self._shared_pool()
+        in_flight = deque()
+        try:
+            # Keep two ranges per worker in flight, so finished ranges wait for the consumer in memory
+            # only briefly and the workers never idle while the next range is queued
+            while page_ranges or in_flight:
+                while page_ranges and len(in_flight) < 2 * workers:
+                    in_flight.append(executor.submit(
+                        _extract_page_range, pdf_file, *page_ranges.popleft(), self.chunk_size, self.chunk_overlap
+                    ))
+
+                # Yield the oldest range first to keep the page order
+                for page_number, chunk_texts in in_flight.popleft().result():
+                    for chunk_text in chunk_texts:
+                        yield Document(page_content=chunk_text, metadata={"source": source, "page": page_number})
+        finally:
+            # Also reached when the consumer stops early: drop the queued ranges of this PDF
+            for future in in_flight:
+                future.cancel()
+            if temporary:
+                os.remove(pdf_file)
+
+# Last PDF parsed by an extraction worker process, reused by its following page ranges
+_worker_pdf = {"key": None, "reader": None}
+
+def _extract_page_range(pdf_file, start, end, chunk_size, chunk_overlap):
+    """
+    Extracts and splits the pages [start, end) of a PDF file in a worker process.
+
+    Returns:
+        list: (page number, chunk texts) for each page of the range.
+    """
+    # The PDF is parsed again only when the worker moves to another file, or the file changed
+    stat = os.stat(pdf_file)
+    key = (pdf_file, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    if _worker_pdf["key"] != key:
+        _worker_pdf["reader"] = PdfReader(pdf_file)
+        _worker_pdf["key"] = key
+    reader = _worker_pdf["reader"]
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    return [
+        (page_number, splitter.split_text(reader.pages[page_number].extract_text()))
+        for page_number in range(start, end)
+    ]
+
 # Example usage:
 # Uncomment the following lines to use the PDFExtractor on a PDF file
 
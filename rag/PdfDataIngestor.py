@@ -1,10 +1,20 @@
 import os
+import json
+import tempfile
+import hashlib
+import itertools
 from dotenv import load_dotenv
 from langchain_openai import AzureOpenAIEmbeddings
 from langchain.vectorstores.azuresearch import AzureSearch
+from langchain_community.vectorstores.azuresearch import FIELDS_ID, FIELDS_CONTENT, FIELDS_CONTENT_VECTOR, FIELDS_METADATA
 from rag.PdfDataExtractor import PDFExtractor  # Custom class to handle PDF extraction
+from rag.LocalVectorIndex import LocalVectorIndex
+from rag.LocalKeywordIndex import LocalKeywordIndex
+from rag.EmbeddingCache import EmbeddingCache
+from rag.AdaptiveEmbedder import AdaptiveEmbedder
+from rag.IngestionManifest import IngestionManifest
+from rag.PipelineMetrics import INGEST_STAGE_SECONDS, INGEST_DOCUMENTS_TOTAL, INGEST_CHUNKS_TOTAL
 from azure.storage.blob import BlobServiceClient
-import tempfile
 
 class DataIngestor:
     """
@@ -15,7 +25,11 @@ class DataIngestor:
     - Connecting to Azure Blob Storage to download PDF files.
     - Extracting content from the PDF.
     - Using Azure OpenAI to generate embeddings for the content.
-    - Ingesting the embeddings into an Azure Search Index.
+    - Ingesting the embeddings into an Azure Search Index, or into the LocalVectorIndex when
+      RETRIEVER_BACKEND is "local".
+    - Indexing the chunks into the LocalKeywordIndex for hybrid (keyword + vector) retrieval.
+    - Re-ingesting a document incrementally: chunks have deterministic ids, only chunks that are not
+      yet indexed are embedded and uploaded, and chunks removed from the document are deleted.
     """
     
     def __init__(self):
@@ -24,9 +38,15 @@ class DataIngestor:
         OpenAI and Azure Search clients.
 
         It expects the following environment variables to be present:
-        - AZURE_SEARCH_ENDPOINT: The endpoint for the Azure Cognitive Search.
-        - AZURE_SEARCH_KEY: The access key for the Azure Cognitive Search.
-        - AZURE_SEARCH_INDEX: The name of the index where the documents will be stored.
+        - RETRIEVER_BACKEND: "azure" (default) to index into Azure Cognitive Search, "local" to index
+          into the LocalVectorIndex stored in LOCAL_INDEX_DIR, "hybrid" to index into the vector backend
+          named by HYBRID_VECTOR_BACKEND and into the LocalKeywordIndex.
+        - KEYWORD_INDEX_ENABLED: "true" to also build the LocalKeywordIndex with another backend.
+        - EMBEDDING_CACHE_ENABLED: "false" to disable the EmbeddingCache stored in EMBEDDING_CACHE_PATH.
+        - INGEST_MANIFEST_PATH: The IngestionManifest recording the chunks indexed for each document.
+        - AZURE_SEARCH_ENDPOINT: The endpoint for the Azure Cognitive Search (azure backend only).
+        - AZURE_SEARCH_KEY: The access key for the Azure Cognitive Search (azure backend only).
+        - AZURE_SEARCH_INDEX: The name of the index where the documents will be stored (azure backend only).
         - AZURE_OPENAI_EMBEDDING_ENDPOINT: The Azure OpenAI API endpoint.
         - AZURE_OPENAI_EMBEDDING_KEY: The API key for Azure OpenAI service.
         - AZURE_OPENAI_EMBEDDING_DEPLOYMENT: The name of the embedding deployment in Azure OpenAI.
@@ -37,10 +57,13 @@ class DataIngestor:
         # Load environment variables from a .env file
         load_dotenv(dotenv_path='../.env')
 
-        # Load Azure Search and OpenAI configuration
-        self.endpoint = os.environ["AZURE_SEARCH_ENDPOINT"]
-        self.key_credential = os.environ["AZURE_SEARCH_KEY"] 
-        self.index_name = os.environ["AZURE_SEARCH_INDEX"]
+        # Load the index backend, Azure Search and OpenAI configuration
+        self.backend = os.getenv("RETRIEVER_BACKEND", "azure").lower()
+        self.vector_backend = os.getenv("HYBRID_VECTOR_BACKEND", "azure").lower() if self.backend == "hybrid" else self.backend
+        if self.vector_backend == "azure":
+            self.endpoint = os.environ["AZURE_SEARCH_ENDPOINT"]
+            self.key_credential = os.environ["AZURE_SEARCH_KEY"] 
+            self.index_name = os.environ["AZURE_SEARCH_INDEX"]
         self.azure_openai_endpoint = os.environ["AZURE_OPENAI_EMBEDDING_ENDPOINT"]
         self.azure_openai_key = os.environ["AZURE_OPENAI_EMBEDDING_KEY"]
         self.azure_openai_embedding_deployment = os.environ["AZURE_OPENAI_EMBEDDING_DEPLOYMENT"]
@@ -52,71 +75,395 @@ class DataIngestor:
         
         print("Blob container name:", self.blob_container_name)  # Debugging
 
-        # Initialize Azure OpenAI Embeddings
+        # Number of chunks embedded and indexed together; bounds the chunks held in memory
+        self.window_size = int(os.getenv("INGEST_WINDOW_SIZE", "256"))
+        # Number of documents per Azure Search upload request
+        self.upload_batch_size = int(os.getenv("AZURE_SEARCH_UPLOAD_BATCH_SIZE", "1000"))
+
+        # Initialize the BlobServiceClient once so its connections are reused across documents
+        self.blob_service_client = BlobServiceClient.from_connection_string(self.azure_storage_connection_string) if self.azure_storage_connection_string else None
+
+        # Initialize Azure OpenAI Embeddings; throttling is handled by the adaptive embedder, not retried by the client
         self.embeddings = AzureOpenAIEmbeddings(
             azure_deployment=self.azure_openai_embedding_deployment,
             openai_api_version=self.azure_openai_api_version,
             azure_endpoint=self.azure_openai_endpoint,
-            api_key=self.azure_openai_key
+            api_key=self.azure_openai_key,
+            max_retries=0
         )
 
-        # Initialize Azure Search client
-        self.vector_store = AzureSearch(
-            azure_search_endpoint=self.endpoint,
-            azure_search_key=self.key_credential,
-            index_name=self.index_name,
-            embedding_function=self.embeddings.embed_query,
-            semantic_configuration_name="default"
+        # Initialize the batched, concurrent embedding of chunks (EMBEDDING_* variables)
+        self.embedder = AdaptiveEmbedder(self.embeddings)
+
+        # Initialize the cache of chunk embeddings, so unchanged chunks are not embedded again
+        embedding_cache_enabled = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+        self.embedding_cache = EmbeddingCache(self.azure_openai_embedding_deployment, self.azure_openai_api_version) if embedding_cache_enabled else None
+
+        # Initialize Azure Search client, or the local index for the local backend
+        self.vector_store = None
+        self.local_index = None
+        if self.vector_backend == "azure":
+            self.vector_store = AzureSearch(
+                azure_search_endpoint=self.endpoint,
+                azure_search_key=self.key_credential,
+                index_name=self.index_name,
+                embedding_function=self.embeddings.embed_query,
+                semantic_configuration_name="default"
+            )
+        else:
+            self.local_index = LocalVectorIndex()
+
+        # Initialize the BM25 keyword index used by hybrid retrieval
+        keyword_index_enabled = self.backend == "hybrid" or os.getenv("KEYWORD_INDEX_ENABLED", "false").lower() == "true"
+        self.keyword_index = LocalKeywordIndex() if keyword_index_enabled else None
+
+        # Initialize the record of indexed chunks used to re-ingest documents incrementally
+        self.ingestion_manifest = IngestionManifest()
+
+    def download_document(self, blob_name):
+        """
+        Downloads a PDF from Azure Blob Storage into a temporary file.
+
+        The blob is streamed chunk by chunk to the file, so large documents are never held in
+        memory, and the extraction worker processes open the file by its name instead of
+        receiving a copy. The file is created in the temporary directory (TMPDIR) and deleted
+        when it is closed. The BlobProperties of the downloaded version are kept in its
+        `properties` attribute.
+
+        Parameters:
+        ----------
+        blob_name : str
+            The name of the PDF file stored in Azure Blob Storage.
+
+        Returns:
+        -------
+        tempfile.NamedTemporaryFile
+            The content of the PDF, positioned at its start. The caller closes it.
+        """
+        blob_client = self.blob_service_client.get_blob_client(container=self.blob_container_name, blob=blob_name)
+
+        # Stream the blob content chunk by chunk into the file
+        download_stream = blob_client.download_blob()
+        document = tempfile.NamedTemporaryFile(prefix="ingest-", suffix=".pdf")
+        try:
+            for chunk in download_stream.chunks():
+                document.write(chunk)
+            document.flush()
+        except Exception:
+            document.close()
+            raise
+        document.seek(0)
+        document.properties = download_stream.properties
+        return document
+
+    def extract_records(self, blob_name, document):
+        """
+        Extracts the text chunks of a PDF lazily, one page at a time. Large PDFs are extracted by a
+        process pool (PDF_EXTRACT_WORKERS, PDF_EXTRACT_PAGES_PER_TASK), still in page order.
+
+        Parameters:
+        ----------
+        blob_name : str
+            The name of the PDF, recorded as the source of its chunks.
+        document : file-like
+            The content of the PDF, as returned by `download_document`.
+
+        Returns:
+        -------
+        generator
+            One record per chunk with its "id", "content", "source" and "page", in page order.
+        """
+        # Use the PDFExtractor to parse the PDF and split its pages into chunks as they are read
+        extractor = PDFExtractor(document)
+        file_chunks = extractor.iter_chunks(source=blob_name)
+
+        # Record the blob name as the chunk source
+        return (
+            {
+                "id": self.make_chunk_id(blob_name, file_chunk.metadata.get("page"), file_chunk.page_content),
+                "content": file_chunk.page_content,
+                "source": blob_name,
+                "page": file_chunk.metadata.get("page")
+            }
+            for file_chunk in file_chunks
         )
 
-    def ingest_data(self, blob_name):
+    @staticmethod
+    def make_chunk_id(source, page, content):
+        """
+        Derives the deterministic id of a chunk from its document, page and text, so the same chunk
+        gets the same id each time its document is ingested. The hex digest is a valid Azure Search key.
+
+        Returns:
+        -------
+        str
+            The chunk id.
+        """
+        content_hash = hashlib.sha256(content.encode("utf-8")).hexdigest()
+        return hashlib.sha256(f"{source}\0{page}\0{content_hash}".encode("utf-8")).hexdigest()
+
+    def embed_records(self, records):
+        """
+        Generates the embeddings of chunk records with Azure OpenAI, in token-bounded batches sent
+        concurrently by the AdaptiveEmbedder.
+
+        Embeddings of chunks whose text was embedded before are read from the embedding cache;
+        only the other chunks are sent to Azure OpenAI, and their embeddings are cached.
+
+        Parameters:
+        ----------
+        records : list
+            Chunk records with a "content" field.
+
+        Returns:
+        -------
+        list
+            The embedding of each record.
+        """
+        texts = [record["content"] for record in records]
+        if self.embedding_cache is None:
+            return self.embedder.embed(texts)
+
+        embeddings = self.embedding_cache.get_many(texts)
+        missing_texts = list(dict.fromkeys(text for text, embedding in zip(texts, embeddings) if embedding is None))
+        if missing_texts:
+            # Embed each missing text once, even if it occurs in several chunks
+            new_embeddings = self.embedder.embed(missing_texts)
+            self.embedding_cache.put_many(missing_texts, new_embeddings)
+            embedded = dict(zip(missing_texts, new_embeddings))
+            embeddings = [embedded[text] if embedding is None else embedding for text, embedding in zip(texts, embeddings)]
+        return embeddings
+
+    def _upload_to_azure_search(self, records, embeddings):
+        """
+        Uploads embedded chunks to Azure Search in the document layout of the LangChain AzureSearch store.
+
+        Returns:
+        -------
+        list
+            The keys of the uploaded documents.
+        """
+        documents = [
+            {
+                "@search.action": "upload",
+                # The chunk id is the key, so uploading a chunk again replaces it
+                FIELDS_ID: record["id"],
+                FIELDS_CONTENT: record["content"],
+                FIELDS_CONTENT_VECTOR: [float(value) for value in embedding],
+                FIELDS_METADATA: json.dumps({"source": record["source"], "page": record["page"]}),
+            }
+            for record, embedding in zip(records, embeddings)
+        ]
+
+        for start in range(0, len(documents), self.upload_batch_size):
+            response = self.vector_store.client.upload_documents(documents=documents[start:start + self.upload_batch_size])
+            # Check if all documents were successfully uploaded
+            if not all(result.succeeded for result in response):
+                raise Exception(response)
+        return [document[FIELDS_ID] for document in documents]
+
+    def index_records(self, records, embeddings, vector_refs=None):
+        """
+        Writes embedded chunk records to the vector index and, if enabled, the keyword index.
+
+        The step can be retried: when the vector write of a previous attempt succeeded, its
+        references are passed back in `vector_refs` and only the keyword index is written, so the
+        local index never receives the rows twice.
+
+        Parameters:
+        ----------
+        records : list
+            Chunk records with "content", "source" and "page" fields.
+        embeddings : list
+            The embedding of each record.
+        vector_refs : list
+            Filled in place with the vector backend references once the vector write succeeded;
+            a non-empty list skips the vector write.
+
+        Returns:
+        -------
+        list
+            The vector backend reference of each chunk (Azure Search key or local index row).
+        """
+        if vector_refs is None:
+            vector_refs = []
+        if not vector_refs:
+            if self.local_index is not None:
+                # Append the chunks to the local memory-mapped index
+                vector_refs.extend(self.local_index.add(embeddings, records))
+            else:
+                # Ingest the chunks into Azure Search; uploads are keyed by chunk id, so a retry replaces them
+                vector_refs.extend(self._upload_to_azure_search(records, embeddings))
+
+        # Index the same chunks for keyword search
+        if self.keyword_index is not None:
+            self.keyword_index.add(records)
+        return vector_refs
+
+    def delete_chunks(self, chunk_refs):
+        """
+        Deletes chunks from the vector index and, if enabled, the keyword index.
+
+        Parameters:
+        ----------
+        chunk_refs : dict
+            The vector backend reference of each chunk id, as recorded in the ingestion manifest.
+        """
+        if self.local_index is not None:
+            # Tombstone the rows in the local index
+            self.local_index.delete([int(vector_ref) for vector_ref in chunk_refs.values()])
+        else:
+            # Delete the documents from Azure Search
+            keys = list(chunk_refs.values())
+            for start in range(0, len(keys), self.upload_batch_size):
+                response = self.vector_store.client.delete_documents(documents=[{FIELDS_ID: key} for key in keys[start:start + self.upload_batch_size]])
+                if not all(result.succeeded for result in response):
+                    raise Exception(response)
+
+        if self.keyword_index is not None:
+            self.keyword_index.delete(list(chunk_refs))
+
+    def close(self):
+        """
+        Stops the shared PDF extraction processes and the embedding request threads. Call once
+        no ingestion is running.
+        """
+        PDFExtractor.shutdown_pool()
+        self.embedder.close()
+
+    def ingest_data(self, blob_name, progress=None, run_stage=None, raise_errors=False, on_download=None):
         """
         Ingests the content of a PDF stored in Azure Blob Storage into Azure Cognitive Search.
 
         This function:
-        - Downloads the PDF from Azure Blob Storage.
-        - Extracts the content using the PDFExtractor class.
-        - Sends the content to Azure OpenAI to generate embeddings.
-        - Ingests the resulting embeddings into Azure Search.
+        - Downloads the PDF from Azure Blob Storage into a temporary file, in chunks.
+        - Extracts the content page by page using the PDFExtractor class.
+        - Skips the chunks already indexed by a previous ingestion of the document.
+        - Sends the new chunks to Azure OpenAI to generate embeddings, one window of chunks at a time.
+        - Ingests the resulting embeddings into Azure Search (or the local index).
+        - Deletes the previously indexed chunks that are no longer in the document.
+
+        Chunks are extracted as they are needed, so besides the PDF itself at most one window of
+        chunks and their embeddings is held in memory. The duration of each stage is recorded in
+        the `legal_bot_ingest_stage_seconds` metric; extraction is run, timed and retried window
+        by window.
 
         Parameters:
         ----------
         blob_name : str
             The name of the PDF file stored in Azure Blob Storage to be processed and ingested.
+        progress : callable
+            Optional callback receiving the current stage and counters as keyword arguments
+            (`stage`, `pages`, `chunks`, `unchanged`, `embeddings`, `indexed`, `deleted`).
+        run_stage : callable
+            Optional wrapper called as `run_stage(stage, function, *args)` to run each stage,
+            e.g. to retry it. By default stages are called directly.
+        raise_errors : bool
+            Re-raise ingestion errors instead of returning None.
+        on_download : callable
+            Optional callback receiving the BlobProperties of the downloaded document, e.g. to
+            record the ETag of the version actually ingested.
 
         Returns:
         -------
-        dict
-            The results of the ingestion process returned by Azure Search.
+        list
+            The vector backend references of the newly indexed chunks, or None if the ingestion failed.
         """
-        # Initialize the BlobServiceClient to connect to Azure Blob Storage
-        blob_service_client = BlobServiceClient.from_connection_string(self.azure_storage_connection_string)
-        blob_client = blob_service_client.get_blob_client(container=self.blob_container_name, blob=blob_name)
+        progress = progress or (lambda **counters: None)
+        run_stage = run_stage or (lambda stage, function, *args: function(*args))
 
-        # Download the blob content to memory
-        download_stream = blob_client.download_blob()
-        file_content = download_stream.readall()  # Read the entire PDF content into memory
+        def run_timed_stage(stage, function, *args):
+            with INGEST_STAGE_SECONDS.time(stage=stage):
+                return run_stage(stage, function, *args)
 
-        # Create a temporary file to store the downloaded PDF content
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp_pdf:
-            temp_pdf.write(file_content)  # Write the PDF content to a temporary file
-            temp_pdf_path = temp_pdf.name  # Store the path to the temporary file
+        document = None
+        try:
+            # Chunks indexed by previous ingestions of the document
+            indexed_chunks = self.ingestion_manifest.get_chunks(blob_name)
 
-        # Use the PDFExtractor to extract the text content from the PDF file
-        extractor = PDFExtractor(temp_pdf_path)
-        file_chunks = extractor.extract_content()  # Extract content and split it into chunks
+            progress(stage="download")
+            document = run_timed_stage("download", self.download_document, blob_name)
+            if on_download is not None:
+                on_download(document.properties)
 
-        # Remove the temporary file after content extraction
-        os.remove(temp_pdf_path)
+            # A failed extraction leaves its generator finished, so a retried window restarts the
+            # extraction and skips the chunks already consumed; extraction is deterministic
+            extraction = {"records": None, "consumed": 0}
 
-        try:
-            # Ingest the extracted content into Azure Search using the vector store
-            results = self.vector_store.add_documents(documents=file_chunks)
+            def extract_window():
+                if extraction["records"] is None:
+                    records = self.extract_records(blob_name, document)
+                    extraction["records"] = itertools.islice(records, extraction["consumed"], None)
+                try:
+                    window = list(itertools.islice(extraction["records"], self.window_size))
+                except Exception:
+                    extraction["records"] = None
+                    raise
+                extraction["consumed"] += len(window)
+                return window
+
+            results = []
+            seen_ids = set()
+            chunks = 0
+            unchanged = 0
+            embedded = 0
+            while True:
+                # Pull the next window of chunks from the page-by-page extraction
+                progress(stage="extract")
+                window = run_timed_stage("extract", extract_window)
+                if not window:
+                    break
+                chunks += len(window)
+
+                # Keep the chunks that are neither indexed already nor repeated on their page
+                new_records = []
+                for record in window:
+                    if record["id"] in seen_ids:
+                        continue
+                    seen_ids.add(record["id"])
+                    if record["id"] in indexed_chunks:
+                        unchanged += 1
+                    else:
+                        new_records.append(record)
+                progress(stage="embed", pages=window[-1]["page"] + 1, chunks=chunks, unchanged=unchanged)
+                if not new_records:
+                    continue
+
+                embeddings = run_timed_stage("embed", self.embed_records, new_records)
+                embedded += len(embeddings)
+                progress(stage="index", embeddings=embedded)
+
+                # Retries of the index stage reuse the rows of a vector write that already succeeded
+                vector_refs = run_timed_stage("index", self.index_records, new_records, embeddings, [])
+                self.ingestion_manifest.add_chunks(blob_name, {record["id"]: vector_ref for record, vector_ref in zip(new_records, vector_refs)})
+                results.extend(vector_refs)
+                progress(indexed=len(results))
+
+            # Delete the chunks that are no longer in the document
+            stale_chunks = {chunk_id: vector_ref for chunk_id, vector_ref in indexed_chunks.items() if chunk_id not in seen_ids}
+            if stale_chunks:
+                progress(stage="index")
+                with INGEST_STAGE_SECONDS.time(stage="delete"):
+                    run_stage("index", self.delete_chunks, stale_chunks)
+                self.ingestion_manifest.remove_chunks(blob_name, list(stale_chunks))
+            progress(deleted=len(stale_chunks))
+
+            INGEST_DOCUMENTS_TOTAL.inc(outcome="succeeded")
+            INGEST_CHUNKS_TOTAL.inc(embedded, result="embedded")
+            INGEST_CHUNKS_TOTAL.inc(unchanged, result="unchanged")
+            INGEST_CHUNKS_TOTAL.inc(len(stale_chunks), result="deleted")
             return results  # Return the results of the ingestion process
         except Exception as e:
             # Handle any errors that occur during the ingestion process
             print(f"Data ingestion failed: {e}")
+            INGEST_DOCUMENTS_TOTAL.inc(outcome="failed")
+            if raise_errors:
+                raise
             return None
+        finally:
+            # Release the downloaded PDF
+            if document is not None:
+                document.close()
 
 
 # Example usage (commented out):
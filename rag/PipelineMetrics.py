@@ -0,0 +1,205 @@
+import time
+import threading
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from a cache hit to a long completion or ingestion stage
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+def _format_labels(labelnames: tuple, labelvalues: tuple, extra: str = "") -> str:
+    """
+    Formats a label set in the Prometheus text format, e.g. `{stage="llm"}`.
+    """
+    pairs = [
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in zip(labelnames, labelvalues)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    """
+    Formats a sample value, using "+Inf" for infinity.
+    """
+    return "+Inf" if value == float("inf") else repr(float(value))
+
+class Counter:
+    """
+    Monotonic counter with optional labels.
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # label values -> count
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        """
+        Adds `amount` to the counter of the given labels.
+        """
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        """
+        Returns the current count of the given labels.
+        """
+        with self._lock:
+            return self._values.get(tuple(labels[name] for name in self.labelnames), 0)
+
+    def render(self) -> list:
+        """
+        Returns the exposition lines of the counter.
+        """
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+class Histogram:
+    """
+    Histogram with cumulative buckets, a sum and a count per label set.
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._series = {}  # label values -> [bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        """
+        Records one observation for the given labels.
+        """
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observes the duration of a `with` block, in seconds, including when it raises.
+        """
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, **labels)
+
+    def render(self) -> list:
+        """
+        Returns the exposition lines of the histogram.
+        """
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (bucket_counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, bucket_counts):
+                    cumulative += bucket_count
+                    le = 'le="{}"'.format(_format_value(bound) if bound == float("inf") else repr(bound))
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+class MetricsRegistry:
+    """
+    Collection of the metrics exported on `/metrics` in the Prometheus text format.
+
+    Metrics are process-wide: with several uvicorn workers, each worker exports its own values and
+    the scraper aggregates them.
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        """
+        Creates and registers a counter.
+        """
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        """
+        Creates and registers a histogram.
+        """
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """
+        Returns every metric in the Prometheus text exposition format.
+        """
+        return "\n".join(line for metric in self._metrics for line in metric.render()) + "\n"
+
+
+# Metrics of the query and ingestion pipelines
+registry = MetricsRegistry()
+
+QUERY_STAGE_SECONDS = registry.histogram(
+    "legal_bot_query_stage_seconds",
+    "Duration of each stage of answering a query (cache_lookup, retrieve, rerank, pack, llm, total).",
+    ("stage",)
+)
+QUERIES_TOTAL = registry.counter(
+    "legal_bot_queries_total",
+    "Queries processed, by outcome (answered, cached, no_documents, error).",
+    ("outcome",)
+)
+LLM_TOKENS_TOTAL = registry.counter(
+    "legal_bot_llm_tokens_total",
+    "Tokens consumed by the chat model, by kind (prompt, completion).",
+    ("kind",)
+)
+CONTEXT_TOKENS = registry.histogram(
+    "legal_bot_context_tokens",
+    "Tokens of the packed context sent with each query.",
+    buckets=(250, 500, 1000, 1500, 2000, 3000, 4000, 6000, 8000)
+)
+CACHE_LOOKUPS_TOTAL = registry.counter(
+    "legal_bot_cache_lookups_total",
+    "Cache lookups, by cache (semantic_answer, embedding) and result (hit, miss).",
+    ("cache", "result")
+)
+ADMISSION_DECISIONS_TOTAL = registry.counter(
+    "legal_bot_admission_decisions_total",
+    "Admission control decisions, by result (admitted, rejected_413, rejected_429, rejected_503).",
+    ("result",)
+)
+INGEST_STAGE_SECONDS = registry.histogram(
+    "legal_bot_ingest_stage_seconds",
+    "Duration of each ingestion stage (download, extract, embed, index, delete), per call.",
+    ("stage",)
+)
+INGEST_DOCUMENTS_TOTAL = registry.counter(
+    "legal_bot_ingest_documents_total",
+    "Documents ingested, by outcome (succeeded, failed).",
+    ("outcome",)
+)
+INGEST_CHUNKS_TOTAL = registry.counter(
+    "legal_bot_ingest_chunks_total",
+    "Chunks processed by ingestion, by result (embedded, unchanged, deleted).",
+    ("result",)
+)
+EMBEDDING_REQUESTS_TOTAL = registry.counter(
+    "legal_bot_embedding_requests_total",
+    "Embedding requests sent during ingestion, by result (ok, throttled, error).",
+    ("result",)
+)
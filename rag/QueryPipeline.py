@@ -0,0 +1,192 @@
+import asyncio
+import os
+import threading
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
+from rag.QueryResponseGenerator import QueryResponseGenerator
+from rag.SemanticAnswerCache import SemanticAnswerCache
+
+# Environment variables whose values shape the clients built by the pipeline
+PIPELINE_CONFIG_VARIABLES = [
+    "AZURE_OPENAI_GPT4_MODEL",
+    "AZURE_OPENAI_GPT4_DEPLOYMENT",
+    "AZURE_OPENAI_GPT4_KEY",
+    "AZURE_OPENAI_GPT4_ENDPOINT",
+    "AZURE_OPENAI_GPT4_VERSION",
+    "AZURE_OPENAI_POOL_SIZE",
+    "AZURE_OPENAI_TIMEOUT",
+    "AZURE_SEARCH_KEY",
+    "AZURE_SEARCH_ENDPOINT",
+    "AZURE_SEARCH_INDEX",
+    "AZURE_SEARCH_TOP_RESULTS",
+    "AZURE_SEARCH_POOL_SIZE",
+    "AZURE_SEARCH_SELECT_FIELDS",
+    "AZURE_OPENAI_EMBEDDING_ENDPOINT",
+    "AZURE_OPENAI_EMBEDDING_KEY",
+    "AZURE_OPENAI_EMBEDDING_DEPLOYMENT",
+    "AZURE_OPENAI_EMBEDDING_VERSION",
+    "CONTEXT_TOKEN_BUDGET",
+    "RERANK_MODE",
+    "RERANK_TOP_N",
+    "RETRIEVER_BACKEND",
+    "LOCAL_INDEX_DIR",
+    "LOCAL_INDEX_TOP_RESULTS",
+    "LOCAL_INDEX_NPROBE",
+    "HYBRID_VECTOR_BACKEND",
+    "HYBRID_RRF_K",
+    "HYBRID_TOP_RESULTS",
+    "HYBRID_KEYWORD_TOP_RESULTS",
+    "LOCAL_KEYWORD_INDEX_DIR",
+    "BATCH_QUERY_CONCURRENCY",
+    "BATCH_QUERY_MAX_CONCURRENCY",
+]
+
+class QueryPipeline:
+    """
+    Process-wide owner of the RAG query pipeline.
+
+    The pipeline builds a single QueryResponseGenerator (LLM client, retriever and their pooled
+    HTTP connections) at application startup and lends it to every request. When the configuration
+    changes, `reload()` builds a fresh generator and swaps it in; the previous generator is closed
+    once the last request that borrowed it has finished.
+
+    Attributes:
+    ----------
+    generator : QueryResponseGenerator
+        The generator currently handed out to new requests.
+    answer_cache : SemanticAnswerCache
+        The semantic answer cache shared by every generator, or None unless SEMANTIC_CACHE_ENABLED
+        is true (it is off by default). It outlives reloads and is only cleared when the
+        configuration changes.
+    """
+
+    def __init__(self):
+        """
+        Initializes an empty pipeline. Call `start()` to build the clients.
+        """
+        self._lock = threading.Lock()
+        self.generator = None
+        self.answer_cache = SemanticAnswerCache() if os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true" else None
+        self._config_fingerprint = None
+        self._leases = {}  # id(generator) -> number of requests currently using it
+        self._retired = {}  # id(generator) -> generator waiting for its last lease to be released
+
+    @staticmethod
+    def _read_config_fingerprint() -> tuple:
+        """
+        Captures the current values of the configuration variables used by the pipeline.
+
+        Returns:
+        -------
+        tuple
+            The values of `PIPELINE_CONFIG_VARIABLES`, in order.
+        """
+        return tuple(os.getenv(name) for name in PIPELINE_CONFIG_VARIABLES)
+
+    def start(self):
+        """
+        Builds the query response generator and its pooled clients.
+        """
+        with self._lock:
+            if self.generator is None:
+                self._config_fingerprint = self._read_config_fingerprint()
+                self.generator = QueryResponseGenerator(answer_cache=self.answer_cache)
+
+    async def reload(self, force: bool = False) -> bool:
+        """
+        Re-reads the .env file and rebuilds the generator if its configuration has changed.
+
+        Parameters:
+        ----------
+        force : bool
+            Rebuild the generator even if the configuration is unchanged.
+
+        Returns:
+        -------
+        bool
+            True if a new generator was swapped in, False otherwise.
+        """
+        load_dotenv(override=True)
+        config_fingerprint = self._read_config_fingerprint()
+        if not force and config_fingerprint == self._config_fingerprint:
+            return False
+
+        # Build the new clients outside the lock and off the event loop so requests are not blocked meanwhile
+        new_generator = await asyncio.to_thread(QueryResponseGenerator, answer_cache=self.answer_cache)
+
+        with self._lock:
+            old_generator = self.generator
+            self.generator = new_generator
+            # Answers computed against another index or model are no longer valid
+            if self.answer_cache is not None and config_fingerprint != self._config_fingerprint:
+                self.answer_cache.clear()
+            self._config_fingerprint = config_fingerprint
+            close_now = old_generator is not None and not self._leases.get(id(old_generator))
+            if old_generator is not None and not close_now:
+                self._retired[id(old_generator)] = old_generator
+
+        if close_now:
+            await old_generator.aclose()
+        return True
+
+    @asynccontextmanager
+    async def lease(self):
+        """
+        Lends the current generator to a request for the duration of an `async with` block.
+
+        Yields:
+        ------
+        QueryResponseGenerator
+            The generator to use for this request.
+        """
+        with self._lock:
+            if self.generator is None:
+                raise RuntimeError("Query pipeline has not been started")
+            generator = self.generator
+            self._leases[id(generator)] = self._leases.get(id(generator), 0) + 1
+
+        try:
+            yield generator
+        finally:
+            retired_generator = None
+            with self._lock:
+                self._leases[id(generator)] -= 1
+                if not self._leases[id(generator)]:
+                    del self._leases[id(generator)]
+                    retired_generator = self._retired.pop(id(generator), None)
+
+            # The generator was replaced by a reload and this was its last user
+            if retired_generator is not None:
+                await retired_generator.aclose()
+
+    def invalidate_document(self, source: str) -> int:
+        """
+        Drops the cached answers that were computed from a document, e.g. after it was re-ingested.
+
+        Parameters:
+        ----------
+        source : str
+            The blob name of the document.
+
+        Returns:
+        -------
+        int
+            The number of invalidated answers.
+        """
+        if self.answer_cache is None:
+            return 0
+        return self.answer_cache.invalidate_source(source)
+
+    async def close(self):
+        """
+        Closes the current generator and any retired generators still held by the pipeline.
+        """
+        with self._lock:
+            generators = list(self._retired.values())
+            if self.generator is not None:
+                generators.append(self.generator)
+            self.generator = None
+            self._retired = {}
+
+        for generator in generators:
+            await generator.aclose()
@@ -1,8 +1,17 @@
 import os
+import re
+import httpx
+import asyncio
+from typing import AsyncIterator
 from dotenv import load_dotenv
-from langchain_openai import AzureChatOpenAI
+from langchain_openai import AzureChatOpenAI, AzureOpenAIEmbeddings
 from langchain_core.prompts import ChatPromptTemplate
-from rag.AzureSearchContentRetriever import AzureSearchContentRetriever
+from rag.ContentRetriever import ContentRetriever, create_content_retriever, render_citation
+from rag.SemanticAnswerCache import SemanticAnswerCache
+from rag.ContextPacker import ContextPacker
+from rag.ChunkReranker import ChunkReranker
+from rag.SingleFlight import SingleFlight
+from rag.PipelineMetrics import QUERY_STAGE_SECONDS, QUERIES_TOTAL, LLM_TOKENS_TOTAL, CONTEXT_TOKENS, CACHE_LOOKUPS_TOTAL
 
 # Load environment variables from a .env file
 load_dotenv(dotenv_path="../.env")
@@ -28,10 +37,24 @@ class QueryResponseGenerator:
         API version for Azure OpenAI.
     temperature : float
         The temperature setting for the model to control response randomness.
+    http_client : httpx.Client
+        Pooled keep-alive HTTP client shared by all sync calls to Azure OpenAI.
+    http_async_client : httpx.AsyncClient
+        Pooled keep-alive HTTP client shared by all async calls to Azure OpenAI.
     llm : AzureChatOpenAI
         Instance of AzureChatOpenAI for language generation.
-    retriever : AzureSearchContentRetriever
-        Instance of AzureSearchContentRetriever to fetch relevant documents.
+    retriever : ContentRetriever
+        The retriever backend (Azure Cognitive Search or the local vector index) fetching relevant documents.
+    single_flight : SingleFlight
+        Coalesces concurrent identical queries on the async path.
+    reranker : ChunkReranker
+        Optional second-stage re-ranker that keeps only the best retrieved chunks.
+    context_packer : ContextPacker
+        Assembles the prompt context from the retrieved chunks under a token budget.
+    answer_cache : SemanticAnswerCache
+        Optional cache of answers keyed on query embeddings, consulted before retrieval.
+    embeddings : AzureOpenAIEmbeddings
+        Embedding client used by the answer cache and the embedding re-ranker, or None when neither is enabled.
     
     Methods:
     -------
@@ -40,13 +63,34 @@ class QueryResponseGenerator:
     
     get_chat_query_response(query: str) -> str:
         Takes a user query, retrieves relevant document contexts using Azure Search,
-        and generates a response using Azure OpenAI GPT-4.
+        and generates a response using Azure OpenAI GPT-4. Blocking wrapper of `aget_chat_query_response`.
+
+    aget_chat_query_response(query: str) -> str:
+        Answers a query without blocking the event loop.
+
+    astream_chat_query_response(query: str) -> AsyncIterator[tuple]:
+        Streams the retrieved-context metadata followed by the answer tokens as they are generated.
+
+    aget_batch_chat_query_responses(queries: list, concurrency: int) -> list:
+        Answers a batch of queries with bounded concurrency, deduplicating repeated queries.
+
+    aclose() -> None:
+        Releases the pooled HTTP connections held by the LLM and the retriever.
+
+    close() -> None:
+        Blocking variant of `aclose` for scripts.
     """
 
-    def __init__(self):
+    def __init__(self, answer_cache: SemanticAnswerCache = None):
         """
         Initializes the QueryResponseGenerator instance with environment variables
         and sets up both the language model (AzureChatOpenAI) and the document retriever.
+
+        Parameters:
+        ----------
+        answer_cache : SemanticAnswerCache
+            Optional semantic answer cache. It is only used when the AZURE_OPENAI_EMBEDDING_*
+            variables are set, since queries are keyed on their embeddings.
         """
         # Retrieve environment variables for Azure OpenAI
         self.model_name = os.getenv("AZURE_OPENAI_GPT4_MODEL")
@@ -55,12 +99,72 @@ class QueryResponseGenerator:
         self.endpoint = os.getenv("AZURE_OPENAI_GPT4_ENDPOINT")
         self.version = os.getenv("AZURE_OPENAI_GPT4_VERSION")
         self.temperature = 0.2  # Controls the randomness of the responses
+        self.connection_pool_size = int(os.getenv("AZURE_OPENAI_POOL_SIZE", "100"))
+        self.request_timeout = float(os.getenv("AZURE_OPENAI_TIMEOUT", "60"))
+
+        # Pooled HTTP clients so that connections to Azure OpenAI are kept alive between requests
+        connection_limits = httpx.Limits(
+            max_connections=self.connection_pool_size,
+            max_keepalive_connections=self.connection_pool_size
+        )
+        self.http_client = httpx.Client(limits=connection_limits, timeout=self.request_timeout)
+        self.http_async_client = httpx.AsyncClient(limits=connection_limits, timeout=self.request_timeout)
         
         # Initialize the AzureChatOpenAI instance
         self.llm = self._initialize_llm_instance()
         
-        # Initialize the AzureSearchContentRetriever for document search
-        self.retriever = AzureSearchContentRetriever()
+        # Initialize the embedding client used by the semantic answer cache, the embedding re-ranker
+        # and the local retriever backend
+        needs_embeddings = (
+            answer_cache is not None
+            or os.getenv("RERANK_MODE", "none").lower() == "embedding"
+            or "local" in (os.getenv("RETRIEVER_BACKEND", "azure").lower(), os.getenv("HYBRID_VECTOR_BACKEND", "azure").lower())
+        )
+        self.embeddings = self._initialize_embeddings_instance() if needs_embeddings else None
+        self.answer_cache = answer_cache if self.embeddings is not None else None
+
+        # Initialize the retriever backend selected by RETRIEVER_BACKEND for document search
+        self.retriever = create_content_retriever(embeddings=self.embeddings)
+
+        # Initialize the optional ChunkReranker applied between retrieval and packing
+        self.reranker = ChunkReranker(embeddings=self.embeddings)
+
+        # Initialize the ContextPacker that keeps the prompt within its token budget
+        self.context_packer = ContextPacker()
+
+        # Coalesces concurrent identical queries into one retrieval and one generation
+        self.single_flight = SingleFlight()
+
+        # Event loop of the blocking `get_chat_query_response`, created on its first call
+        self._sync_loop = None
+
+        # Default and maximum number of batch queries processed at the same time
+        self.batch_concurrency = int(os.getenv("BATCH_QUERY_CONCURRENCY", "8"))
+        self.batch_max_concurrency = int(os.getenv("BATCH_QUERY_MAX_CONCURRENCY", "16"))
+
+    def _initialize_embeddings_instance(self) -> AzureOpenAIEmbeddings:
+        """
+        Initializes the AzureOpenAIEmbeddings instance used to embed queries for the answer cache and re-ranker.
+        
+        Returns:
+        -------
+        AzureOpenAIEmbeddings
+            The embedding client, or None if the embedding deployment is not configured.
+        """
+        embedding_deployment = os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT")
+        embedding_endpoint = os.getenv("AZURE_OPENAI_EMBEDDING_ENDPOINT")
+        if not embedding_deployment or not embedding_endpoint:
+            print("Query embeddings disabled: AZURE_OPENAI_EMBEDDING_* variables are not set")
+            return None
+
+        return AzureOpenAIEmbeddings(
+            azure_deployment=embedding_deployment,
+            openai_api_version=os.getenv("AZURE_OPENAI_EMBEDDING_VERSION"),
+            azure_endpoint=embedding_endpoint,
+            api_key=os.getenv("AZURE_OPENAI_EMBEDDING_KEY"),
+            http_client=self.http_client,
+            http_async_client=self.http_async_client
+        )
 
     def _initialize_llm_instance(self) -> AzureChatOpenAI:
         """
@@ -77,31 +181,27 @@ class QueryResponseGenerator:
             openai_api_version=self.version,
             openai_api_key=self.api_key,
             azure_endpoint=self.endpoint,
-            temperature=self.temperature
+            temperature=self.temperature,
+            http_client=self.http_client,
+            http_async_client=self.http_async_client
         )
 
-    def get_chat_query_response(self, query: str) -> str:
+    def _build_prompt_messages(self, query: str, retrieved_documents: str) -> list:
         """
-        Generates a response to a user query by first retrieving relevant documents
-        and then using Azure OpenAI GPT-4 to generate an intelligent answer.
+        Builds the chat messages sent to the language model for a query and its context.
         
         Parameters:
         ----------
         query : str
             The user's input question to be answered.
+        retrieved_documents : str
+            The document context retrieved for the query.
         
         Returns:
         -------
-        str
-            The response generated by Azure OpenAI based on the query and the context.
+        list
+            The prompt formatted as a list of chat messages.
         """
-        # Retrieve relevant documents using the document retriever
-        retrieved_documents = self.retriever.retrieve_searched_documents(query)
-        
-        # If no documents are found, return a no-results message
-        if not retrieved_documents:
-            return "No relevant documents found."
-
         # Define a prompt template to guide the GPT model
         template = (
             '''
@@ -111,6 +211,7 @@ class QueryResponseGenerator:
             If the question is not directly related to the context or you do not have enough information to answer it accurately, 
             respond with 'I'm not sure how to answer that based on the provided information.' or 'I don't have the information to answer this question.' 
             Be concise with your answer and complete the sentences. Do not leave anything incomplete.
+            Each context passage starts with its number and source, like [1]; cite the numbers of the passages you rely on.
 
             Context: {context}
 
@@ -124,14 +225,382 @@ class QueryResponseGenerator:
         formatted_prompt = prompt_template.format_prompt(context=retrieved_documents, query=query)
 
         # Convert the formatted prompt to message format
-        messages = formatted_prompt.to_messages()
+        return formatted_prompt.to_messages()
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        """
+        Normalizes a query for deduplication: case-folded with collapsed whitespace.
+        """
+        return re.sub(r"\s+", " ", query).strip().casefold()
+
+    @staticmethod
+    def _describe_search_results(search_results: list) -> list:
+        """
+        Extracts the context metadata of the packed chunks: their number in the context, citation,
+        score, source, page and chunk id.
+        """
+        return [
+            {
+                "number": number,
+                "citation": render_citation(result),
+                "score": result["score"],
+                "source": result["source"],
+                "page": result["page"],
+                "chunk_id": result.get("chunk_id"),
+            }
+            for number, result in enumerate(search_results, start=1)
+        ]
+
+    def _store_cached_answer(self, query_embedding, answer: str, search_results: list, cache_generation: int = None):
+        """
+        Stores a generated answer in the semantic answer cache, tagged with the documents it used,
+        unless a document was invalidated since the cache generation read before the lookup.
+        """
+        if self.answer_cache is not None and query_embedding is not None:
+            self.answer_cache.store(
+                query_embedding,
+                {"answer": answer, "documents": self._describe_search_results(search_results)},
+                sources={result["source"] for result in search_results},
+                generation=cache_generation
+            )
+
+    def _lookup_cached_answer(self, query_embedding) -> dict:
+        """
+        Looks a query embedding up in the semantic answer cache and counts the hit or miss.
+        """
+        cached_answer = self.answer_cache.lookup(query_embedding)
+        CACHE_LOOKUPS_TOTAL.inc(cache="semantic_answer", result="miss" if cached_answer is None else "hit")
+        return cached_answer
 
-        # Get the response from AzureChatOpenAI using the prompt messages
-        get_llm_response = self.llm(messages)
+    def _pack_context(self, search_results: list) -> dict:
+        """
+        Packs the re-ranked chunks into the context token budget, recording the time and context size.
+        """
+        with QUERY_STAGE_SECONDS.time(stage="pack"):
+            packed_context = self.context_packer.pack(search_results)
+        CONTEXT_TOKENS.observe(packed_context["tokens_used"])
+        return packed_context
 
-        # Extract and return the content from the language model's response
-        response_content = get_llm_response.content
-        return response_content
+    @staticmethod
+    def _record_token_usage(llm_response):
+        """
+        Counts the prompt and completion tokens reported by Azure OpenAI for a completion.
+        """
+        token_usage = getattr(llm_response, "response_metadata", {}).get("token_usage") or {}
+        LLM_TOKENS_TOTAL.inc(token_usage.get("prompt_tokens", 0), kind="prompt")
+        LLM_TOKENS_TOTAL.inc(token_usage.get("completion_tokens", 0), kind="completion")
+
+    def _record_streamed_token_usage(self, messages: list, answer: str):
+        """
+        Counts the prompt and completion tokens of a streamed completion. Streamed chunks carry no
+        usage, so both are counted with the tokenizer of the context packer.
+        """
+        LLM_TOKENS_TOTAL.inc(sum(self.context_packer.count_tokens(message.content) for message in messages), kind="prompt")
+        LLM_TOKENS_TOTAL.inc(self.context_packer.count_tokens(answer), kind="completion")
+
+    def get_chat_query_response(self, query: str) -> str:
+        """
+        Generates a response to a user query by first retrieving relevant documents
+        and then using Azure OpenAI GPT-4 to generate an intelligent answer.
+
+        Blocking wrapper of `aget_chat_query_response` for scripts, which must not call it from a
+        running event loop. Every call runs on the same private event loop, which the pooled async
+        clients stay bound to; `close()` releases it.
+        
+        Parameters:
+        ----------
+        query : str
+            The user's input question to be answered.
+        
+        Returns:
+        -------
+        str
+            The response generated by Azure OpenAI based on the query and the context.
+        """
+        if self._sync_loop is None:
+            self._sync_loop = asyncio.new_event_loop()
+        return self._sync_loop.run_until_complete(self.aget_chat_query_response(query))
+
+    async def aget_chat_query_response(self, query: str, on_cached=None) -> str:
+        """
+        Answers a query without blocking the event loop. Both the search and the completion are
+        awaited, so the event loop can serve other requests while they are in flight.
+
+        Concurrent identical queries (after normalization) are coalesced: they share a single
+        retrieval and a single generation and all receive its answer.
+        
+        Parameters:
+        ----------
+        query : str
+            The user's input question to be answered.
+        on_cached : callable
+            Called once when the query does not call the model itself: it joins an identical
+            query in flight, or its answer comes from the semantic answer cache.
+        
+        Returns:
+        -------
+        str
+            The response generated by Azure OpenAI based on the query and the context.
+        """
+        joined = False
+
+        def on_coalesced():
+            nonlocal joined
+            joined = True
+            if on_cached is not None:
+                on_cached()
+
+        answer, cached = await self.single_flight.do(self.normalize_query(query), self._aanswer_query, query, on_coalesced=on_coalesced)
+        if cached and not joined and on_cached is not None:
+            on_cached()
+        return answer
+
+    async def _aanswer_query(self, query: str) -> tuple:
+        """
+        Answers a query: cache lookup, retrieval, re-ranking, packing and generation.
+        
+        Parameters:
+        ----------
+        query : str
+            The user's input question to be answered.
+        
+        Returns:
+        -------
+        tuple
+            The response generated by Azure OpenAI based on the query and the context, and whether
+            it came from the semantic answer cache.
+        """
+        with QUERY_STAGE_SECONDS.time(stage="total"):
+            try:
+                # A semantically equivalent query answered earlier skips both search and generation
+                query_embedding = cached_answer = cache_generation = None
+                if self.answer_cache is not None:
+                    cache_generation = self.answer_cache.generation
+                    with QUERY_STAGE_SECONDS.time(stage="cache_lookup"):
+                        query_embedding = await self.embeddings.aembed_query(query)
+                        cached_answer = self._lookup_cached_answer(query_embedding)
+                if cached_answer is not None:
+                    QUERIES_TOTAL.inc(outcome="cached")
+                    return cached_answer["answer"], True
+
+                # Retrieve relevant documents using the document retriever
+                with QUERY_STAGE_SECONDS.time(stage="retrieve"):
+                    search_results = await self.retriever.aretrieve_search_results(query)
+
+                # If no documents are found, return a no-results message
+                if not search_results:
+                    QUERIES_TOTAL.inc(outcome="no_documents")
+                    return "No relevant documents found.", False
+
+                # Keep only the best candidates, then pack them into the context token budget
+                with QUERY_STAGE_SECONDS.time(stage="rerank"):
+                    search_results = await self.reranker.arerank(query, search_results, query_embedding)
+                packed_context = self._pack_context(search_results)
+                search_results = packed_context["results"]
+                messages = self._build_prompt_messages(query, packed_context["context"])
+
+                # Get the response from AzureChatOpenAI without blocking the event loop
+                with QUERY_STAGE_SECONDS.time(stage="llm"):
+                    get_llm_response = await self.llm.ainvoke(messages)
+                self._record_token_usage(get_llm_response)
+
+                response_content = get_llm_response.content
+                self._store_cached_answer(query_embedding, response_content, search_results, cache_generation)
+                QUERIES_TOTAL.inc(outcome="answered")
+                return response_content, False
+            except Exception:
+                QUERIES_TOTAL.inc(outcome="error")
+                raise
+
+    async def astream_chat_query_response(self, query: str, on_cached=None) -> AsyncIterator[tuple]:
+        """
+        Streams the response to a user query. The metadata of the retrieved context is emitted
+        first, then the answer tokens as Azure OpenAI produces them.
+
+        Concurrent identical queries (after normalization) share a single retrieval and a single
+        generation: a query joining a stream in flight first receives the events already sent,
+        then follows the stream live.
+        
+        Parameters:
+        ----------
+        query : str
+            The user's input question to be answered.
+        on_cached : callable
+            Called once when the query does not call the model itself: it joins an identical
+            stream in flight, or its answer comes from the semantic answer cache.
+        
+        Yields:
+        ------
+        tuple
+            `(event, data)` pairs: one `("context", {"documents": [...], "context_tokens": int})` event
+            with the number, citation, score, source, page and chunk id of each packed chunk and the context size,
+            then `("token", str)` events, then `("done", {})`.
+        """
+        joined = False
+
+        def on_coalesced():
+            nonlocal joined
+            joined = True
+            if on_cached is not None:
+                on_cached()
+
+        # Streams are keyed apart from the answers of `aget_chat_query_response`
+        stream_key = ("stream", self.normalize_query(query))
+        async for event, data in self.single_flight.stream(stream_key, self._astream_answer, query, on_coalesced=on_coalesced):
+            if event == "cached":
+                if not joined and on_cached is not None:
+                    on_cached()
+                continue
+            yield event, data
+
+    async def _astream_answer(self, query: str) -> AsyncIterator[tuple]:
+        """
+        Produces the events of `astream_chat_query_response`, preceded by a `("cached", {})` event
+        when the answer comes from the semantic answer cache.
+
+        The "llm" stage of a streamed query lasts until its last token.
+        
+        Parameters:
+        ----------
+        query : str
+            The user's input question to be answered.
+        
+        Yields:
+        ------
+        tuple
+            `(event, data)` pairs.
+        """
+        with QUERY_STAGE_SECONDS.time(stage="total"):
+            try:
+                # A cached answer is replayed as a single token after its original context metadata
+                query_embedding = cached_answer = cache_generation = None
+                if self.answer_cache is not None:
+                    cache_generation = self.answer_cache.generation
+                    with QUERY_STAGE_SECONDS.time(stage="cache_lookup"):
+                        query_embedding = await self.embeddings.aembed_query(query)
+                        cached_answer = self._lookup_cached_answer(query_embedding)
+                if cached_answer is not None:
+                    QUERIES_TOTAL.inc(outcome="cached")
+                    yield "cached", {}
+                    yield "context", {"documents": cached_answer["documents"]}
+                    yield "token", cached_answer["answer"]
+                    yield "done", {}
+                    return
+
+                # Retrieve relevant documents using the document retriever
+                with QUERY_STAGE_SECONDS.time(stage="retrieve"):
+                    search_results = await self.retriever.aretrieve_search_results(query)
+
+                # Keep only the best candidates, then pack them into the context token budget
+                with QUERY_STAGE_SECONDS.time(stage="rerank"):
+                    search_results = await self.reranker.arerank(query, search_results, query_embedding)
+                packed_context = self._pack_context(search_results)
+                search_results = packed_context["results"]
+
+                # Send the context metadata before the first token so clients can render sources early
+                yield "context", {
+                    "documents": self._describe_search_results(search_results),
+                    "context_tokens": packed_context["tokens_used"]
+                }
+
+                # If no documents are found, return a no-results message
+                if not search_results:
+                    QUERIES_TOTAL.inc(outcome="no_documents")
+                    yield "token", "No relevant documents found."
+                    yield "done", {}
+                    return
+
+                messages = self._build_prompt_messages(query, packed_context["context"])
+
+                # Forward the completion chunk by chunk as the model produces it
+                answer_tokens = []
+                with QUERY_STAGE_SECONDS.time(stage="llm"):
+                    async for chunk in self.llm.astream(messages):
+                        if chunk.content:
+                            answer_tokens.append(chunk.content)
+                            yield "token", chunk.content
+                self._record_streamed_token_usage(messages, "".join(answer_tokens))
+
+                self._store_cached_answer(query_embedding, "".join(answer_tokens), search_results, cache_generation)
+                QUERIES_TOTAL.inc(outcome="answered")
+                yield "done", {}
+            except Exception:
+                QUERIES_TOTAL.inc(outcome="error")
+                raise
+
+    async def aget_batch_chat_query_responses(self, queries: list, concurrency: int = None, admit=None, on_cached=None) -> list:
+        """
+        Answers a batch of queries. Repeated queries (after normalization) are answered once, and
+        at most `concurrency` queries run retrieval and generation at the same time, which keeps
+        the batch within the Azure OpenAI rate limits.
+        
+        Parameters:
+        ----------
+        queries : list of str
+            The user's questions.
+        concurrency : int
+            Maximum number of queries in flight, by default BATCH_QUERY_CONCURRENCY; capped at
+            BATCH_QUERY_MAX_CONCURRENCY.
+        admit : callable
+            Optional admission control: called with each distinct query, it returns the async
+            context manager held while the query runs, and raises to reject the query.
+        on_cached : callable
+            Called for each query that does not call the model itself (see `aget_chat_query_response`).
+        
+        Returns:
+        -------
+        list
+            One dictionary per input query, in input order, with the "query" and either its
+            "response" or the "error" that prevented answering it. Queries rejected by admission
+            control also carry the rejection's "status_code" and "retry_after".
+        """
+        concurrency = min(concurrency or self.batch_concurrency, self.batch_max_concurrency)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def answer(query: str) -> dict:
+            async with semaphore:
+                try:
+                    if admit is None:
+                        return {"response": await self.aget_chat_query_response(query, on_cached)}
+                    async with admit(query):
+                        return {"response": await self.aget_chat_query_response(query, on_cached)}
+                except Exception as e:
+                    print(f"Batch query failed: {e}")
+                    if hasattr(e, "retry_after"):
+                        return {"error": str(e), "status_code": e.status_code, "retry_after": e.retry_after}
+                    return {"error": str(e)}
+
+        # Fan out one task per distinct query and map the answers back to every occurrence
+        unique_queries = {}
+        for query in queries:
+            unique_queries.setdefault(self.normalize_query(query), query)
+        answers = await asyncio.gather(*(answer(query) for query in unique_queries.values()))
+        answers_by_key = dict(zip(unique_queries, answers))
+
+        return [{"query": query, **answers_by_key[self.normalize_query(query)]} for query in queries]
+
+    async def aclose(self):
+        """
+        Closes the pooled HTTP clients of the language model and the document retriever.
+        """
+        self.http_client.close()
+        await self.http_async_client.aclose()
+        await self.retriever.aclose()
+
+    def close(self):
+        """
+        Blocking variant of `aclose` for scripts using `get_chat_query_response`. The clients are
+        closed on the event loop they were used on.
+        """
+        loop = self._sync_loop or asyncio.new_event_loop()
+        self._sync_loop = None
+        try:
+            loop.run_until_complete(self.aclose())
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.run_until_complete(loop.shutdown_default_executor())
+        finally:
+            loop.close()
 
 
 # Example usage
@@ -140,7 +609,10 @@ if __name__ == "__main__":
     content_generation_object = QueryResponseGenerator()
 
     # Query to retrieve documents and generate a response
-    response = content_generation_object.get_chat_query_response("When does the AppleCare Protection Plan's coverage for defects begin?")
+    try:
+        response = content_generation_object.get_chat_query_response("When does the AppleCare Protection Plan's coverage for defects begin?")
+    finally:
+        content_generation_object.close()
     
     # Output the response
     print("Response is:\n", response)
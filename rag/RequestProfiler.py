@@ -0,0 +1,430 @@
+import os
+import sys
+import json
+import time
+import uuid
+import hmac
+import asyncio
+import weakref
+import threading
+import tracemalloc
+import contextvars
+
+# The profiling session of the request running in the current context, if any
+_active_session = contextvars.ContextVar("profiling_session", default=None)
+
+# Root directory of the application, used to shorten file names in the profiles
+_ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _frame_label(frame) -> str:
+    """
+    Labels a stack frame as "function (file:line of the definition)", so that samples of the same
+    function aggregate in the flamegraph.
+    """
+    code = frame.f_code
+    filename = code.co_filename
+    if filename.startswith(_ROOT_DIR):
+        filename = os.path.relpath(filename, _ROOT_DIR)
+    else:
+        filename = "/".join(filename.replace("\\", "/").split("/")[-2:])
+    return f"{code.co_qualname if hasattr(code, 'co_qualname') else code.co_name} ({filename}:{code.co_firstlineno})"
+
+class ProfileSession:
+    """
+    The profile of a single request: sampled stacks and allocation deltas.
+
+    Attributes:
+    ----------
+    profile_id : str
+        Identifies the profile; returned in the `X-Profile-Id` response header.
+    stacks : dict
+        Number of samples of each collapsed stack ("root;...;leaf").
+    tasks : weakref.WeakSet
+        The asyncio tasks of the request: the task serving it and the tasks it created. Tasks are
+        added on the event loop and read by the sampler thread, both under `tasks_lock`.
+    """
+
+    def __init__(self, method: str, path: str, loop: asyncio.AbstractEventLoop):
+        self.profile_id = uuid.uuid4().hex
+        self.method = method
+        self.path = path
+        self.loop = loop
+        self.loop_thread_id = threading.get_ident()
+        self.root_task = asyncio.current_task()
+        self.tasks = weakref.WeakSet([self.root_task])
+        self.tasks_lock = threading.Lock()
+        self.stacks = {}
+        self.cpu_samples = 0
+        self.await_samples = 0
+        self.started_at = time.time()
+        self.duration = None
+        self.allocations = []
+        self.peak_traced_bytes = None
+        self.stopped = threading.Event()
+
+        # Set by RequestProfiler.start
+        self.context_token = None
+        self.previous_task_factory = None
+        self.started_tracemalloc = False
+        self.snapshot = None
+        self.sampler = None
+        self.ready = None
+        self.started = None
+
+    def add_task(self, task: asyncio.Task):
+        """
+        Adds a task created by the request.
+        """
+        with self.tasks_lock:
+            self.tasks.add(task)
+
+    def task_snapshot(self) -> list:
+        """
+        Returns the tasks of the request, copied so the sampler never iterates the set while the
+        event loop adds to it.
+        """
+        with self.tasks_lock:
+            return list(self.tasks)
+
+    def add_sample(self, stack: list):
+        """
+        Counts one sample of a stack, given root first.
+        """
+        collapsed = ";".join(stack)
+        self.stacks[collapsed] = self.stacks.get(collapsed, 0) + 1
+
+    def collapsed(self) -> str:
+        """
+        Returns the profile in the collapsed stack format read by flamegraph.pl, speedscope and
+        inferno: one "frame;frame;frame count" line per distinct stack.
+        """
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items()))
+
+    def summary(self) -> dict:
+        """
+        Returns the metadata and allocation deltas of the profile.
+        """
+        return {
+            "profile_id": self.profile_id,
+            "method": self.method,
+            "path": self.path,
+            "started_at": self.started_at,
+            "duration": self.duration,
+            "cpu_samples": self.cpu_samples,
+            "await_samples": self.await_samples,
+            "peak_traced_bytes": self.peak_traced_bytes,
+            "allocations": self.allocations,
+        }
+
+class RequestProfiler:
+    """
+    Opt-in profiler of individual requests, for finding where the time of one slow query goes.
+
+    While a request is profiled, a background thread samples the event loop every `interval`
+    seconds. When one of the request's tasks is running, the sample is the actual Python stack
+    ("[cpu]"): the query pipeline, the retriever, and the response serialization. Otherwise the
+    request is waiting, and the sample is the await chain of each of its pending tasks ("[await]"),
+    which shows the call waiting on Azure Search or Azure OpenAI. tracemalloc records the
+    allocations made during the request; they include those of requests running concurrently.
+
+    Only one request is profiled at a time. Profiles are written to `profile_dir` as
+    `<id>.collapsed` (flamegraph-ready) and `<id>.json` (duration and allocation deltas). Requests
+    that are not profiled pay nothing beyond the header check of `RequestProfilingMiddleware`.
+
+    Attributes:
+    ----------
+    interval : float
+        Seconds between samples.
+    profile_dir : str
+        Directory where profiles are stored.
+    max_profiles : int
+        Number of profiles kept; the oldest are deleted.
+    armed : int
+        Number of upcoming chatbot requests to profile without the header (see `arm`).
+    """
+
+    def __init__(self, token: str):
+        """
+        Initializes the profiler.
+
+        It reads the following environment variables:
+        - PROFILE_SAMPLE_INTERVAL: Seconds between samples (0.005).
+        - PROFILE_DIR: Directory of the stored profiles ("profiles").
+        - PROFILE_MAX_FILES: Number of profiles kept (100).
+        - PROFILE_TOP_ALLOCATIONS: Allocation sites reported per profile (25).
+
+        Args:
+            token (str): Secret that a request must send in the `X-Profile-Token` header to be profiled.
+        """
+        self._token = token.encode("utf-8")
+        self.interval = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+        self.profile_dir = os.getenv("PROFILE_DIR", "profiles")
+        self.max_profiles = int(os.getenv("PROFILE_MAX_FILES", "100"))
+        self.top_allocations = int(os.getenv("PROFILE_TOP_ALLOCATIONS", "25"))
+        self.armed = 0
+        self.armed_path_prefix = "/legal-bot"
+        self._session = None
+
+    def is_authorized(self, token: str) -> bool:
+        """
+        Tells whether a token matches the profiling secret.
+        """
+        return token is not None and hmac.compare_digest(token.encode("utf-8"), self._token)
+
+    def arm(self, requests: int, path_prefix: str = "/legal-bot"):
+        """
+        Profiles the next `requests` requests whose path starts with `path_prefix`, as if they had
+        sent the header.
+        """
+        self.armed = max(0, requests)
+        self.armed_path_prefix = path_prefix
+
+    def should_profile(self, path: str, token: str) -> bool:
+        """
+        Tells whether a request must be profiled, consuming an armed request if it is. Requests
+        to the profiling endpoints themselves are never profiled.
+        """
+        if path.startswith(("/profiling", "/profiles/")):
+            return False
+        if token is not None:
+            return self.is_authorized(token)
+        if self.armed and path.startswith(self.armed_path_prefix):
+            self.armed -= 1
+            return True
+        return False
+
+    def _task_factory(self, session: ProfileSession, previous_factory):
+        """
+        Returns a task factory adding the tasks created by the profiled request to its session.
+        """
+        def create_task(loop, coro, context=None):
+            keyword_arguments = {} if context is None else {"context": context}
+            if previous_factory is None:
+                task = asyncio.Task(coro, loop=loop, **keyword_arguments)
+            else:
+                task = previous_factory(loop, coro, **keyword_arguments)
+            # Tasks inherit the context of their creator, so the request's tasks carry its session
+            if (context.get(_active_session) if context is not None else _active_session.get()) is session:
+                session.add_task(task)
+            return task
+        return create_task
+
+    @staticmethod
+    def _await_stack(task: asyncio.Task) -> list:
+        """
+        Returns the chain of coroutines a suspended task is awaiting, outermost first.
+        """
+        stack = []
+        awaitable = task.get_coro()
+        while awaitable is not None:
+            frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "gi_frame", None) or getattr(awaitable, "ag_frame", None)
+            if frame is None:
+                # A future, or an object that cannot be inspected, such as the step of an async generator
+                stack.append(f"<{type(awaitable).__name__}>")
+                break
+            stack.append(_frame_label(frame))
+            awaitable = getattr(awaitable, "cr_await", None) or getattr(awaitable, "gi_yieldfrom", None) or getattr(awaitable, "ag_await", None)
+        return stack
+
+    @staticmethod
+    def _thread_stack(frame) -> list:
+        """
+        Returns the stack of a running thread, outermost first, without the event loop frames
+        below the running task.
+        """
+        stack = []
+        while frame is not None:
+            if frame.f_code.co_name == "_run" and frame.f_code.co_filename.endswith(os.path.join("asyncio", "events.py")):
+                break
+            stack.append(_frame_label(frame))
+            frame = frame.f_back
+        stack.reverse()
+        return stack
+
+    def _sample(self, session: ProfileSession):
+        """
+        Samples the event loop thread until the session stops. Runs in a background thread, which
+        also takes the allocation snapshot of the start of the request, so tracemalloc never runs
+        on the event loop; the loop is told when it is taken.
+        """
+        session.started_tracemalloc = not tracemalloc.is_tracing()
+        if session.started_tracemalloc:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        session.snapshot = tracemalloc.take_snapshot()
+        session.loop.call_soon_threadsafe(self._set_ready, session)
+
+        while not session.stopped.wait(self.interval):
+            # Tasks of the request that have not finished. all_tasks copies the tasks of the loop,
+            # retrying if the loop changes them meanwhile, so it can be called from this thread
+            loop_tasks = asyncio.all_tasks(session.loop)
+            pending_tasks = [task for task in session.task_snapshot() if task in loop_tasks]
+
+            # A task is running if its coroutine frame is on the stack of the event loop thread
+            top_frame = frame = sys._current_frames().get(session.loop_thread_id)
+            running_frames = set()
+            while frame is not None:
+                running_frames.add(frame)
+                frame = frame.f_back
+            if any(getattr(task.get_coro(), "cr_frame", None) in running_frames for task in pending_tasks):
+                session.add_sample(["[cpu]"] + self._thread_stack(top_frame))
+                session.cpu_samples += 1
+                continue
+
+            # The request is waiting: record what each of its pending tasks is awaiting
+            if len(pending_tasks) > 1:
+                # The serving task only waits for the tasks it started
+                pending_tasks = [task for task in pending_tasks if task is not session.root_task] or pending_tasks
+            for task in pending_tasks:
+                session.add_sample(["[await]"] + self._await_stack(task))
+            session.await_samples += 1
+
+    @staticmethod
+    def _set_ready(session: ProfileSession):
+        """
+        Marks the session as started. Called on the event loop by the sampler thread.
+        """
+        if not session.ready.done():
+            session.ready.set_result(None)
+
+    async def start(self, method: str, path: str) -> ProfileSession:
+        """
+        Starts profiling the request served by the current task, once the sampler thread has
+        taken the initial allocation snapshot.
+
+        Returns:
+        -------
+        ProfileSession
+            The session, or None if another request is being profiled.
+        """
+        if self._session is not None:
+            return None
+        loop = asyncio.get_running_loop()
+        session = self._session = ProfileSession(method, path, loop)
+        session.context_token = _active_session.set(session)
+        session.previous_task_factory = loop.get_task_factory()
+        loop.set_task_factory(self._task_factory(session, session.previous_task_factory))
+
+        session.ready = loop.create_future()
+        session.sampler = threading.Thread(target=self._sample, args=(session,), name="request-profiler", daemon=True)
+        session.sampler.start()
+        await session.ready
+        session.started = time.perf_counter()
+        return session
+
+    async def stop(self, session: ProfileSession):
+        """
+        Stops profiling a request and stores its profile. The allocation comparison and the files
+        are handled in a worker thread.
+        """
+        session.duration = time.perf_counter() - session.started
+        session.stopped.set()
+        session.loop.set_task_factory(session.previous_task_factory)
+        _active_session.reset(session.context_token)
+        try:
+            await asyncio.to_thread(self._finish, session)
+        finally:
+            self._session = None
+
+    def _finish(self, session: ProfileSession):
+        """
+        Waits for the sampler, computes the allocation deltas of a request and stores its profile.
+        Runs in a worker thread.
+        """
+        session.sampler.join()
+
+        # Allocation sites whose memory grew the most during the request
+        snapshot = tracemalloc.take_snapshot()
+        session.peak_traced_bytes = tracemalloc.get_traced_memory()[1]
+        if session.started_tracemalloc:
+            tracemalloc.stop()
+        ignored = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+        differences = snapshot.filter_traces(ignored).compare_to(session.snapshot.filter_traces(ignored), "lineno")
+        session.allocations = [
+            {"location": str(difference.traceback), "size_diff": difference.size_diff, "count_diff": difference.count_diff}
+            for difference in differences[:self.top_allocations] if difference.size_diff
+        ]
+        session.snapshot = None
+
+        try:
+            self._store(session)
+        except OSError as e:
+            print(f"Could not store profile {session.profile_id}: {e}")
+
+    def _store(self, session: ProfileSession):
+        """
+        Writes a profile to the profile directory and deletes the oldest profiles.
+        """
+        os.makedirs(self.profile_dir, exist_ok=True)
+        with open(os.path.join(self.profile_dir, f"{session.profile_id}.collapsed"), "w") as profile_file:
+            profile_file.write(session.collapsed())
+        with open(os.path.join(self.profile_dir, f"{session.profile_id}.json"), "w") as summary_file:
+            json.dump(session.summary(), summary_file, indent=2)
+
+        summaries = sorted(
+            (entry for entry in os.scandir(self.profile_dir) if entry.name.endswith(".json")),
+            key=lambda entry: entry.stat().st_mtime
+        )
+        for entry in summaries[:max(0, len(summaries) - self.max_profiles)]:
+            for extension in (".json", ".collapsed"):
+                path = os.path.join(self.profile_dir, entry.name[:-len(".json")] + extension)
+                if os.path.exists(path):
+                    os.remove(path)
+        print(f"Stored profile {session.profile_id} of {session.method} {session.path} ({session.duration:.3f}s)")
+
+    def load(self, profile_id: str, extension: str) -> str:
+        """
+        Reads a stored profile.
+
+        Args:
+            profile_id (str): The id returned in the `X-Profile-Id` header.
+            extension (str): "collapsed" for the stacks, "json" for the summary.
+
+        Returns:
+            str: The content of the profile, or None if it does not exist.
+        """
+        if not profile_id.isalnum():
+            return None
+        path = os.path.join(self.profile_dir, f"{profile_id}.{extension}")
+        if not os.path.exists(path):
+            return None
+        with open(path) as profile_file:
+            return profile_file.read()
+
+class RequestProfilingMiddleware:
+    """
+    ASGI middleware profiling the requests that send a valid `X-Profile-Token` header, or that
+    were armed through `RequestProfiler.arm`. The profile id is returned in the `X-Profile-Id`
+    response header. Other requests go straight to the application.
+    """
+
+    def __init__(self, app, profiler: RequestProfiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        token = None
+        for name, value in scope["headers"]:
+            if name == b"x-profile-token":
+                token = value.decode("latin-1")
+                break
+        if (token is None and not self.profiler.armed) or not self.profiler.should_profile(scope["path"], token):
+            return await self.app(scope, receive, send)
+
+        session = await self.profiler.start(scope["method"], scope["path"])
+        if session is None:
+            # Another request is being profiled
+            return await self.app(scope, receive, send)
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": list(message.get("headers", [])) + [(b"x-profile-id", session.profile_id.encode("ascii"))]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            await self.profiler.stop(session)
@@ -0,0 +1,201 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+
+class SemanticAnswerCache:
+    """
+    In-memory cache of chatbot answers keyed on the normalized embedding of the query.
+
+    A lookup compares the query embedding with every cached embedding in a single vectorized
+    cosine-similarity product and returns the best entry if its similarity reaches the threshold,
+    so paraphrases of a cached question are answered without calling Azure Search or GPT.
+    Entries expire after a TTL, the least recently used entry is evicted when the cache is full,
+    and entries are invalidated when one of the documents that fed their answer is re-ingested.
+
+    An answer computed while a document was being re-ingested may already be stale when it is
+    stored. Callers read `generation` before their lookup and pass it to `store`, which drops the
+    answer if the cache was invalidated or cleared in between.
+
+    Attributes:
+    ----------
+    similarity_threshold : float
+        Minimum cosine similarity for a cached entry to be returned.
+    ttl_seconds : float
+        Lifetime of an entry after it was stored.
+    max_entries : int
+        Maximum number of cached entries; 0 disables caching.
+    generation : int
+        Incremented on every invalidation and clear.
+    hits : int
+        Number of lookups answered from the cache.
+    misses : int
+        Number of lookups not answered from the cache.
+    """
+
+    def __init__(self, similarity_threshold: float = None, ttl_seconds: float = None, max_entries: int = None):
+        """
+        Initializes an empty cache. Unset parameters are read from the SEMANTIC_CACHE_THRESHOLD,
+        SEMANTIC_CACHE_TTL and SEMANTIC_CACHE_MAX_ENTRIES environment variables.
+        """
+        if similarity_threshold is None:
+            similarity_threshold = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+        if ttl_seconds is None:
+            ttl_seconds = float(os.getenv("SEMANTIC_CACHE_TTL", "3600"))
+        if max_entries is None:
+            max_entries = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "1000"))
+
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """
+        Removes every entry from the cache.
+        """
+        with self._lock:
+            self.generation += 1
+            # Embedding matrix is allocated on the first store, once the dimension is known
+            self._embeddings = None
+            self._expires_at = np.full(self.max_entries, -np.inf)
+            self._values = [None] * self.max_entries
+            self._sources = [frozenset()] * self.max_entries
+            self._slots_by_source = {}  # source -> slots whose answer used that source
+            self._lru_slots = OrderedDict()  # occupied slots, least recently used first
+            self._free_slots = list(range(self.max_entries - 1, -1, -1))
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        """
+        Converts an embedding to a unit-length float32 vector.
+        """
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _release_slot(self, slot: int):
+        """
+        Empties a slot and removes it from the source and LRU bookkeeping. Caller holds the lock.
+        """
+        for source in self._sources[slot]:
+            slots = self._slots_by_source.get(source)
+            if slots is not None:
+                slots.discard(slot)
+                if not slots:
+                    del self._slots_by_source[source]
+        self._expires_at[slot] = -np.inf
+        self._values[slot] = None
+        self._sources[slot] = frozenset()
+        self._lru_slots.pop(slot, None)
+        self._free_slots.append(slot)
+
+    def lookup(self, embedding):
+        """
+        Finds the cached value of the most similar query.
+
+        Parameters:
+        ----------
+        embedding : list of float
+            The embedding of the incoming query.
+
+        Returns:
+        -------
+        dict or None
+            The cached value if a live entry reaches the similarity threshold, None otherwise.
+        """
+        query_vector = self._normalize(embedding)
+        now = time.monotonic()
+
+        with self._lock:
+            if self._embeddings is None or not self._lru_slots:
+                self.misses += 1
+                return None
+
+            # Cosine similarity against every slot at once; empty and expired slots never match
+            similarities = self._embeddings @ query_vector
+            similarities[self._expires_at <= now] = -np.inf
+            best_slot = int(np.argmax(similarities))
+
+            if similarities[best_slot] < self.similarity_threshold:
+                self.misses += 1
+                return None
+
+            self._lru_slots.move_to_end(best_slot)
+            self.hits += 1
+            return self._values[best_slot]
+
+    def store(self, embedding, value: dict, sources, generation: int = None):
+        """
+        Caches the value computed for a query, unless the cache was invalidated since `generation`.
+
+        Parameters:
+        ----------
+        embedding : list of float
+            The embedding of the query.
+        value : dict
+            The value to return for similar queries.
+        sources : iterable of str
+            The documents whose content was used to compute the value.
+        generation : int
+            The `generation` read before the value was computed, or None to store unconditionally.
+
+        Returns:
+        -------
+        bool
+            True if the value was stored.
+        """
+        if self.max_entries <= 0:
+            return False
+        query_vector = self._normalize(embedding)
+        now = time.monotonic()
+
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                # A document was re-ingested, or the configuration changed, while the value was computed
+                return False
+
+            if self._embeddings is None or self._embeddings.shape[1] != query_vector.shape[0]:
+                self._embeddings = np.zeros((self.max_entries, query_vector.shape[0]), dtype=np.float32)
+
+            if not self._free_slots:
+                # Drop expired entries first, then fall back to the least recently used one
+                expired_slots = [slot for slot in self._lru_slots if self._expires_at[slot] <= now]
+                for slot in expired_slots or [next(iter(self._lru_slots))]:
+                    self._release_slot(slot)
+
+            slot = self._free_slots.pop()
+            self._embeddings[slot] = query_vector
+            self._expires_at[slot] = now + self.ttl_seconds
+            self._values[slot] = value
+            self._sources[slot] = frozenset(source for source in sources if source)
+            for source in self._sources[slot]:
+                self._slots_by_source.setdefault(source, set()).add(slot)
+            self._lru_slots[slot] = None
+            return True
+
+    def invalidate_source(self, source: str) -> int:
+        """
+        Removes every entry whose value was computed from the given document.
+
+        Parameters:
+        ----------
+        source : str
+            The name of the re-ingested document.
+
+        Returns:
+        -------
+        int
+            The number of invalidated entries.
+        """
+        with self._lock:
+            self.generation += 1
+            slots = list(self._slots_by_source.get(source, ()))
+            for slot in slots:
+                self._release_slot(slot)
+            return len(slots)
@@ -0,0 +1,140 @@
+import asyncio
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key into a single execution.
+
+    The first caller for a key starts the work; callers arriving while it is in flight await the
+    same task and receive its result (or its exception). Once the task finishes the key is released,
+    so later calls start fresh work. The shared task is shielded: a caller that is cancelled (for
+    example because its client disconnected) does not cancel the work for the others.
+
+    Streams are coalesced the same way by `stream`: a single task iterates the async generator,
+    and every caller receives all of its items, including those produced before it joined.
+
+    Attributes:
+    ----------
+    calls : int
+        Number of calls that started new work.
+    coalesced : int
+        Number of calls that joined work already in flight.
+    """
+
+    def __init__(self):
+        """
+        Initializes the group with no call in flight.
+        """
+        self._in_flight = {}  # key -> asyncio.Task
+        self._in_flight_streams = {}  # key -> {"items": list, "changed": asyncio.Event, "task": asyncio.Task}
+        self.calls = 0
+        self.coalesced = 0
+
+    def _release(self, key, task: asyncio.Task):
+        """
+        Forgets a finished task, unless the key already points to newer work.
+        """
+        # Mark the exception as observed in case every caller was cancelled before it was raised
+        if not task.cancelled():
+            task.exception()
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+
+    async def do(self, key, function, *args, on_coalesced=None):
+        """
+        Runs `function(*args)` once for all concurrent callers with the same key.
+
+        Parameters:
+        ----------
+        key : hashable
+            Identifies equivalent calls.
+        function : coroutine function
+            The work to run.
+        *args
+            Arguments of the work.
+        on_coalesced : callable
+            Called when this caller joins work already in flight instead of starting it.
+
+        Returns:
+        -------
+        object
+            The result of the shared execution.
+        """
+        task = self._in_flight.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(function(*args))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda finished_task: self._release(key, finished_task))
+        else:
+            self.coalesced += 1
+            if on_coalesced is not None:
+                on_coalesced()
+        return await asyncio.shield(task)
+
+    @staticmethod
+    async def _produce(flight: dict, generator):
+        """
+        Iterates a shared stream, recording its items and waking the callers after each one.
+        """
+        try:
+            async for item in generator:
+                flight["items"].append(item)
+                flight["changed"].set()
+                flight["changed"] = asyncio.Event()
+        finally:
+            flight["changed"].set()
+
+    def _release_stream(self, key, flight: dict):
+        """
+        Forgets a finished stream, unless the key already points to a newer one.
+        """
+        if not flight["task"].cancelled():
+            flight["task"].exception()
+        if self._in_flight_streams.get(key) is flight:
+            del self._in_flight_streams[key]
+
+    async def stream(self, key, function, *args, on_coalesced=None):
+        """
+        Iterates the async generator `function(*args)` once for all concurrent callers with the same key.
+
+        Parameters:
+        ----------
+        key : hashable
+            Identifies equivalent calls.
+        function : async generator function
+            The stream to produce.
+        *args
+            Arguments of the stream.
+        on_coalesced : callable
+            Called when this caller joins a stream already in flight instead of starting it.
+
+        Yields:
+        ------
+        object
+            Every item of the shared stream, from the first one. The exception of the stream, if
+            any, is raised after its last item.
+        """
+        flight = self._in_flight_streams.get(key)
+        if flight is None:
+            self.calls += 1
+            flight = {"items": [], "changed": asyncio.Event(), "task": None}
+            flight["task"] = asyncio.ensure_future(self._produce(flight, function(*args)))
+            self._in_flight_streams[key] = flight
+            flight["task"].add_done_callback(lambda finished_task: self._release_stream(key, flight))
+        else:
+            self.coalesced += 1
+            if on_coalesced is not None:
+                on_coalesced()
+
+        position = 0
+        while True:
+            if position < len(flight["items"]):
+                position += 1
+                yield flight["items"][position - 1]
+            elif flight["task"].done():
+                # Re-raises the exception of the stream, if any
+                flight["task"].result()
+                return
+            else:
+                # Waiting on the event, not the task, so a cancelled caller leaves the stream running
+                await flight["changed"].wait()
@@ -0,0 +1,24 @@
+import os
+import sys
+import pytest
+
+# The modules are imported as `rag.<Module>` from the repository root, like api.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class FakeClock:
+    """
+    Stands in for the `time` module of the code under test, so time only moves when the test says.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+@pytest.fixture
+def fake_clock():
+    """
+    A FakeClock, to be patched over the `time` module of the module under test.
+    """
+    return FakeClock()
@@ -0,0 +1,116 @@
+import threading
+import httpx
+import pytest
+from openai import APIConnectionError, RateLimitError
+from rag.AdaptiveEmbedder import AdaptiveEmbedder
+
+def rate_limit_error(**headers) -> RateLimitError:
+    request = httpx.Request("POST", "https://example.openai.azure.com/embeddings")
+    return RateLimitError("Too Many Requests", response=httpx.Response(429, headers=headers, request=request), body=None)
+
+class FakeEmbeddings:
+    """
+    Stands in for AzureOpenAIEmbeddings: embeds each text as [len(text)], after raising the
+    queued errors one request at a time.
+    """
+
+    def __init__(self, errors: list = ()):
+        self.errors = list(errors)
+        self.batches = []
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts, chunk_size=None):
+        with self._lock:
+            self.batches.append(list(texts))
+            if self.errors:
+                raise self.errors.pop(0)
+        return [[float(len(text))] for text in texts]
+
+@pytest.fixture
+def make_embedder(monkeypatch):
+    embedders = []
+
+    def make(embeddings, **environment):
+        settings = {
+            "EMBEDDING_CONCURRENCY": "4",
+            "EMBEDDING_MAX_CONCURRENCY": "8",
+            "EMBEDDING_BATCH_TOKENS": "100",
+            "EMBEDDING_BATCH_MAX_TOKENS": "400",
+            "EMBEDDING_BATCH_MAX_INPUTS": "256",
+            "EMBEDDING_MAX_RETRIES": "2",
+        }
+        settings.update(environment)
+        for name, value in settings.items():
+            monkeypatch.setenv(name, value)
+        embedder = AdaptiveEmbedder(embeddings)
+        embedders.append(embedder)
+        return embedder
+
+    yield make
+    for embedder in embedders:
+        embedder.close()
+
+def test_texts_are_embedded_in_order_in_token_bounded_batches(make_embedder):
+    embeddings = FakeEmbeddings()
+    embedder = make_embedder(embeddings, EMBEDDING_BATCH_TOKENS="30", EMBEDDING_CONCURRENCY="1", EMBEDDING_MAX_CONCURRENCY="1")
+    texts = ["x" * 39 for _ in range(5)]  # 10 estimated tokens each
+
+    assert embedder.embed(texts) == [[39.0]] * 5
+    # One request at a time: the second batch is cut after the first grew the budget from 30 to 38 tokens
+    assert [len(batch) for batch in embeddings.batches] == [3, 2]
+
+def test_batch_holds_at_least_one_text(make_embedder):
+    embeddings = FakeEmbeddings()
+    assert make_embedder(embeddings, EMBEDDING_BATCH_TOKENS="1").embed(["x" * 400]) == [[400.0]]
+
+def test_throttled_requests_of_one_round_halve_the_limits_once(make_embedder):
+    embedder = make_embedder(FakeEmbeddings(), EMBEDDING_CONCURRENCY="8")
+    for _ in range(3):
+        embedder._on_throttled(epoch=0)
+    assert (embedder.concurrency, embedder.batch_tokens, embedder.throttled) == (4, 50, 3)
+
+    # A request sent after the decrease halves them again
+    embedder._on_throttled(epoch=1)
+    assert (embedder.concurrency, embedder.batch_tokens) == (2, 25)
+
+def test_latency_adjusts_the_limits(make_embedder):
+    embedder = make_embedder(FakeEmbeddings(), EMBEDDING_TARGET_LATENCY="1")
+    embedder._on_success(latency=2)
+    assert (embedder.concurrency, embedder.batch_tokens) == (3, 80)
+    embedder._on_success(latency=0.1)
+    assert (embedder.concurrency, embedder.batch_tokens) == (4, 101)
+
+def test_retry_delay_follows_retry_after(make_embedder):
+    assert AdaptiveEmbedder._retry_delay(rate_limit_error(**{"retry-after-ms": "1500"}), attempt=0) == 1.5
+    assert AdaptiveEmbedder._retry_delay(rate_limit_error(**{"retry-after": "2"}), attempt=0) == 2.0
+    # Without a usable header the delay backs off exponentially, up to 30s
+    assert AdaptiveEmbedder._retry_delay(rate_limit_error(**{"retry-after": "soon"}), attempt=2) == 2.0
+    assert AdaptiveEmbedder._retry_delay(RuntimeError(), attempt=10) == 30.0
+
+def test_throttled_batch_is_retried_after_backing_off(make_embedder):
+    embeddings = FakeEmbeddings([rate_limit_error(**{"retry-after-ms": "10"})])
+    embedder = make_embedder(embeddings, EMBEDDING_CONCURRENCY="1")
+
+    assert embedder.embed(["ab", "abc"]) == [[2.0], [3.0]]
+    assert embeddings.batches == [["ab", "abc"], ["ab", "abc"]]
+    assert (embedder.requests, embedder.throttled) == (2, 1)
+    # Halved by the 429, then raised by the successful retry
+    assert embedder.concurrency == 2
+
+def test_transient_errors_are_retried_without_lowering_the_limits(make_embedder):
+    request = httpx.Request("POST", "https://example.openai.azure.com/embeddings")
+    embeddings = FakeEmbeddings([APIConnectionError(request=request)])
+    embedder = make_embedder(embeddings, EMBEDDING_CONCURRENCY="1")
+    embedder._retry_delay = lambda error, attempt: 0.0
+
+    assert embedder.embed(["ab"]) == [[2.0]]
+    assert (embedder.requests, embedder.throttled, embedder.concurrency) == (2, 0, 2)
+
+def test_error_is_raised_once_retries_are_exhausted(make_embedder):
+    embeddings = FakeEmbeddings([rate_limit_error(**{"retry-after-ms": "1"}) for _ in range(3)])
+    embedder = make_embedder(embeddings, EMBEDDING_MAX_RETRIES="2")
+
+    with pytest.raises(RateLimitError):
+        embedder.embed(["ab"])
+    assert len(embeddings.batches) == 3
+    assert embedder._in_flight == 0
@@ -0,0 +1,165 @@
+import asyncio
+import pytest
+import rag.AdmissionController as admission
+from rag.AdmissionController import AdmissionController, AdmissionRejected, TokenBucket
+
+@pytest.fixture
+def clock(monkeypatch, fake_clock):
+    monkeypatch.setattr(admission, "time", fake_clock)
+    return fake_clock
+
+@pytest.fixture
+def make_controller(monkeypatch):
+    """
+    Builds a controller from environment overrides, with 1000-token buckets refilled at 100 tokens/s.
+    """
+    def make(**environment):
+        settings = {
+            "ADMISSION_GLOBAL_TOKENS_PER_MINUTE": "60000",
+            "ADMISSION_USER_TOKENS_PER_MINUTE": "6000",
+            "ADMISSION_BURST_SECONDS": "10",
+            "ADMISSION_MAX_CONCURRENT": "8",
+            "ADMISSION_QUEUE_SIZE": "8",
+            "ADMISSION_QUEUE_TIMEOUT": "30",
+            "ADMISSION_COMPLETION_TOKENS": "100",
+            "CONTEXT_TOKEN_BUDGET": "300",
+        }
+        settings.update(environment)
+        for name, value in settings.items():
+            monkeypatch.setenv(name, value)
+        return AdmissionController()
+    return make
+
+def rejection(controller: AdmissionController, user: str, cost: float) -> AdmissionRejected:
+    with pytest.raises(AdmissionRejected) as raised:
+        asyncio.run(controller.acquire(user, cost))
+    return raised.value
+
+def test_token_bucket_refills_up_to_its_capacity():
+    bucket = TokenBucket(rate=10, capacity=100, now=0)
+    bucket.tokens = 0
+    assert bucket.time_until(50, now=2) == pytest.approx(3.0)
+    assert bucket.tokens == pytest.approx(20)
+    assert bucket.time_until(50, now=60) == 0
+    assert bucket.tokens == 100
+
+def test_token_bucket_without_rate_never_refills():
+    bucket = TokenBucket(rate=0, capacity=10, now=0)
+    assert bucket.time_until(10, now=5) == 0
+    bucket.tokens = 0
+    assert bucket.time_until(1, now=5) == float("inf")
+
+def test_estimate_cost_counts_the_question_context_and_completion(make_controller):
+    controller = make_controller()
+    assert controller.estimate_cost("x" * 40) == 11 + 300 + 100
+
+def test_query_larger_than_a_bucket_is_rejected_with_413(make_controller, clock):
+    controller = make_controller()
+    assert rejection(controller, "alice", 1001).status_code == 413
+    assert controller.rejected == 1
+
+def test_user_over_their_rate_is_rejected_with_429_while_others_are_admitted(make_controller, clock):
+    controller = make_controller(ADMISSION_QUEUE_TIMEOUT="5")
+    asyncio.run(controller.acquire("alice", 1000))()
+
+    rejected = rejection(controller, "alice", 1000)
+    assert rejected.status_code == 429
+    assert rejected.retry_after == pytest.approx(10.0)
+
+    asyncio.run(controller.acquire("bob", 1000))()
+    assert controller.admitted == 2
+
+def test_user_bucket_refills_with_time(make_controller, clock):
+    controller = make_controller(ADMISSION_QUEUE_TIMEOUT="5", ADMISSION_GLOBAL_TOKENS_PER_MINUTE="600000")
+    asyncio.run(controller.acquire("alice", 1000))()
+    clock.now += 10
+    asyncio.run(controller.acquire("alice", 1000))()
+    assert controller.admitted == 2
+
+def test_refund_cached_returns_the_context_and_completion_tokens(make_controller, clock):
+    controller = make_controller(ADMISSION_QUEUE_TIMEOUT="1")
+    asyncio.run(controller.acquire("alice", 1000))()
+    controller.refund_cached("alice")
+    assert controller._user_buckets["alice"].tokens == pytest.approx(400)
+    assert controller._global_bucket.tokens == pytest.approx(9400)
+
+def test_release_is_idempotent(make_controller):
+    controller = make_controller()
+
+    async def scenario():
+        release = await controller.acquire("alice", 10)
+        release()
+        release()
+        return controller._running
+
+    assert asyncio.run(scenario()) == 0
+
+def test_waiting_query_is_admitted_when_a_slot_frees(make_controller):
+    controller = make_controller(ADMISSION_MAX_CONCURRENT="1")
+
+    async def scenario():
+        release = await controller.acquire("alice", 10)
+        waiting = asyncio.ensure_future(controller.acquire("bob", 10))
+        await asyncio.sleep(0.01)
+        assert not waiting.done()
+        release()
+        (await asyncio.wait_for(waiting, 1))()
+
+    asyncio.run(scenario())
+    assert controller.admitted == 2
+    assert controller._running == 0
+
+def test_full_queue_is_rejected_with_503(make_controller):
+    controller = make_controller(ADMISSION_MAX_CONCURRENT="1", ADMISSION_QUEUE_SIZE="1")
+
+    async def scenario():
+        release = await controller.acquire("alice", 10)
+        waiting = asyncio.ensure_future(controller.acquire("bob", 10))
+        await asyncio.sleep(0.01)
+        with pytest.raises(AdmissionRejected) as raised:
+            await controller.acquire("carol", 10)
+        release()
+        (await waiting)()
+        return raised.value
+
+    assert asyncio.run(scenario()).status_code == 503
+
+def test_query_waiting_past_its_deadline_is_rejected_with_503(make_controller):
+    controller = make_controller(ADMISSION_MAX_CONCURRENT="1", ADMISSION_QUEUE_TIMEOUT="0.05")
+
+    async def scenario():
+        await controller.acquire("alice", 10)
+        with pytest.raises(AdmissionRejected) as raised:
+            await controller.acquire("bob", 10)
+        return raised.value
+
+    assert asyncio.run(scenario()).status_code == 503
+    assert not controller._waiters
+
+def test_user_waiting_for_their_bucket_does_not_block_other_users(make_controller):
+    controller = make_controller()
+
+    async def scenario():
+        (await controller.acquire("alice", 1000))()
+        # Alice's bucket needs 10s to refill, well within the queue timeout
+        alice = asyncio.ensure_future(controller.acquire("alice", 1000))
+        await asyncio.sleep(0.01)
+        (await asyncio.wait_for(controller.acquire("bob", 1000), 1))()
+        assert not alice.done()
+        alice.cancel()
+        await asyncio.gather(alice, return_exceptions=True)
+
+    asyncio.run(scenario())
+    assert controller.admitted == 2
+
+def test_admit_releases_the_slot_when_the_block_fails(make_controller):
+    controller = make_controller()
+
+    async def scenario():
+        with pytest.raises(RuntimeError):
+            async with controller.admit("alice", "what is the notice period?"):
+                assert controller._running == 1
+                raise RuntimeError("generation failed")
+        return controller._running
+
+    assert asyncio.run(scenario()) == 0
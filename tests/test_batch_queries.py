@@ -0,0 +1,105 @@
+import asyncio
+from contextlib import asynccontextmanager
+import pytest
+from pydantic import ValidationError
+from models.BatchChatQueryModel import BATCH_QUERY_MAX_SIZE, BatchChatQueryModel
+from rag.AdmissionController import AdmissionRejected
+from rag.QueryResponseGenerator import QueryResponseGenerator
+
+class FakeAnswers:
+    """
+    Stands in for `aget_chat_query_response`, recording the calls and the peak concurrency.
+    """
+
+    def __init__(self, failing: str = None, cached: str = None):
+        self.failing = failing
+        self.cached = cached
+        self.queries = []
+        self.running = 0
+        self.peak = 0
+
+    async def __call__(self, query: str, on_cached=None) -> str:
+        self.queries.append(query)
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        try:
+            await asyncio.sleep(0.01)
+            if query == self.failing:
+                raise RuntimeError("model call failed")
+            if query == self.cached and on_cached is not None:
+                on_cached()
+            return f"answer to {query}"
+        finally:
+            self.running -= 1
+
+def make_generator(answers: FakeAnswers, batch_concurrency: int = 8, batch_max_concurrency: int = 16) -> QueryResponseGenerator:
+    """
+    Builds a generator without its Azure clients, answering through `answers`.
+    """
+    generator = QueryResponseGenerator.__new__(QueryResponseGenerator)
+    generator.batch_concurrency = batch_concurrency
+    generator.batch_max_concurrency = batch_max_concurrency
+    generator.aget_chat_query_response = answers
+    return generator
+
+def test_repeated_queries_are_answered_once_in_input_order():
+    answers = FakeAnswers()
+    queries = ["Notice period?", "deposit?", "  notice   PERIOD? "]
+    results = asyncio.run(make_generator(answers).aget_batch_chat_query_responses(queries))
+
+    assert answers.queries == ["Notice period?", "deposit?"]
+    assert results == [
+        {"query": "Notice period?", "response": "answer to Notice period?"},
+        {"query": "deposit?", "response": "answer to deposit?"},
+        {"query": "  notice   PERIOD? ", "response": "answer to Notice period?"},
+    ]
+
+def test_concurrency_is_bounded_by_the_request_and_the_server():
+    queries = [f"question {i}" for i in range(12)]
+
+    answers = FakeAnswers()
+    asyncio.run(make_generator(answers).aget_batch_chat_query_responses(queries, concurrency=3))
+    assert answers.peak == 3
+
+    answers = FakeAnswers()
+    asyncio.run(make_generator(answers, batch_max_concurrency=4).aget_batch_chat_query_responses(queries, concurrency=10))
+    assert answers.peak == 4
+
+    answers = FakeAnswers()
+    asyncio.run(make_generator(answers, batch_concurrency=2).aget_batch_chat_query_responses(queries))
+    assert answers.peak == 2
+
+def test_a_failed_query_does_not_fail_the_batch():
+    answers = FakeAnswers(failing="deposit?")
+    results = asyncio.run(make_generator(answers).aget_batch_chat_query_responses(["notice?", "deposit?"]))
+    assert results == [
+        {"query": "notice?", "response": "answer to notice?"},
+        {"query": "deposit?", "error": "model call failed"},
+    ]
+
+def test_each_distinct_query_is_admitted_and_rejections_are_reported():
+    admitted = []
+    cached = []
+
+    @asynccontextmanager
+    async def admit(query):
+        if query == "deposit?":
+            raise AdmissionRejected(429, "Rate limit exceeded, retry later", 12.0)
+        admitted.append(query)
+        yield
+
+    answers = FakeAnswers(cached="notice?")
+    results = asyncio.run(make_generator(answers).aget_batch_chat_query_responses(
+        ["notice?", "deposit?", "NOTICE?"], admit=admit, on_cached=lambda: cached.append(True)
+    ))
+
+    assert admitted == ["notice?"]
+    assert cached == [True]
+    assert results[1] == {"query": "deposit?", "error": "Rate limit exceeded, retry later", "status_code": 429, "retry_after": 12.0}
+    assert results[2] == {"query": "NOTICE?", "response": "answer to notice?"}
+
+def test_batch_model_validates_its_size_and_concurrency():
+    assert BatchChatQueryModel(queries=["notice?"], concurrency=2).concurrency == 2
+    for invalid in ({"queries": []}, {"queries": ["q"] * (BATCH_QUERY_MAX_SIZE + 1)}, {"queries": ["q"], "concurrency": 0}):
+        with pytest.raises(ValidationError):
+            BatchChatQueryModel(**invalid)
@@ -0,0 +1,88 @@
+import asyncio
+import pytest
+from rag.ChunkReranker import ChunkReranker
+
+QUERY = "termination notice"
+
+# Ordered as the retriever returned them
+CHUNKS = [
+    {"content": "the landlord repairs the roof", "source": "lease.pdf"},
+    {"content": "termination notice termination notice boilerplate heading", "source": "lease.pdf"},
+    {"content": "either party may end the lease with thirty days written warning", "source": "lease.pdf"},
+]
+
+class FakeEmbeddings:
+    """
+    Stands in for AzureOpenAIEmbeddings: fixed vectors per text, recording what was embedded.
+    """
+
+    VECTORS = {
+        QUERY: [1.0, 0.0, 0.0],
+        CHUNKS[0]["content"]: [0.0, 0.0, 1.0],
+        CHUNKS[1]["content"]: [0.3, 1.0, 0.0],
+        CHUNKS[2]["content"]: [0.9, 0.1, 0.0],
+    }
+
+    def __init__(self):
+        self.embedded = []
+
+    def embed_query(self, text):
+        return self.VECTORS[text]
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return [self.VECTORS[text] for text in texts]
+
+    async def aembed_query(self, text):
+        return self.embed_query(text)
+
+    async def aembed_documents(self, texts):
+        return self.embed_documents(texts)
+
+def positions(results: list) -> list:
+    """
+    Returns the retriever position of each re-ranked chunk.
+    """
+    return [[chunk["content"] for chunk in CHUNKS].index(result["content"]) for result in results]
+
+def test_disabled_reranker_keeps_the_retriever_order():
+    reranker = ChunkReranker(mode="none", top_n=1)
+    assert reranker.rerank(QUERY, CHUNKS) is CHUNKS
+
+def test_bm25_ranks_keyword_matches_first():
+    results = ChunkReranker(mode="bm25", top_n=2).rerank(QUERY, CHUNKS)
+    # Only the second chunk contains the query terms; the others tie at 0 and keep their order
+    assert positions(results) == [1, 0]
+    assert results[0]["rerank_score"] > 0 == results[1]["rerank_score"]
+
+def test_embedding_ranks_semantic_matches_first():
+    reranker = ChunkReranker(mode="embedding", top_n=2, embeddings=FakeEmbeddings())
+    results = reranker.rerank(QUERY, CHUNKS)
+    assert positions(results) == [2, 1]
+    assert results[0]["rerank_score"] == pytest.approx(0.9 / (0.9 ** 2 + 0.1 ** 2) ** 0.5)
+
+def test_async_rerank_matches_rerank():
+    reranker = ChunkReranker(mode="embedding", top_n=3, embeddings=FakeEmbeddings())
+    assert asyncio.run(reranker.arerank(QUERY, CHUNKS)) == reranker.rerank(QUERY, CHUNKS)
+
+def test_chunk_embeddings_are_reused():
+    embeddings = FakeEmbeddings()
+    reranker = ChunkReranker(mode="embedding", top_n=2, embeddings=embeddings)
+    reranker.rerank(QUERY, CHUNKS[:2])
+    reranker.rerank(QUERY, CHUNKS)
+    # Embeddings returned by the retriever are used as they are
+    reranker.rerank(QUERY, [dict(CHUNKS[0], content="not cached", embedding=[1.0, 0.0, 0.0])])
+    assert embeddings.embedded == [CHUNKS[0]["content"], CHUNKS[1]["content"], CHUNKS[2]["content"]]
+
+def test_embedding_cache_is_bounded():
+    embeddings = FakeEmbeddings()
+    reranker = ChunkReranker(mode="embedding", top_n=3, embeddings=embeddings, embedding_cache_size=2)
+    reranker.rerank(QUERY, CHUNKS)
+    reranker.rerank(QUERY, CHUNKS[:1])
+    # The first chunk was the least recently used of the three, so it was evicted
+    assert embeddings.embedded == [CHUNKS[0]["content"], CHUNKS[1]["content"], CHUNKS[2]["content"], CHUNKS[0]["content"]]
+
+def test_embedding_mode_without_client_falls_back_to_bm25():
+    assert ChunkReranker(mode="embedding", top_n=2).mode == "bm25"
+    with pytest.raises(ValueError):
+        ChunkReranker(mode="cross-encoder")
@@ -0,0 +1,80 @@
+import re
+import pytest
+import rag.ContextPacker as context_packer
+from rag.ContextPacker import ContextPacker
+
+class WordEncoding:
+    """
+    Offline stand-in for a tiktoken encoding: one token per word, and one per line break.
+    """
+
+    def encode(self, text: str) -> list:
+        return re.findall(r"[^\s]+|\n", text)
+
+    def decode(self, tokens: list) -> str:
+        return " ".join(tokens)
+
+@pytest.fixture
+def make_packer(monkeypatch):
+    monkeypatch.setattr(context_packer.tiktoken, "get_encoding", lambda encoding_name: WordEncoding())
+
+    def make(token_budget: int = 100, duplicate_threshold: float = 0.8) -> ContextPacker:
+        return ContextPacker(token_budget=token_budget, duplicate_threshold=duplicate_threshold)
+    return make
+
+def chunk(text: str, source: str = "lease.pdf", page: int = 0) -> dict:
+    return {"content": text, "source": source, "page": page}
+
+def words(count: int, prefix: str = "word") -> str:
+    return " ".join(f"{prefix}{i}" for i in range(count))
+
+def test_chunks_are_numbered_and_cited_in_relevance_order(make_packer):
+    packer = make_packer()
+    results = [chunk("rent is due monthly", page=2), chunk("the deposit is returned", source="annex.pdf", page=None)]
+    packed = packer.pack(results)
+
+    assert packed["context"] == "[1] lease.pdf, page 3\nrent is due monthly\n[2] annex.pdf\nthe deposit is returned"
+    assert packed["results"] == results
+    # Headers (5 and 3 tokens), contents (4 each) and one separator
+    assert packed["tokens_used"] == 5 + 4 + 1 + 3 + 4 == packer.count_tokens(packed["context"])
+
+def test_near_duplicates_are_dropped(make_packer):
+    packer = make_packer()
+    text = words(20)
+    results = [chunk(text), chunk(text, page=1), chunk(words(10)), chunk(words(20, prefix="other"))]
+    packed = packer.pack(results)
+
+    # An identical chunk and one contained in a packed chunk are dropped
+    assert packed["results"] == [results[0], results[3]]
+    assert packed["dropped_duplicates"] == 2
+
+def test_partial_overlap_below_the_threshold_is_kept(make_packer):
+    packer = make_packer(token_budget=200)
+    first = words(20)
+    second = " ".join(first.split()[10:] + words(10, prefix="new").split())
+    assert len(packer.pack([chunk(first), chunk(second)])["results"]) == 2
+
+def test_chunks_over_budget_are_skipped_and_smaller_ones_still_packed(make_packer):
+    packer = make_packer(token_budget=30)
+    results = [chunk(words(10, "a")), chunk(words(20, "b")), chunk(words(5, "c"))]
+    packed = packer.pack(results)
+
+    assert packed["results"] == [results[0], results[2]]
+    assert packed["dropped_over_budget"] == 1
+    assert packed["tokens_used"] <= 30
+
+def test_most_relevant_chunk_is_truncated_to_the_budget(make_packer):
+    packer = make_packer(token_budget=15)
+    packed = packer.pack([chunk(words(50)), chunk(words(2, "next"))])
+
+    assert packed["context"] == "[1] lease.pdf, page 1\n" + words(10)
+    assert packed["tokens_used"] == 15
+    assert packed["dropped_over_budget"] == 1
+
+def test_empty_chunks_are_ignored(make_packer):
+    packed = make_packer().pack([chunk(""), chunk("notice period")])
+    assert packed["context"] == "[1] lease.pdf, page 1\nnotice period"
+    assert packed["dropped_duplicates"] == packed["dropped_over_budget"] == 0
+
+def test_nothing_to_pack(make_packer):
+    assert make_packer().pack([]) == {"context": "", "results": [], "tokens_used": 0, "dropped_duplicates": 0, "dropped_over_budget": 0}
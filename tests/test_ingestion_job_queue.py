@@ -0,0 +1,169 @@
+import threading
+import time
+import pytest
+from rag.IngestionJobQueue import IngestionJobQueue
+
+def wait_until(predicate, timeout: float = 2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "condition not reached in time"
+        time.sleep(0.005)
+
+class FakeIngestor:
+    """
+    Stands in for DataIngestor: runs the stages given per blob through `run_stage`, and records
+    how many ingestions of each blob run at once.
+    """
+
+    def __init__(self, stages: dict = None):
+        self.stages = stages or {}
+        self.running = {}
+        self.peak = {}
+        self.ingested = []
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def ingest_data(self, blob_name, progress=None, run_stage=None, raise_errors=False):
+        with self._lock:
+            self.running[blob_name] = self.running.get(blob_name, 0) + 1
+            self.peak[blob_name] = max(self.peak.get(blob_name, 0), self.running[blob_name])
+        try:
+            progress(stage="download")
+            for stage, function in self.stages.get(blob_name, []):
+                run_stage(stage, function)
+            progress(pages=2, chunks=5)
+            self.ingested.append(blob_name)
+            return []
+        finally:
+            with self._lock:
+                self.running[blob_name] -= 1
+
+    def close(self):
+        self.closed = True
+
+def failing(times: int):
+    """
+    Returns a stage function raising its first `times` calls.
+    """
+    calls = []
+
+    def stage():
+        calls.append(None)
+        if len(calls) <= times:
+            raise RuntimeError(f"failure {len(calls)}")
+    return stage
+
+@pytest.fixture
+def make_queue(monkeypatch):
+    queues = []
+
+    def make(ingestor, workers: int = 2, on_complete=None, **environment):
+        settings = {"INGEST_WORKERS": str(workers), "INGEST_STAGE_RETRIES": "2", "INGEST_RETRY_BACKOFF": "0"}
+        settings.update(environment)
+        for name, value in settings.items():
+            monkeypatch.setenv(name, value)
+        job_queue = IngestionJobQueue(lambda: ingestor, on_complete)
+        job_queue.start()
+        queues.append(job_queue)
+        return job_queue
+
+    yield make
+    for job_queue in queues:
+        job_queue.stop(timeout=2)
+
+def test_job_runs_and_reports_its_progress(make_queue):
+    completed = []
+    job_queue = make_queue(FakeIngestor(), on_complete=completed.append)
+    job = job_queue.submit("lease.pdf")
+    wait_until(lambda: job.status == "succeeded")
+
+    snapshot = job_queue.get(job.job_id).to_dict()
+    assert snapshot["stage"] == "download"
+    assert snapshot["progress"]["pages"] == 2 and snapshot["progress"]["chunks"] == 5
+    assert completed == ["lease.pdf"]
+
+def test_failed_stage_is_retried(make_queue):
+    job_queue = make_queue(FakeIngestor({"lease.pdf": [("download", failing(2))]}))
+    job = job_queue.submit("lease.pdf")
+    wait_until(lambda: job.finished_at is not None)
+    assert job.status == "succeeded"
+    assert job.attempts == {"download": 3}
+
+def test_job_fails_once_retries_are_exhausted(make_queue):
+    job_queue = make_queue(FakeIngestor({"lease.pdf": [("index", failing(3))]}))
+    job = job_queue.submit("lease.pdf")
+    wait_until(lambda: job.finished_at is not None)
+    assert (job.status, job.error, job.attempts) == ("failed", "failure 3", {"index": 3})
+
+def test_embed_stage_is_not_retried(make_queue):
+    job_queue = make_queue(FakeIngestor({"lease.pdf": [("embed", failing(1))]}))
+    job = job_queue.submit("lease.pdf")
+    wait_until(lambda: job.finished_at is not None)
+    assert (job.status, job.attempts) == ("failed", {"embed": 1})
+
+def test_queued_blob_is_not_queued_twice(make_queue):
+    release = threading.Event()
+    job_queue = make_queue(FakeIngestor({"first.pdf": [("download", release.wait)]}), workers=1)
+    job_queue.submit("first.pdf")
+    job = job_queue.submit("lease.pdf")
+    assert job_queue.submit("lease.pdf") is job
+    release.set()
+    wait_until(lambda: job.status == "succeeded")
+
+def test_ingestions_of_one_blob_do_not_overlap(make_queue):
+    release = threading.Event()
+    ingestor = FakeIngestor({"lease.pdf": [("download", release.wait)]})
+    job_queue = make_queue(ingestor, workers=3)
+    first = job_queue.submit("lease.pdf")
+    wait_until(lambda: first.status == "running")
+
+    # A new upload while the blob is being ingested gets its own job, which waits for the first
+    second = job_queue.submit("lease.pdf")
+    other = job_queue.submit("other.pdf")
+    wait_until(lambda: other.status == "succeeded")
+    assert second.status == "queued"
+
+    release.set()
+    wait_until(lambda: second.status == "succeeded")
+    assert ingestor.peak["lease.pdf"] == 1
+    assert ingestor.ingested == ["other.pdf", "lease.pdf", "lease.pdf"]
+
+def test_stop_gives_up_on_running_jobs_after_the_timeout(make_queue):
+    release = threading.Event()
+    ingestor = FakeIngestor({"lease.pdf": [("download", release.wait)]})
+    job_queue = make_queue(ingestor, workers=2)
+    job = job_queue.submit("lease.pdf")
+    wait_until(lambda: job.status == "running")
+
+    started_at = time.monotonic()
+    assert job_queue.stop(timeout=0.2) is False
+    assert time.monotonic() - started_at < 1
+    # The ingestor is still used by the running job
+    assert not ingestor.closed
+    release.set()
+
+def test_stop_closes_the_ingestor_once_workers_are_done(make_queue):
+    ingestor = FakeIngestor()
+    job_queue = make_queue(ingestor)
+    job = job_queue.submit("lease.pdf")
+    wait_until(lambda: job.status == "succeeded")
+    assert job_queue.stop(timeout=2) is True
+    assert ingestor.closed
+
+def test_ingestor_configuration_error_fails_the_job(make_queue, monkeypatch):
+    def broken_factory():
+        raise ValueError("Missing AZURE_BLOB_CONTAINER")
+
+    job_queue = make_queue(FakeIngestor())
+    monkeypatch.setattr(job_queue, "_ingestor_factory", broken_factory)
+    job = job_queue.submit("lease.pdf")
+    wait_until(lambda: job.finished_at is not None)
+    assert (job.status, job.error) == ("failed", "Missing AZURE_BLOB_CONTAINER")
+
+def test_history_keeps_the_most_recent_finished_jobs(make_queue):
+    job_queue = make_queue(FakeIngestor(), workers=1, INGEST_JOB_HISTORY="2")
+    jobs = []
+    for name in ("a.pdf", "b.pdf", "c.pdf"):
+        jobs.append(job_queue.submit(name))
+        wait_until(lambda: jobs[-1].status == "succeeded")
+    assert [job_queue.get(job.job_id) for job in jobs] == [None, jobs[1], jobs[2]]
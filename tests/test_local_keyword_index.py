@@ -0,0 +1,120 @@
+import json
+import math
+import pytest
+from rag.LocalKeywordIndex import LocalKeywordIndex
+
+TEXTS = [
+    "the tenant pays the rent monthly",
+    "rent is due on the first day and rent increases yearly",
+    "the landlord repairs the roof",
+    "section 4.2.1 covers the deposit",
+    "the deposit is returned after the lease ends",
+    "termination requires written notice",
+]
+
+def make_records(texts: list, start: int = 0) -> list:
+    return [{"id": f"chunk-{i}", "content": text} for i, text in enumerate(texts, start=start)]
+
+def scores(results: list) -> dict:
+    return {result["id"]: result["score"] for result in results}
+
+def read_manifest(index: LocalKeywordIndex) -> dict:
+    with open(index._path(index.MANIFEST_FILE)) as manifest_file:
+        return json.load(manifest_file)
+
+def bm25(query: str, texts: list, k1: float = 1.2, b: float = 0.75) -> dict:
+    """
+    Reference BM25 scores of the texts that contain a query term, keyed like `make_records`.
+    """
+    documents = [LocalKeywordIndex.tokenize(text) for text in texts]
+    average_length = sum(map(len, documents)) / len(documents)
+    results = {}
+    for i, tokens in enumerate(documents):
+        score = 0.0
+        for term in dict.fromkeys(LocalKeywordIndex.tokenize(query)):
+            frequency = tokens.count(term)
+            if frequency:
+                document_frequency = sum(term in document for document in documents)
+                idf = math.log1p((len(documents) - document_frequency + 0.5) / (document_frequency + 0.5))
+                score += idf * frequency * (k1 + 1) / (frequency + k1 * (1 - b + b * len(tokens) / average_length))
+        if score:
+            results[f"chunk-{i}"] = score
+    return results
+
+@pytest.fixture
+def index(tmp_path):
+    return LocalKeywordIndex(str(tmp_path / "keywords"), merge_factor=8, max_deleted_ratio=0.5)
+
+def test_tokenize_keeps_clause_numbers():
+    assert LocalKeywordIndex.tokenize("See Section 4.2.1, then 5.") == ["see", "section", "4.2.1", "then", "5"]
+
+def test_search_matches_reference_bm25(index):
+    index.add(make_records(TEXTS))
+    results = index.search("rent deposit", top_k=10)
+
+    expected = bm25("rent deposit", TEXTS)
+    assert scores(results) == pytest.approx(expected, rel=1e-5)
+    assert [result["id"] for result in results] == sorted(expected, key=expected.get, reverse=True)
+    assert results[0]["content"] == TEXTS[1]
+
+def test_search_finds_clause_numbers(index):
+    index.add(make_records(TEXTS))
+    assert [result["id"] for result in index.search("4.2.1", top_k=3)] == ["chunk-3"]
+
+def test_scores_do_not_depend_on_the_segments(index, tmp_path):
+    for start in range(0, len(TEXTS), 2):
+        index.add(make_records(TEXTS[start:start + 2], start=start))
+    assert len(read_manifest(index)["segments"]) == 3
+
+    single = LocalKeywordIndex(str(tmp_path / "single"))
+    single.add(make_records(TEXTS))
+    assert scores(index.search("the rent deposit", top_k=10)) == pytest.approx(scores(single.search("the rent deposit", top_k=10)))
+
+def test_full_tier_is_merged_into_one_segment(tmp_path):
+    index = LocalKeywordIndex(str(tmp_path / "keywords"), merge_factor=2)
+    for i, text in enumerate(TEXTS[:4]):
+        index.add(make_records([text], start=i))
+
+    # Two single-document segments merge into one of 2, and two of those into one of 4
+    assert read_manifest(index)["segments"] == ["segment_000006"]
+    assert index.count == 4
+    assert sorted(path.name for path in (tmp_path / "keywords").iterdir() if path.is_dir()) == ["segment_000006"]
+    assert scores(index.search("rent", top_k=10)) == pytest.approx(bm25("rent", TEXTS[:4]))
+
+def test_deleted_documents_are_hidden_and_leave_the_statistics(index, tmp_path):
+    index.add(make_records(TEXTS))
+    index.delete(["chunk-0"])
+
+    assert index.count == len(TEXTS) - 1
+    results = index.search("rent", top_k=10)
+    assert [result["id"] for result in results] == ["chunk-1"]
+
+    remaining = LocalKeywordIndex(str(tmp_path / "remaining"))
+    remaining.add(make_records(TEXTS[1:], start=1))
+    assert scores(results) == pytest.approx(scores(remaining.search("rent", top_k=10)))
+
+def test_deleted_chunk_can_be_added_again(index):
+    index.add(make_records(TEXTS))
+    index.delete(["chunk-2"])
+    assert index.search("roof", top_k=1) == []
+
+    index.add([{"id": "chunk-2", "content": "the landlord repairs the new roof"}])
+    assert [result["content"] for result in index.search("roof", top_k=1)] == ["the landlord repairs the new roof"]
+
+def test_segment_with_many_deletions_is_rewritten(index):
+    index.add(make_records(TEXTS[:3]))
+    index.delete(["chunk-0"])
+    assert read_manifest(index)["segments"] == ["segment_000000"]
+
+    index.delete(["chunk-1"])
+    manifest = read_manifest(index)
+    assert manifest["segments"] == ["segment_000001"]
+    assert manifest["tombstones"] == {}
+    assert index.count == 1
+    assert [result["id"] for result in index.search("landlord rent", top_k=10)] == ["chunk-2"]
+
+def test_a_second_reader_sees_new_segments(index):
+    reader = LocalKeywordIndex(index.index_dir)
+    assert reader.search("rent", top_k=1) == []
+    index.add(make_records(TEXTS))
+    assert reader.search("rent", top_k=1)[0]["id"] == "chunk-1"
@@ -0,0 +1,125 @@
+import numpy as np
+import pytest
+from rag.LocalVectorIndex import LocalVectorIndex
+
+def clustered_embeddings(clusters: int = 4, per_cluster: int = 50, dimension: int = 16, seed: int = 0):
+    """
+    Returns embeddings drawn around `clusters` well separated directions.
+    """
+    rng = np.random.default_rng(seed)
+    centers = np.eye(dimension, dtype=np.float32)[:clusters] * 10
+    return np.concatenate([center + rng.normal(size=(per_cluster, dimension)).astype(np.float32) for center in centers])
+
+def make_records(count: int, start: int = 0) -> list:
+    return [{"id": f"chunk-{i}", "content": f"chunk {i}"} for i in range(start, start + count)]
+
+@pytest.fixture
+def index(tmp_path):
+    return LocalVectorIndex(str(tmp_path / "index"))
+
+def test_add_assigns_consecutive_rows_and_stores_records(index):
+    assert index.add(np.eye(3, 4), make_records(3)) == [0, 1, 2]
+    assert index.add(np.eye(2, 4), make_records(2, start=3)) == [3, 4]
+    assert index.count == 5
+    assert index.get_records([4, 0]) == [{"id": "chunk-4", "content": "chunk 4"}, {"id": "chunk-0", "content": "chunk 0"}]
+
+def test_add_rejects_a_different_dimension(index):
+    index.add(np.eye(2, 4), make_records(2))
+    with pytest.raises(ValueError):
+        index.add(np.eye(2, 5), make_records(2))
+
+def test_exact_search_returns_cosine_similarities_best_first(index):
+    index.add([[1, 0], [0, 1], [1, 1]], make_records(3))
+    results = index.search([2, 0], top_k=2)
+    assert [row for row, _ in results] == [0, 2]
+    assert results[0][1] == pytest.approx(1.0)
+    assert results[1][1] == pytest.approx(np.sqrt(0.5))
+
+def test_deleted_rows_are_not_returned(index):
+    index.add([[1, 0], [0.9, 0.1], [0, 1]], make_records(3))
+    index.delete([0])
+    assert [row for row, _ in index.search([1, 0], top_k=3)] == [1, 2]
+    with pytest.raises(ValueError):
+        index.delete([3])
+
+def test_ivf_search_matches_exact_search_on_clustered_data(index):
+    embeddings = clustered_embeddings()
+    index.add(embeddings, make_records(len(embeddings)))
+    exact = index.search(embeddings[7], top_k=5)
+
+    index.build_ivf(n_lists=4)
+    assert index.search(embeddings[7], top_k=5, nprobe=1) == exact
+    # nprobe covering every list (or None) falls back to the exact search
+    assert index.search(embeddings[7], top_k=5, nprobe=4) == exact
+    assert index.search(embeddings[7], top_k=5) == exact
+
+def test_ivf_search_only_scores_the_probed_lists(index):
+    embeddings = clustered_embeddings()
+    index.add(embeddings, make_records(len(embeddings)))
+    index.build_ivf(n_lists=4)
+
+    # A single-list probe returns the cluster of the query, not the whole index
+    rows = [row for row, _ in index.search(embeddings[0], top_k=200, nprobe=1)]
+    assert set(range(50)) <= set(rows)
+    assert len(rows) < len(embeddings)
+
+def test_rows_added_after_the_partition_are_searched(index):
+    embeddings = clustered_embeddings()
+    index.add(embeddings, make_records(len(embeddings)))
+    index.build_ivf(n_lists=4)
+
+    query = np.zeros(16, dtype=np.float32)
+    query[15] = 1
+    (row,) = index.add([query], make_records(1, start=len(embeddings)))
+    assert index.search(query, top_k=1, nprobe=1)[0][0] == row
+
+def test_ivf_search_skips_deleted_rows(index):
+    embeddings = clustered_embeddings()
+    index.add(embeddings, make_records(len(embeddings)))
+    index.build_ivf(n_lists=4)
+    index.delete([7])
+    assert 7 not in [row for row, _ in index.search(embeddings[7], top_k=10, nprobe=1)]
+
+def ivf_files(tmp_path) -> list:
+    return sorted(path.name for path in (tmp_path / "index").iterdir() if path.name.startswith("ivf_"))
+
+def test_rebuilding_the_partition_keeps_only_the_previous_generation(index, tmp_path):
+    embeddings = clustered_embeddings()
+    index.add(embeddings, make_records(len(embeddings)))
+    index.build_ivf(n_lists=4)
+    index.build_ivf(n_lists=2)
+    assert ivf_files(tmp_path) == [
+        "ivf_centroids.1.f32", "ivf_centroids.2.f32", "ivf_list_offsets.1.i64",
+        "ivf_list_offsets.2.i64", "ivf_rows.1.i32", "ivf_rows.2.i32",
+    ]
+
+    index.build_ivf(n_lists=2)
+    assert ivf_files(tmp_path) == [
+        "ivf_centroids.2.f32", "ivf_centroids.3.f32", "ivf_list_offsets.2.i64",
+        "ivf_list_offsets.3.i64", "ivf_rows.2.i32", "ivf_rows.3.i32",
+    ]
+    assert len(index.search(embeddings[0], top_k=200, nprobe=1)) < len(embeddings)
+
+def test_reader_of_the_previous_manifest_maps_its_partition_after_a_rebuild(index, monkeypatch):
+    embeddings = clustered_embeddings()
+    index.add(embeddings, make_records(len(embeddings)))
+    index.build_ivf(n_lists=4)
+    stale_manifest = index._read_manifest()
+    index.build_ivf(n_lists=2)
+
+    # The reader read the manifest just before the rebuild published the next one
+    reader = LocalVectorIndex(index.index_dir)
+    monkeypatch.setattr(reader, "_read_manifest", lambda: dict(stale_manifest))
+    assert reader.search(embeddings[7], top_k=5, nprobe=1) == LocalVectorIndex(index.index_dir).search(embeddings[7], top_k=5)
+
+def test_a_second_reader_sees_committed_rows(index):
+    index.add([[1, 0]], make_records(1))
+    reader = LocalVectorIndex(index.index_dir)
+    assert reader.count == 1
+    index.add([[0, 1]], make_records(1, start=1))
+    assert [row for row, _ in reader.search([0, 1], top_k=1)] == [1]
+
+def test_get_embeddings_returns_unit_rows(index):
+    index.add([[3, 4], [0, 2]], make_records(2))
+    index.refresh()
+    np.testing.assert_allclose(index.get_embeddings([1, 0]), [[0, 1], [0.6, 0.8]], rtol=1e-6)
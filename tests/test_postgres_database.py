@@ -0,0 +1,57 @@
+import types
+import psycopg2
+import pytest
+from psycopg2 import extensions
+from db.postgres_database import PostgresDatabase
+
+class FakeConnection:
+    def __init__(self, closed: int = 0):
+        self.closed = closed
+        self.last_used = 0.0
+        self.info = types.SimpleNamespace(transaction_status=extensions.TRANSACTION_STATUS_IDLE)
+
+class FakePool:
+    """
+    Stands in for the psycopg2 pool: lends the given connections, then raises the given error.
+    """
+
+    def __init__(self, connections: list, error: Exception = None):
+        self.connections = list(connections)
+        self.error = error
+        self.returned = []
+
+    def getconn(self):
+        if not self.connections:
+            raise self.error
+        return self.connections.pop(0)
+
+    def putconn(self, conn, close: bool = False):
+        if any(returned is conn for returned, _ in self.returned):
+            raise psycopg2.pool.PoolError("trying to put unkeyed connection")
+        self.returned.append((conn, close))
+
+@pytest.fixture
+def database(monkeypatch):
+    monkeypatch.setenv("POSTGRES_POOL_MAX", "1")
+    monkeypatch.setenv("POSTGRES_POOL_TIMEOUT", "0.1")
+    return PostgresDatabase({})
+
+def test_stale_connection_is_replaced(database):
+    stale, fresh = FakeConnection(closed=1), FakeConnection()
+    fresh.last_used = float("inf")
+    database._pool = FakePool([stale, fresh])
+
+    with database.connection() as conn:
+        assert conn is fresh
+    assert [(conn is stale, close) for conn, close in database._pool.returned] == [(True, True), (False, False)]
+
+def test_failed_replacement_raises_the_connection_error(database):
+    stale = FakeConnection(closed=1)
+    database._pool = FakePool([stale], psycopg2.OperationalError("could not connect to server"))
+
+    with pytest.raises(psycopg2.OperationalError, match="could not connect"):
+        with database.connection():
+            pass
+    # The stale connection is returned once, and the slot is freed for the next caller
+    assert database._pool.returned == [(stale, True)]
+    assert database._available.acquire(timeout=0)
@@ -0,0 +1,99 @@
+import pytest
+import rag.SemanticAnswerCache as semantic_answer_cache
+from rag.SemanticAnswerCache import SemanticAnswerCache
+
+@pytest.fixture
+def clock(monkeypatch, fake_clock):
+    monkeypatch.setattr(semantic_answer_cache, "time", fake_clock)
+    return fake_clock
+
+def make_cache(**parameters) -> SemanticAnswerCache:
+    settings = {"similarity_threshold": 0.9, "ttl_seconds": 60, "max_entries": 3}
+    settings.update(parameters)
+    return SemanticAnswerCache(**settings)
+
+def test_lookup_returns_answers_of_similar_queries_only(clock):
+    cache = make_cache()
+    assert cache.store([1, 0, 0], {"answer": "a"}, ["lease.pdf"])
+
+    # Cosine similarity, independent of the embedding length
+    assert cache.lookup([10, 1, 0]) == {"answer": "a"}
+    assert cache.lookup([1, 1, 0]) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_lookup_on_an_empty_cache_misses(clock):
+    cache = make_cache()
+    assert cache.lookup([1, 0]) is None
+    assert cache.misses == 1
+
+def test_lookup_returns_the_most_similar_entry(clock):
+    cache = make_cache(similarity_threshold=0.5)
+    cache.store([1, 0], {"answer": "a"}, [])
+    cache.store([1, 1], {"answer": "b"}, [])
+    assert cache.lookup([1, 0.9]) == {"answer": "b"}
+
+def test_entries_expire_after_the_ttl(clock):
+    cache = make_cache()
+    cache.store([1, 0], {"answer": "a"}, [])
+    clock.now += 59
+    assert cache.lookup([1, 0]) == {"answer": "a"}
+    clock.now += 1
+    assert cache.lookup([1, 0]) is None
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = make_cache()
+    for i in range(3):
+        cache.store([1 if j == i else 0 for j in range(4)], {"answer": i}, [])
+    # Entry 0 is used, so entry 1 is the least recently used
+    assert cache.lookup([1, 0, 0, 0]) == {"answer": 0}
+
+    cache.store([0, 0, 0, 1], {"answer": 3}, [])
+    assert cache.lookup([0, 1, 0, 0]) is None
+    assert [cache.lookup(embedding) for embedding in ([1, 0, 0, 0], [0, 0, 1, 0], [0, 0, 0, 1])] == [{"answer": 0}, {"answer": 2}, {"answer": 3}]
+
+def test_expired_entries_are_evicted_before_live_ones(clock):
+    cache = make_cache(ttl_seconds=10)
+    cache.store([1, 0, 0, 0], {"answer": 0}, [])
+    clock.now += 5
+    cache.store([0, 1, 0, 0], {"answer": 1}, [])
+    cache.store([0, 0, 1, 0], {"answer": 2}, [])
+    cache.lookup([0, 1, 0, 0])
+    cache.lookup([0, 0, 1, 0])
+    clock.now += 6
+
+    cache.store([0, 0, 0, 1], {"answer": 3}, [])
+    assert cache.lookup([0, 1, 0, 0]) == {"answer": 1}
+    assert cache.lookup([0, 0, 1, 0]) == {"answer": 2}
+
+def test_invalidate_source_removes_the_entries_it_fed(clock):
+    cache = make_cache()
+    cache.store([1, 0], {"answer": "a"}, ["lease.pdf", "annex.pdf"])
+    cache.store([0, 1], {"answer": "b"}, ["other.pdf"])
+
+    assert cache.invalidate_source("annex.pdf") == 1
+    assert cache.lookup([1, 0]) is None
+    assert cache.lookup([0, 1]) == {"answer": "b"}
+    assert cache.invalidate_source("lease.pdf") == 0
+
+def test_store_drops_answers_computed_before_an_invalidation(clock):
+    cache = make_cache()
+    generation = cache.generation
+    cache.invalidate_source("lease.pdf")
+    assert not cache.store([1, 0], {"answer": "stale"}, ["lease.pdf"], generation)
+    assert cache.lookup([1, 0]) is None
+
+    assert cache.store([1, 0], {"answer": "fresh"}, ["lease.pdf"], cache.generation)
+    assert cache.lookup([1, 0]) == {"answer": "fresh"}
+
+def test_clear_empties_the_cache_and_advances_the_generation(clock):
+    cache = make_cache()
+    generation = cache.generation
+    cache.store([1, 0], {"answer": "a"}, [])
+    cache.clear()
+    assert cache.generation == generation + 1
+    assert cache.lookup([1, 0]) is None
+
+def test_zero_max_entries_disables_caching(clock):
+    cache = make_cache(max_entries=0)
+    assert not cache.store([1, 0], {"answer": "a"}, [])
+    assert cache.lookup([1, 0]) is None
@@ -0,0 +1,143 @@
+import asyncio
+import pytest
+from rag.SingleFlight import SingleFlight
+
+def test_concurrent_calls_with_one_key_share_one_execution():
+    single_flight = SingleFlight()
+    executions = []
+
+    async def answer(query):
+        executions.append(query)
+        await asyncio.sleep(0.01)
+        return f"answer to {query}"
+
+    async def scenario():
+        return await asyncio.gather(*(single_flight.do("key", answer, "rent") for _ in range(3)))
+
+    assert asyncio.run(scenario()) == ["answer to rent"] * 3
+    assert executions == ["rent"]
+    assert (single_flight.calls, single_flight.coalesced) == (1, 2)
+
+def test_different_keys_and_later_calls_run_separately():
+    single_flight = SingleFlight()
+    executions = []
+
+    async def answer(query):
+        executions.append(query)
+        await asyncio.sleep(0)
+        return query
+
+    async def scenario():
+        await asyncio.gather(single_flight.do("a", answer, "a"), single_flight.do("b", answer, "b"))
+        # The key is released once the work finished
+        await single_flight.do("a", answer, "a")
+
+    asyncio.run(scenario())
+    assert executions == ["a", "b", "a"]
+    assert single_flight.coalesced == 0
+    assert not single_flight._in_flight
+
+def test_every_caller_receives_the_exception():
+    single_flight = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("search failed")
+
+    async def scenario():
+        return await asyncio.gather(*(single_flight.do("key", fail) for _ in range(2)), return_exceptions=True)
+
+    assert [str(error) for error in asyncio.run(scenario())] == ["search failed"] * 2
+
+def test_cancelled_caller_does_not_cancel_the_shared_work():
+    single_flight = SingleFlight()
+
+    async def answer():
+        await asyncio.sleep(0.02)
+        return "answer"
+
+    async def scenario():
+        first = asyncio.ensure_future(single_flight.do("key", answer))
+        second = asyncio.ensure_future(single_flight.do("key", answer))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(scenario()) == "answer"
+
+async def collect(stream) -> list:
+    return [item async for item in stream]
+
+def test_concurrent_streams_share_one_generator():
+    single_flight = SingleFlight()
+    executions = []
+
+    async def tokens(query):
+        executions.append(query)
+        for token in ("the", "rent", "is", "due"):
+            await asyncio.sleep(0.005)
+            yield token
+
+    async def scenario():
+        first = asyncio.ensure_future(collect(single_flight.stream("key", tokens, "rent")))
+        await asyncio.sleep(0.012)
+        # A late caller still receives the items produced before it joined
+        second = asyncio.ensure_future(collect(single_flight.stream("key", tokens, "rent")))
+        return await asyncio.gather(first, second)
+
+    assert asyncio.run(scenario()) == [["the", "rent", "is", "due"]] * 2
+    assert executions == ["rent"]
+    assert (single_flight.calls, single_flight.coalesced) == (1, 1)
+    assert not single_flight._in_flight_streams
+
+def test_stream_exception_is_raised_after_its_items():
+    single_flight = SingleFlight()
+
+    async def tokens():
+        yield "partial"
+        raise ValueError("model failed")
+
+    async def scenario():
+        received = []
+        with pytest.raises(ValueError, match="model failed"):
+            async for item in single_flight.stream("key", tokens):
+                received.append(item)
+        return received
+
+    assert asyncio.run(scenario()) == ["partial"]
+
+def test_cancelled_stream_consumer_leaves_the_stream_running():
+    single_flight = SingleFlight()
+
+    async def tokens():
+        for token in range(5):
+            await asyncio.sleep(0.005)
+            yield token
+
+    async def scenario():
+        first = asyncio.ensure_future(collect(single_flight.stream("key", tokens)))
+        second = asyncio.ensure_future(collect(single_flight.stream("key", tokens)))
+        await asyncio.sleep(0.007)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(scenario()) == [0, 1, 2, 3, 4]
+
+def test_on_coalesced_is_called_for_joining_callers_only():
+    single_flight = SingleFlight()
+    joined = []
+
+    async def answer():
+        await asyncio.sleep(0.01)
+        return "answer"
+
+    async def tokens():
+        await asyncio.sleep(0.01)
+        yield "answer"
+
+    async def scenario():
+        await asyncio.gather(*(single_flight.do("key", answer, on_coalesced=lambda i=i: joined.append(("do", i))) for i in range(3)))
+        await asyncio.gather(*(collect(single_flight.stream("key", tokens, on_coalesced=lambda i=i: joined.append(("stream", i)))) for i in range(2)))
+
+    asyncio.run(scenario())
+    assert joined == [("do", 1), ("do", 2), ("stream", 1)]